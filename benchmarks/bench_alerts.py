@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+Measures alert delivery latency against a local SMTP stand-in.
+
+Usage::
+
+    python benchmarks/bench_alerts.py [recipients] [alerts] [latency ms]
+
+An aiosmtpd server (``pip install aiosmtpd``) is started in a separate
+process. It takes ``latency`` ms to accept each message and drops
+connections idle for more than a second. Alerts to ``recipients``
+recipients are then sent through ``CommProxy.notify`` with gevent
+monkey patching, as in a real run. This is done with a single-connection
+pool and a pool as large as the fan-out. The cold first alert, the warm
+median, and an alert after the server dropped the idle connections are
+reported.
+"""
+from __future__ import absolute_import, unicode_literals
+from __future__ import division, print_function
+
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+
+def serve(latency):
+    """ runs the SMTP stand-in; prints its port then serves forever """
+    import asyncio
+    from aiosmtpd.controller import Controller
+
+    class Handler(object):
+        async def handle_DATA(self, server, session, envelope):  # noqa: N802
+            await asyncio.sleep(latency)
+            return '250 OK'
+
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    controller = Controller(
+        Handler(), hostname='127.0.0.1', port=port,
+        server_kwargs={'timeout': 1},
+    )
+    controller.start()
+    print(port)
+    sys.stdout.flush()
+    while True:
+        time.sleep(3600)
+
+
+class Hotel(object):
+    friendly = 'Bench Hotel'
+    phone = '555-555-5555'
+    link = 'http://localhost/'
+    search = '09/01/2016 - 09/05/2016, 4 guests, 1 room(s)'
+
+
+class Result(object):
+    parent = Hotel()
+    raw = '<html><body>\n{0}</body></html>'.format('<p>rooms</p>\n' * 4000)
+    cookies = {'session': 'bench'}
+
+
+def commconfig(port, recipients, pool_size):
+    lookups = dict(
+        ('r{0}'.format(n), {
+            'first_name': 'R{0}'.format(n),
+            'phone': '555',
+            'email': 'r{0}@example.com'.format(n),
+            'sms': 'r{0}@sms.example.com'.format(n),
+            'mms': 'r{0}@mms.example.com'.format(n),
+            'comment': 'recipient {0}'.format(n),
+        }) for n in range(recipients)
+    )
+    config = {
+        'smtp_login': {
+            'server': '127.0.0.1', 'port': port, 'starttls': False,
+            'sender': 'bench@example.com', 'pool_size': pool_size,
+            'idle_check': 0.5,
+        },
+        'lookups': lookups,
+        'recipients': sorted(lookups),
+    }
+    handle, path = tempfile.mkstemp(suffix='.json')
+    with io.open(handle, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(config))
+    return path
+
+
+def measure(port, recipients, alerts, pool_size):
+    from dragonite.comm import CommProxy
+    from dragonite.conf import settings
+
+    path = commconfig(port, recipients, pool_size)
+    try:
+        comm = CommProxy(config=path, settings=settings)
+    finally:
+        os.remove(path)
+    comm.send_email = True
+    comm.send_sms = True
+
+    def alert():
+        started = timeit.default_timer()
+        with comm as gateway:
+            gateway.notify(Result())
+        return (timeit.default_timer() - started) * 1000
+
+    cold = alert()
+    warm = sorted(alert() for _ in range(alerts))
+    time.sleep(1.5)
+    stale = alert()
+    comm.close()
+    return cold, warm[len(warm) // 2], stale
+
+
+def main(recipients=4, alerts=10, latency=50):
+    import gevent.monkey
+    gevent.monkey.patch_all()
+    from dragonite.conf import settings
+
+    settings.configure(loglevel='error', simple=True, nodb=True)
+    server = subprocess.Popen(
+        [sys.executable, __file__, '--serve', str(latency / 1000.0)],
+        stdout=subprocess.PIPE,
+    )
+    try:
+        port = int(server.stdout.readline())
+        print('{0} recipients, {1} ms per message'.format(
+            recipients, latency
+        ))
+        for pool_size in (1, recipients + 1):
+            cold, warm, stale = measure(port, recipients, alerts, pool_size)
+            print(
+                'pool of {0}: cold {1:7.1f} ms  warm p50 {2:7.1f} ms  '
+                'after idle drop {3:7.1f} ms'.format(
+                    pool_size, cold, warm, stale
+                )
+            )
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        serve(float(sys.argv[2]))
+    elif len(sys.argv) > 1 and not sys.argv[1].isdigit():
+        print(__doc__)
+        sys.exit(1)
+    else:
+        main(*[int(arg) for arg in sys.argv[1:4]])
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+Compares full-document parsing against region-limited parsing.
+
+Usage::
+
+    python benchmarks/bench_dom.py <scraper name> page.html [...] [--url URL]
+
+Each recorded page is evaluated both ways by the named scraper; the
+verdicts must agree and the average time per page is reported. Pages are
+parsed as if they came from the scraper's search URL, or from ``--url``
+(e.g. a passkey maintenance page).
+"""
+from __future__ import absolute_import, unicode_literals
+from __future__ import division, print_function
+
+import datetime
+import io
+import sys
+import timeit
+
+from bs4 import BeautifulSoup
+
+from dragonite.conf import settings
+
+
+def evaluate(scraper, raw, url, full):
+    from dragonite.executor import ParsedResponse
+    from dragonite.scrapers.base import ScrapeResults
+
+    result = ScrapeResults(scraper)
+    result.raw = raw
+    result.response = ParsedResponse(url, [])
+    if full:
+        result.dom = BeautifulSoup(raw, 'lxml')
+    scraper.parse(result)
+    return result
+
+
+def main(name, paths, url=None, repeat=20):
+    settings.configure(loglevel='error', simple=True)
+    from dragonite import scrapers
+
+    event = datetime.date(2016, 9, 2)
+    scraper = dict(
+        (s.name, s) for s in scrapers.get_scrapers(event, event)
+    )[name]
+    url = url or scraper.search_request().url
+
+    for path in paths:
+        with io.open(path, 'r', encoding='utf-8') as page:
+            raw = page.read()
+        verdicts = []
+        timings = []
+        for full in (True, False):
+            verdicts.append(evaluate(scraper, raw, url, full).available)
+            elapsed = timeit.timeit(
+                lambda: evaluate(scraper, raw, url, full), number=repeat
+            )
+            timings.append(elapsed / repeat * 1000)
+        if verdicts[0] != verdicts[1]:
+            raise AssertionError('{0}: verdicts differ {1}'.format(
+                path, verdicts
+            ))
+        report = '{0}: {1} KB  full {2:.2f} ms  regions {3:.2f} ms  x{4:.1f}'
+        print(report.format(
+            path,
+            len(raw) // 1024,
+            timings[0],
+            timings[1],
+            timings[0] / timings[1],
+        ))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    url = None
+    if '--url' in args:
+        index = args.index('--url')
+        url = args[index + 1]
+        del args[index:index + 2]
+    if len(args) < 2:
+        print(__doc__)
+        sys.exit(1)
+    main(args[0], args[1:], url)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+Compares the gevent and asyncio crawl engines against a local stub site.
+
+Usage::
+
+    python benchmarks/bench_engines.py [monitors] [polls] [latency ms]
+
+A threaded stub server is started on localhost which sets a cookie on its
+landing page and answers searches after the given latency. Each engine
+then runs ``monitors`` stub scrapers for ``polls`` polls each, in its own
+process since gevent's monkey patching cannot be undone; throughput and
+per-poll latency percentiles are reported. Requires aiohttp.
+"""
+from __future__ import absolute_import, unicode_literals
+from __future__ import division, print_function
+
+import datetime
+import json
+import subprocess
+import sys
+import threading
+import time
+import timeit
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # pragma: no cover
+    sys.exit('bench_engines.py requires Python 3')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    counter = 0
+
+    def do_GET(self):  # noqa: N802
+        if self.path.startswith('/search'):
+            time.sleep(self.latency)
+            StubHandler.counter += 1
+            body = (
+                '<html><body><div class="rooms">poll {0}</div>'
+                '<p class="none">no rooms available</p></body></html>'
+            ).format(StubHandler.counter)
+            cookie = None
+        else:
+            body = '<html><body>welcome</body></html>'
+            cookie = 'session=stub; Path=/'
+        payload = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        if cookie:
+            self.send_header('Set-Cookie', cookie)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(latency):
+    StubHandler.latency = latency
+    server = StubServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def stub_scrapers(port, monitors):
+    from dragonite.scrapers.base import HostHotelScraper, HttpStep
+
+    class StubScraper(HostHotelScraper):
+        name = 'stub'
+        friendly = 'Stub'
+        rtimeout = 5
+        parse_regions = ('//div[@class="rooms"]', '//p[@class="none"]')
+        base = 'http://127.0.0.1:{0}'.format(port)
+
+        def warmup_requests(self):
+            return (HttpStep('GET', self.base + '/home'),)
+
+        def search_request(self):
+            return HttpStep(
+                'GET', self.base + '/search', params={'guests': self.numppl}
+            )
+
+        def parse(self, result):
+            result.available = not result.dom.body.select('p.none')
+
+    event = datetime.date(2016, 9, 2)
+    return [StubScraper(event, event, numppl=n) for n in range(monitors)]
+
+
+class NullComm(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def notify(self, result, ref_uuid=None):
+        pass
+
+
+def run_engine(engine, port, monitors, polls):
+    """ runs one engine in this process and prints its timings as JSON """
+    from dragonite.conf import settings
+
+    settings.configure(
+        loglevel='error', simple=True, nodb=True, max_attempts=polls,
+        interval=0, host_rate=0, engine=engine,
+    )
+    settings.comm = NullComm()
+    latencies = []
+
+    def timed(scrape):
+        def wrapper(*args, **kwargs):
+            started = timeit.default_timer()
+            result = scrape(*args, **kwargs)
+            latencies.append(timeit.default_timer() - started)
+            return result
+        return wrapper
+
+    def timed_async(scrape):
+        async def wrapper(*args, **kwargs):
+            started = timeit.default_timer()
+            result = await scrape(*args, **kwargs)
+            latencies.append(timeit.default_timer() - started)
+            return result
+        return wrapper
+
+    if engine == 'asyncio':
+        from dragonite import aio
+        aio.scrape = timed_async(aio.scrape)
+        run = aio.check_room_availability
+    else:
+        from dragonite import coroutines
+        from dragonite.scrapers.base import HostHotelScraper
+        coroutines.monkey_patch()
+        HostHotelScraper.scrape = timed(HostHotelScraper.scrape)
+        run = coroutines.check_room_availability
+
+    probes = stub_scrapers(port, monitors)
+    started = timeit.default_timer()
+    run(None, None, probes)
+    elapsed = timeit.default_timer() - started
+    print(json.dumps({'elapsed': elapsed, 'latencies': latencies}))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main(monitors=20, polls=25, latency=20):
+    server = serve(latency / 1000.0)
+    port = server.server_address[1]
+    print('{0} monitors x {1} polls, {2} ms server latency'.format(
+        monitors, polls, latency
+    ))
+    for engine in ('gevent', 'asyncio'):
+        output = subprocess.check_output([
+            sys.executable, __file__, '--run', engine,
+            str(port), str(monitors), str(polls),
+        ])
+        timings = json.loads(output.decode('utf-8').splitlines()[-1])
+        latencies = timings['latencies']
+        report = (
+            '{0:>8}: {1:7.1f} polls/s  p50 {2:6.1f} ms  p95 {3:6.1f} ms  '
+            'p99 {4:6.1f} ms'
+        )
+        print(report.format(
+            engine,
+            len(latencies) / timings['elapsed'],
+            percentile(latencies, 0.50) * 1000,
+            percentile(latencies, 0.95) * 1000,
+            percentile(latencies, 0.99) * 1000,
+        ))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--run':
+        engine, port, monitors, polls = sys.argv[2:6]
+        run_engine(engine, int(port), int(monitors), int(polls))
+    elif len(sys.argv) > 1 and not sys.argv[1].isdigit():
+        print(__doc__)
+        sys.exit(1)
+    else:
+        main(*[int(arg) for arg in sys.argv[1:4]])
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+Measures how long the CLI takes to import, using ``python -X importtime``.
+
+Usage::
+
+    python benchmarks/bench_import.py [module] [--budget ms]
+
+The module (``dragonite.cli`` by default) is imported in a fresh
+interpreter several times and the best cumulative import time is
+reported, along with the slowest modules it pulled in and any heavy
+subsystem which should only load once a subcommand needs it. With
+``--budget`` the script exits non-zero when the import is slower.
+"""
+from __future__ import absolute_import, unicode_literals
+from __future__ import division, print_function
+
+import subprocess
+import sys
+
+# subsystems a bare ``dragonite --help`` has no business importing
+HEAVY_MODULES = (
+    'gevent', 'sqlalchemy', 'jinja2', 'lxml', 'bs4', 'requests',
+    'unidecode', 'armory.phone', 'aiohttp',
+)
+
+
+def importtime(module):
+    """ {module name: (self us, cumulative us)} from one fresh import """
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    _, stderr = process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(stderr.decode('utf-8', 'replace'))
+    timings = {}
+    for line in stderr.decode('utf-8', 'replace').splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        timings[name.strip()] = (int(own), int(cumulative))
+    return timings
+
+
+def main(module='dragonite.cli', budget=None, runs=5, top=10):
+    samples = [importtime(module) for _ in range(runs)]
+    best = min(samples, key=lambda timings: timings[module][1])
+    total = best[module][1] / 1000.0
+
+    print('{0}: {1:.1f} ms (best of {2})'.format(module, total, runs))
+    print('slowest modules (self time):')
+    slowest = sorted(best.items(), key=lambda item: -item[1][0])[:top]
+    for name, (own, cumulative) in slowest:
+        print('  {0:>8.1f} ms  {1:>8.1f} ms cumulative  {2}'.format(
+            own / 1000.0, cumulative / 1000.0, name
+        ))
+
+    heavy = sorted(
+        name for name in HEAVY_MODULES
+        if any(loaded == name or loaded.startswith(name + '.')
+               for loaded in best)
+    )
+    print('heavy subsystems loaded: {0}'.format(', '.join(heavy) or 'none'))
+
+    if budget is not None and total > budget:
+        print('over budget of {0:.1f} ms'.format(budget))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    budget = None
+    if '--budget' in args:
+        index = args.index('--budget')
+        budget = float(args[index + 1])
+        del args[index:index + 2]
+    if any(arg.startswith('-') for arg in args):
+        print(__doc__)
+        sys.exit(1)
+    sys.exit(main(*args[:1], budget=budget))
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+Offline parse benchmark over the hotel pages in ``benchmarks/fixtures``.
+
+Usage::
+
+    python benchmarks/bench_parse.py [scraper ...] [--pad KB] [--repeat N]
+
+Every fixture is a page one of the scrapers gets back in a known state:
+available, unavailable, price too high (Marriott) or maintenance
+(passkey). Each page is padded with ``--pad`` KB of markup outside the
+parse regions (100 by default), since live pages are mostly navigation,
+scripts and promotions. Each page is evaluated ``--repeat`` times as a run
+would, with ``ScrapeResults.evaluate`` and an inline parse executor. The
+page is also parsed through ``parse_verdict`` alone, without the raw-text
+prescreen. Pages per second for both, and the tracemalloc peak of one
+evaluation, are reported.
+
+Both verdicts have to match the fixture's expected state; the script
+exits non-zero when any does not. Compare parsing optimizations against
+its numbers.
+"""
+from __future__ import absolute_import, unicode_literals
+from __future__ import division, print_function
+
+import datetime
+import io
+import os
+import sys
+import timeit
+import tracemalloc
+
+from dragonite.conf import settings
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'fixtures')
+PASSKEY = 'https://aws.passkey.com/event/14179207/owner/323'
+
+# (scraper name, state, final URL, expected available, expected error)
+FIXTURES = (
+    ('hyatt', 'available',
+     'https://atlantaregency.hyatt.com/HICBooking', True, False),
+    ('hyatt', 'unavailable',
+     'https://atlantaregency.hyatt.com/HICBooking', False, False),
+    ('hyatt_passkey', 'available',
+     PASSKEY + '/rooms/select', True, False),
+    ('hyatt_passkey', 'unavailable',
+     PASSKEY + '/rooms/select', False, False),
+    ('hyatt_passkey', 'maintenance',
+     PASSKEY + '/maintenance/index.html', False, True),
+    ('hilton', 'available',
+     'http://www3.hilton.com/en_US/hi/reservation/book.htm', True, False),
+    ('hilton', 'unavailable',
+     'http://www3.hilton.com/en_US/hi/reservation/book.htm', False, False),
+    ('marriott', 'available',
+     'https://www.marriott.com/reservation/availability.mi', True, False),
+    ('marriott', 'unavailable',
+     'https://www.marriott.com/reservation/availability.mi', False, False),
+    ('marriott', 'price_too_high',
+     'https://www.marriott.com/reservation/availability.mi', False, False),
+    ('marriott_discount', 'available',
+     'https://www.marriott.com/meetings/rateListMenu.mi', True, False),
+    ('marriott_discount', 'unavailable',
+     'https://www.marriott.com/meetings/rateListMenu.mi', False, False),
+)
+
+
+def padding(kilobytes):
+    """ markup outside every parse region, about ``kilobytes`` KB of it """
+    chunks = []
+    size = 0
+    n = 0
+    while size < kilobytes * 1024:
+        chunk = (
+            '<div class="promo" data-offer="{0}"><h4>Offer {0}</h4><ul>'
+            '<li><a href="/offers/{0}/details">Details</a></li>'
+            '<li><a href="/offers/{0}/terms">Terms &amp; conditions</a></li>'
+            '</ul><script>track("promo-{0}", {{"slot": {0}}});</script>'
+            '</div>\n'
+        ).format(n)
+        chunks.append(chunk)
+        size += len(chunk)
+        n += 1
+    return ''.join(chunks)
+
+
+def load(name, state, pad):
+    path = os.path.join(FIXTURES_DIR, name, state + '.html')
+    with io.open(path, 'r', encoding='utf-8') as page:
+        raw = page.read()
+    return raw.replace('</body>', padding(pad) + '</body>', 1)
+
+
+def evaluate(scraper, raw, url):
+    from dragonite.executor import ParsedResponse
+    from dragonite.scrapers.base import ScrapeResults
+
+    result = ScrapeResults(scraper)
+    result.raw = raw
+    result.response = ParsedResponse(url, [])
+    result.evaluate()
+    return result
+
+
+def peak_memory(scraper, raw, url):
+    """ peak bytes allocated while evaluating one page """
+    evaluate(scraper, raw, url)
+    tracemalloc.start()
+    try:
+        evaluate(scraper, raw, url)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main(names=(), pad=100, repeat=50):
+    settings.configure(loglevel='error', simple=True, parse_executor='inline')
+    from dragonite import scrapers
+    from dragonite.executor import parse_verdict
+
+    event = datetime.date(2016, 9, 2)
+    probes = dict(
+        (s.name, s) for s in scrapers.get_scrapers(event, event)
+    )
+    fixtures = [f for f in FIXTURES if not names or f[0] in names]
+    if not fixtures:
+        print('no fixtures for {0}'.format(', '.join(names)))
+        return 1
+
+    print('{0} pages padded with {1} KB, {2} runs each'.format(
+        len(fixtures), pad, repeat
+    ))
+    print('{0:<18} {1:<15} {2:>5} {3:>9} {4:>12} {5:>10} {6:>8}'.format(
+        'scraper', 'state', 'KB', 'verdict', 'evaluate p/s', 'parse p/s',
+        'peak KB',
+    ))
+    failures = []
+    total = 0.0
+    for name, state, url, available, error in fixtures:
+        scraper = probes[name]
+        raw = load(name, state, pad)
+        expected = (available, error)
+
+        result = evaluate(scraper, raw, url)
+        verdict = parse_verdict(scraper, raw, url)
+        for path, got in (
+            ('evaluate', (result.available, result.error)),
+            ('parse', (verdict['available'], verdict['error'])),
+        ):
+            if got != expected:
+                failures.append('{0}/{1} ({2}): expected {3}, got {4}'.format(
+                    name, state, path, expected, got
+                ))
+
+        evaluated = timeit.timeit(
+            lambda: evaluate(scraper, raw, url), number=repeat
+        )
+        parsed = timeit.timeit(
+            lambda: parse_verdict(scraper, raw, url), number=repeat
+        )
+        total += evaluated
+        print(
+            '{0:<18} {1:<15} {2:>5} {3:>9} {4:>12.1f} {5:>10.1f} '
+            '{6:>8.1f}'.format(
+                name, state, len(raw) // 1024,
+                'error' if result.error else
+                'avail' if result.available else 'none',
+                repeat / evaluated, repeat / parsed,
+                peak_memory(scraper, raw, url) / 1024,
+            )
+        )
+
+    print('overall: {0:.1f} pages/s evaluated'.format(
+        len(fixtures) * repeat / total
+    ))
+    for failure in failures:
+        print('FAIL ' + failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = {}
+    for flag in ('--pad', '--repeat'):
+        if flag in args:
+            index = args.index(flag)
+            options[flag[2:]] = int(args[index + 1])
+            del args[index:index + 2]
+    if any(arg.startswith('-') for arg in args):
+        print(__doc__)
+        sys.exit(1)
+    sys.exit(main(args, **options))
@@ -0,0 +1,568 @@
+# -*- encoding: utf-8 -*-
+"""
+asyncio crawl engine, selected with ``--engine asyncio``.
+
+It drives the same ``HostHotelScraper`` subclasses as the gevent engine in
+``coroutines``: their ``warmup_requests`` and ``search_request`` steps are
+sent with aiohttp instead of a monkey-patched ``requests.Session``, and the
+results go through the same evaluation, database and notification steps.
+
+Requires Python 3.5+ and the optional ``aiohttp`` dependency
+(``pip install dragonite[asyncio]``); this module is only imported when
+the engine is selected.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import logging
+import timeit
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+from . import alerts, beaker, metrics, scheduler, scrapers
+from .conf import settings
+from .executor import parse_verdict
+from .limiter import HostLimiter
+from .scrapers.base import (
+    RequestsGuard, SessionManager, ScrapeResults, url_origin,
+)
+from .utils import fork_context
+
+log = logging.getLogger(__name__)
+
+
+class AsyncHostLimiter(HostLimiter):
+    """ ``HostLimiter`` whose waits suspend the coroutine, not the thread """
+    semaphore = asyncio.BoundedSemaphore
+
+    def limit(self, origin):
+        return _HostSlot(self, origin)
+
+
+class _HostSlot(object):
+    """ ``async with`` counterpart of ``HostLimiter.limit`` """
+
+    def __init__(self, limiter, origin):
+        self.limiter = limiter
+        self.origin = origin
+        self.budget = None
+
+    async def __aenter__(self):
+        bucket, self.budget = self.limiter._get(self.origin)
+        wait = self.limiter.delay(self.origin, bucket)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        if self.budget is not None:
+            await self.budget.acquire()
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        if self.budget is not None:
+            self.budget.release()
+
+
+class AsyncSessionManager(SessionManager):
+    """
+    ``SessionManager`` handing out ``aiohttp.ClientSession`` objects.
+
+    The expiry and warm-up bookkeeping is inherited; ``warming`` serializes
+    the warm-up hops of the probes sharing the session.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncSessionManager, self).__init__(*args, **kwargs)
+        self.warming = asyncio.Lock()
+        self._closing = []
+        self._users = collections.Counter()
+
+    def create(self):
+        return aiohttp.ClientSession(
+            headers=self.headers,
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            # aiohttp drops cookies set by IP addresses such as a local
+            # site emulator unless told otherwise
+            cookie_jar=aiohttp.CookieJar(unsafe=bool(settings.base_url)),
+        )
+
+    def acquire(self):
+        """
+        the current session, held open until ``release`` even if it is
+        recycled meanwhile, so the probes sharing it are not cut off
+        """
+        with self.lock:
+            session = self.session
+            self._users[session] += 1
+            return session
+
+    def release(self, session):
+        with self.lock:
+            self._users[session] -= 1
+            if self._users[session] <= 0:
+                del self._users[session]
+                if session is not self._session:
+                    self._close(session)
+
+    def _close(self, session):
+        self._closing.append(asyncio.ensure_future(session.close()))
+
+    def recycle(self):
+        with self.lock:
+            if self._session is not None and not self._users[self._session]:
+                self._close(self._session)
+            self._session = None
+            self._created = None
+            self._warmed = None
+
+    async def close(self):
+        self.recycle()
+        if self._closing:
+            await asyncio.gather(*self._closing)
+        self._closing = []
+
+
+class AsyncRequestsGuard(RequestsGuard):
+    timeout_errors = (asyncio.TimeoutError,)
+    connection_errors = (aiohttp.ClientError,) if aiohttp else ()
+
+
+class FetchedResponse(object):
+    """ the parts of a response the scrapers look at """
+
+    def __init__(self, url, status_code, history=()):
+        self.url = url
+        self.status_code = status_code
+        self.history = list(history)
+
+    @classmethod
+    def from_client(cls, response):
+        history = [cls(str(r.url), r.status) for r in response.history]
+        return cls(str(response.url), response.status, history)
+
+
+def _query(values):
+    """ aiohttp only accepts strings in query strings and form bodies """
+    if values is None:
+        return None
+    return dict(
+        (key, '{0}'.format(value))
+        for key, value in values.items() if value is not None
+    )
+
+
+async def send(scraper, step, session, timeout, limiter, hop):
+    """
+    asyncio counterpart of ``HostHotelScraper.send``; returns
+    ``(response, text)``
+    """
+    async with limiter.limit(url_origin(step.url)):
+        started = timeit.default_timer()
+        async with session.request(
+            step.method,
+            step.url,
+            params=_query(step.params),
+            data=_query(step.data),
+            headers=step.headers,
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as response:
+            text = await response.text()
+        metrics.observe(
+            'http_request_seconds', timeit.default_timer() - started,
+            scraper=scraper.name, hop=hop,
+        )
+    return FetchedResponse.from_client(response), text
+
+
+async def warmup(scraper, session, rtimeout, limiter):
+    for number, step in enumerate(scraper.warmup_requests(), 1):
+        hop = 'warmup{0}'.format(number)
+        r, _ = await send(scraper, step, session, rtimeout, limiter, hop)
+        scraper.check_status(r)
+    scraper.sessions.mark_warm()
+
+
+async def scrape(scraper, result, limiter, rtimeout=None):
+    """ the asyncio counterpart of ``HostHotelScraper.scrape`` """
+    rtimeout = rtimeout or scraper.rtimeout
+    sessions = scraper.sessions
+
+    s = sessions.acquire()
+    try:
+        with AsyncRequestsGuard(result, scraper.__module__):
+            async with sessions.warming:
+                if not sessions.warm:
+                    await warmup(scraper, s, rtimeout, limiter)
+            r, text = await send(
+                scraper, scraper.search_request(), s, rtimeout, limiter,
+                'search'
+            )
+
+            if scraper.landed(r):
+                log.debug(
+                    scraper.msg('session went stale; replaying warm-up')
+                )
+                async with sessions.warming:
+                    sessions.invalidate()
+                    await warmup(scraper, s, rtimeout, limiter)
+                r, text = await send(
+                    scraper, scraper.search_request(), s, rtimeout, limiter,
+                    'search'
+                )
+
+            log.debug(scraper.msg('[HTTP {0}]'.format(r.status_code)))
+            scraper.check_status(r)
+
+            result.response = r
+            result.raw = text
+            result.cookies = dict((c.key, c.value) for c in s.cookie_jar)
+    finally:
+        sessions.release(s)
+
+    return result
+
+
+class AsyncCrawler(object):
+    """
+    Runs the monitors, result processor and database writer on one loop.
+
+    Parsing, notifications and database writes are blocking, so they are
+    handed to executors; nothing on the loop waits on them directly.
+    """
+
+    def __init__(self, hotel_scrapers):
+        self.scrapers = hotel_scrapers
+        self.limiter = AsyncHostLimiter()
+        self.result_queue = asyncio.Queue()
+        self.write_queue = asyncio.Queue()
+        self.invocation = None
+        self.parse_pool = None
+        if settings.parse_executor == 'thread':
+            self.parse_pool = concurrent.futures.ThreadPoolExecutor(
+                settings.parse_workers
+            )
+        elif settings.parse_executor == 'process':
+            self.parse_pool = concurrent.futures.ProcessPoolExecutor(
+                settings.parse_workers, mp_context=fork_context()
+            )
+        # a single thread so the database session is never used concurrently
+        self.db_pool = concurrent.futures.ThreadPoolExecutor(1)
+        self.io_pool = concurrent.futures.ThreadPoolExecutor(1)
+
+        managers = {}
+        for scraper in hotel_scrapers:
+            shared = scraper.sessions
+            if shared not in managers:
+                managers[shared] = AsyncSessionManager(
+                    pool_size=shared.pool_size,
+                    max_age=shared.max_age,
+                    warmup_ttl=shared.warmup_ttl,
+                    headers=shared.headers,
+                )
+            scraper.sessions = managers[shared]
+        self.sessions = list(managers.values())
+
+    def blocking(self, pool, func, *args):
+        return asyncio.get_event_loop().run_in_executor(pool, func, *args)
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        writer = None
+        processor = None
+        metrics.registry.collect(self.sample_queues)
+        exporter = metrics.start_exporter()
+        try:
+            if settings.use_db:
+                await self.blocking(self.db_pool, functools.partial(
+                    beaker.init_database,
+                    db_url=settings.db_url,
+                    pool_size=settings.db_pool_size,
+                    echo=settings.db_echo,
+                ))
+                self.invocation = await self.blocking(
+                    self.db_pool, beaker.record_invocation, settings.dict()
+                )
+                writer = loop.create_task(self.database_writer())
+
+            processor = loop.create_task(self.result_processor())
+            # like greenlets in a group, a failed monitor leaves the rest
+            outcomes = await asyncio.gather(*[
+                self.monitor_rooms(scraper) for scraper in self.scrapers
+            ], return_exceptions=True)
+            names = []
+            for scraper, outcome in zip(self.scrapers, outcomes):
+                if isinstance(outcome, Exception):
+                    log.error('{0} monitor failed: {1!r}'.format(
+                        scraper.label, outcome
+                    ))
+                else:
+                    names.append(outcome)
+
+            await self.result_queue.put(StopIteration)
+            try:
+                await asyncio.wait_for(
+                    processor, timeout=alerts.delivery_budget() + 10
+                )
+            except asyncio.TimeoutError:
+                log.warning('result processor did not finish; cancelled')
+            return names
+        finally:
+            if processor is not None and not processor.done():
+                processor.cancel()
+            for manager in self.sessions:
+                await manager.close()
+            if writer is not None:
+                await self.write_queue.put(StopIteration)
+                await asyncio.wait_for(writer, timeout=30)
+            for pool in (self.parse_pool, self.db_pool, self.io_pool):
+                if pool is not None:
+                    pool.shutdown(wait=False)
+            if exporter is not None:
+                exporter.stop()
+
+    def sample_queues(self, registry):
+        registry.gauge('result_queue_depth').set(self.result_queue.qsize())
+        registry.gauge('write_queue_depth').set(self.write_queue.qsize())
+
+    async def monitor_rooms(self, scraper):
+        """ the asyncio counterpart of ``coroutines._monitor_rooms`` """
+        log.info('checking {0} room availability...'.format(scraper.label))
+        schedule = scheduler.PollScheduler()
+        iteration = 0
+        fingerprint = None
+        latest = None
+        unchanged = 0
+
+        while settings.max_attempts == 0 or iteration < settings.max_attempts:
+            previous = timeit.default_timer()
+
+            result = ScrapeResults(scraper)
+            await scrape(scraper, result, self.limiter)
+            metrics.increment('polls_total', scraper=scraper.name)
+            current = result.fingerprint
+            if current is not None and current == fingerprint:
+                unchanged += 1
+                log.info('{0}: NO CHANGE ({1})'.format(
+                    scraper.label, unchanged
+                ))
+                if latest.available:
+                    # reminders and re-alerts still need to see it
+                    await self.result_queue.put(latest)
+            else:
+                fingerprint = current
+                latest = result
+                unchanged = 0
+                await self.process_result(result)
+            metrics.observe(
+                'poll_seconds', timeit.default_timer() - previous,
+                scraper=scraper.name,
+            )
+            schedule.record(error=result.error, changed=(unchanged == 0))
+
+            iteration += 1
+            if settings.max_attempts == 0 or iteration < settings.max_attempts:
+                elapsed = timeit.default_timer() - previous
+                await asyncio.sleep(schedule.delay(elapsed))
+
+        return '{0}'.format(scraper.name)
+
+    async def process_result(self, result):
+        """ evaluates a fresh scrape, stores it, and queues it """
+        started = timeit.default_timer()
+        if result.prescreen():
+            if self.parse_pool is None:
+                verdict = parse_verdict(result.parent, result.raw, result.url)
+            else:
+                verdict = await self.blocking(
+                    self.parse_pool,
+                    parse_verdict, result.parent, result.raw, result.url
+                )
+            result.apply_verdict(verdict)
+        metrics.observe(
+            'parse_seconds', timeit.default_timer() - started,
+            scraper=result.parent.name,
+        )
+
+        if settings.use_db:
+            entry = beaker.ScrapeResultEntry.from_result(
+                result,
+                self.invocation.id if self.invocation is not None else None
+            )
+            await self.write_queue.put(('insert', entry, result.raw))
+            result.entry = entry
+
+        if result.available:
+            log.info('{0}: AVAILABILITY FOUND'.format(result.parent.label))
+        else:
+            log.info('{0}: UNAVAILABLE'.format(result.parent.label))
+
+        await self.result_queue.put(result)
+
+    async def result_processor(self):
+        """ the asyncio counterpart of ``coroutines._result_processor`` """
+        tracker = alerts.AvailabilityTracker()
+        notices = asyncio.Queue(maxsize=settings.notify_queue_size)
+        notifier = asyncio.get_event_loop().create_task(
+            self.notification_worker(notices, tracker)
+        )
+        try:
+            while True:
+                result = await self.result_queue.get()
+                if result is StopIteration:
+                    break
+                log.debug('processing {0} result'.format(
+                    result.parent.friendly
+                ))
+                if not tracker.observe(result):
+                    continue
+                try:
+                    notices.put_nowait(
+                        (result, getattr(result, 'entry', None))
+                    )
+                except asyncio.QueueFull:
+                    log.error('{0}: notification queue full; '
+                              'alert dropped'.format(result.parent.label))
+                    tracker.forget(result)
+        finally:
+            await notices.put(StopIteration)
+            try:
+                await asyncio.wait_for(notifier, alerts.delivery_budget())
+            except asyncio.TimeoutError:
+                log.warning('notification worker did not finish; cancelled')
+            await self.blocking(self.io_pool, alerts.close_gateway)
+        return True
+
+    async def notification_worker(self, notices, tracker):
+        """ the asyncio counterpart of ``alerts.NotificationWorker`` """
+        while True:
+            job = await notices.get()
+            if job is StopIteration:
+                break
+            result, entry = job
+            ref_uuid = entry.uuid if entry is not None else None
+            if not await self.deliver(result, ref_uuid):
+                tracker.forget(result)
+            elif entry is not None:
+                await self.write_queue.put(
+                    ('update', entry, {'processed': True})
+                )
+                log.debug('entry {0} processed'.format(entry.uuid))
+
+    async def deliver(self, result, ref_uuid=None,
+                      retry_delay=alerts.RETRY_DELAY):
+        """
+        Sends one alert in ``io_pool`` with a timeout and retries; a send
+        which times out keeps its thread, so the retry queues behind it and
+        only goes to the recipients it did not reach.
+        """
+        delay = retry_delay
+        delivered = []
+        for attempt in range(1, settings.notify_retries + 2):
+            try:
+                await asyncio.wait_for(
+                    self.blocking(
+                        self.io_pool, alerts.send_alert, result, ref_uuid,
+                        delivered,
+                    ),
+                    settings.notify_timeout,
+                )
+                return True
+            except asyncio.TimeoutError:
+                log.warning('{0}: notification timed out ({1})'.format(
+                    result.parent.label, attempt
+                ))
+            except Exception:
+                log.exception('{0}: notification failed ({1})'.format(
+                    result.parent.label, attempt
+                ))
+            if attempt <= settings.notify_retries:
+                await asyncio.sleep(delay)
+                delay *= 2
+        log.error('{0}: giving up on notification'.format(
+            result.parent.label
+        ))
+        return False
+
+    async def database_writer(self):
+        """
+        The asyncio counterpart of ``coroutines._database_writer``; batches
+        are applied in ``db_pool`` so the loop never waits on SQLite.
+        """
+        session = await self.blocking(self.db_pool, functools.partial(
+            beaker.create_session, expire_on_commit=False
+        ))
+        pending = []
+        deadline = None
+        stopping = False
+
+        while not stopping:
+            timeout = None
+            if pending:
+                timeout = max(0, deadline - timeit.default_timer())
+            try:
+                item = await asyncio.wait_for(self.write_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                item = None
+
+            if item is StopIteration:
+                stopping = True
+            elif item is not None:
+                if not pending:
+                    deadline = (
+                        timeit.default_timer() + settings.db_max_latency
+                    )
+                pending.append(item)
+
+            if pending and (
+                stopping or item is None or
+                len(pending) >= settings.db_batch_size or
+                timeit.default_timer() >= deadline
+            ):
+                await self.blocking(
+                    self.db_pool, beaker.apply_writes, session, pending
+                )
+                pending = []
+
+        await self.blocking(self.db_pool, session.close)
+        return True
+
+
+def check_room_availability(start, end, hotel_scrapers=None):
+    """
+    Main point of entry into the asyncio engine; returns the names of the
+    monitors which ran to completion.
+
+    :param start: beginning date of availability window for hotel rooms.
+    :type start: datetime.date
+    :param end: ending date of availability window for hotel rooms.
+    :type end: datetime.date
+    :param hotel_scrapers: scrapers to monitor instead of the search matrix
+    :type hotel_scrapers: list
+    """
+    if aiohttp is None:
+        raise RuntimeError(
+            'the asyncio engine requires aiohttp; '
+            'pip install dragonite[asyncio]'
+        )
+    if hotel_scrapers is None:
+        hotel_scrapers = scrapers.get_scrapers(
+            start, end, settings.search_matrix(start, end)
+        )
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        log.debug('spawning room availability monitors')
+        crawler = AsyncCrawler(hotel_scrapers)
+        return loop.run_until_complete(crawler.run())
+    except KeyboardInterrupt:
+        log.error('terminating program due to KeyboardInterrupt')
+    except aiohttp.ClientConnectionError as e:
+        log.debug('{0}'.format(e))
+        log.error('internet connection error; aborting!')
+    finally:
+        loop.close()
+    return []
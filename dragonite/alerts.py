@@ -0,0 +1,190 @@
+# -*- encoding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import timeit
+
+import gevent
+from gevent.queue import Full, Queue
+
+from .conf import settings
+from .utils import LogAndForget
+
+log = logging.getLogger(__name__)
+
+
+class AlertState(object):
+    """ What has been seen and sent for one (hotel, search) pair. """
+
+    def __init__(self):
+        self.available = False
+        self.since = None
+        self.notified = None
+
+
+class AvailabilityTracker(object):
+    """
+    Availability state machine per (hotel, search).
+
+    A search starts out unavailable; ``observe`` only asks for an alert when
+    it flips to available, and then again every ``reminder`` seconds for as
+    long as it stays available (never, when ``reminder`` is 0). Failed
+    scrapes say nothing about availability and leave the state alone.
+    """
+
+    def __init__(self, reminder=None):
+        if reminder is None:
+            reminder = settings.alert_reminder
+        self.reminder = reminder
+        self.states = {}
+
+    @staticmethod
+    def key(result):
+        return (result.parent.name, getattr(result.parent, 'search', None))
+
+    def observe(self, result):
+        """ records a result; returns True when it should be alerted on """
+        if result.error:
+            return False
+        state = self.states.setdefault(self.key(result), AlertState())
+        now = timeit.default_timer()
+
+        if not result.available:
+            if state.available:
+                log.info('{0}: no longer available'.format(
+                    result.parent.label
+                ))
+            state.available = False
+            state.since = None
+            return False
+
+        if not state.available:
+            state.available = True
+            state.since = now
+            state.notified = now
+            return True
+        if self.reminder and now - state.notified >= self.reminder:
+            state.notified = now
+            return True
+        log.debug('{0}: still available; alert suppressed'.format(
+            result.parent.label
+        ))
+        return False
+
+    def forget(self, result):
+        """ treat the search as unavailable again, e.g. after a lost alert """
+        self.states.pop(self.key(result), None)
+
+
+RETRY_DELAY = 1.0
+
+
+def delivery_budget():
+    """ worst case seconds for one alert, every retry timing out """
+    retries = settings.notify_retries
+    return (
+        settings.notify_timeout * (retries + 1) +
+        RETRY_DELAY * (2 ** retries - 1)
+    )
+
+
+def send_alert(result, ref_uuid=None, delivered=None):
+    """
+    sends a single alert through the gateway, skipping the recipients in
+    ``delivered`` and appending the ones it reaches
+    """
+    with settings.comm as gateway:
+        gateway.notify(result, ref_uuid, delivered)
+
+
+def close_gateway():
+    """ quits the gateway's pooled connections, if it was ever opened """
+    close = getattr(getattr(settings, '_comm', None), 'close', None)
+    if close is not None:
+        with LogAndForget('issue encountered closing the gateway:'):
+            close()
+
+
+class NotificationWorker(object):
+    """
+    Sends alerts from its own bounded queue in a separate greenlet.
+
+    Each send is bounded by ``timeout`` seconds and retried up to
+    ``retries`` times with a doubling delay, so a slow or flaky SMTP server
+    never holds up result processing. ``on_sent`` is called with each
+    delivered job's ``entry`` and ``on_failed`` with each result whose
+    alert could not be delivered.
+    """
+
+    def __init__(self, on_sent=None, on_failed=None, size=None, retries=None,
+                 timeout=None, retry_delay=RETRY_DELAY):
+        if size is None:
+            size = settings.notify_queue_size
+        self.retries = settings.notify_retries if retries is None else retries
+        self.timeout = settings.notify_timeout if timeout is None else timeout
+        self.retry_delay = retry_delay
+        self.on_sent = on_sent
+        self.on_failed = on_failed
+        self.queue = Queue(maxsize=size)
+        self.greenlet = None
+
+    def start(self):
+        self.greenlet = gevent.spawn(self.run)
+        return self
+
+    def submit(self, result, entry=None):
+        """ queues an alert; returns False when the queue is full """
+        try:
+            self.queue.put_nowait((result, entry))
+        except Full:
+            log.error('{0}: notification queue full; alert dropped'.format(
+                result.parent.label
+            ))
+            return False
+        return True
+
+    def stop(self, timeout=None):
+        """ lets queued alerts drain, then stops the worker """
+        if self.greenlet is None:
+            return
+        self.queue.put(StopIteration)
+        self.greenlet.join(timeout=timeout)
+        if not self.greenlet.ready():
+            log.warning('notification worker did not finish; killed')
+            self.greenlet.kill()
+
+    def run(self):
+        for result, entry in self.queue:
+            ref_uuid = entry.uuid if entry is not None else None
+            delivered = self.deliver(result, ref_uuid)
+            with LogAndForget('issue encountered after notifying:'):
+                if delivered and entry is not None and self.on_sent:
+                    self.on_sent(entry)
+                elif not delivered and self.on_failed:
+                    self.on_failed(result)
+        return True
+
+    def deliver(self, result, ref_uuid=None):
+        delay = self.retry_delay
+        # retries only go to the recipients the earlier attempts missed
+        delivered = []
+        for attempt in range(1, self.retries + 2):
+            try:
+                with gevent.Timeout(self.timeout):
+                    send_alert(result, ref_uuid, delivered)
+                return True
+            except gevent.Timeout:
+                log.warning('{0}: notification timed out ({1})'.format(
+                    result.parent.label, attempt
+                ))
+            except Exception:
+                log.exception('{0}: notification failed ({1})'.format(
+                    result.parent.label, attempt
+                ))
+            if attempt <= self.retries:
+                gevent.sleep(delay)
+                delay *= 2
+        log.error('{0}: giving up on notification'.format(
+            result.parent.label
+        ))
+        return False
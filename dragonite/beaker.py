@@ -2,19 +2,37 @@
 from __future__ import absolute_import, unicode_literals
 
 import datetime
+import hashlib
 import json
 import logging
+import timeit
 import uuid
-from collections import OrderedDict
+import zlib
+from collections import OrderedDict, namedtuple
 
-import dateutil.parser
-
-from sqlalchemy import Column, ForeignKey, create_engine, inspect, types
+from sqlalchemy import (
+    Column, ForeignKey, Index, cast, create_engine, event, func, inspect,
+    select, sql, types,
+)
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
-from sqlalchemy.orm import backref, relationship, sessionmaker
+from sqlalchemy.orm import backref, deferred, relationship, sessionmaker
+from sqlalchemy.pool import QueuePool
 
+from . import metrics
 from .scrapers import get_host_names
+from .utils import check_date
+
+# bump whenever tables, columns, or indexes change
+SCHEMA_VERSION = 5
+# entries moved from the legacy raw column per transaction
+LEGACY_RAW_BATCH = 100
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 268435456),
+    ('busy_timeout', 5000),
+)
 
 
 class AutoUUID(types.TypeDecorator):
@@ -114,6 +132,10 @@ class Base(object):
 Model = declarative_base(cls=Base)
 
 
+class SchemaVersion(Model):
+    version = Column(types.Integer, nullable=False)
+
+
 class Invocation(Model):
     debug = Column(types.Boolean)
     info = Column(types.Boolean)
@@ -130,18 +152,94 @@ class Invocation(Model):
     email_enabled = Column(types.Boolean)
 
     def __init__(self, *args, **kwargs):
-        self.checkin = self._check_date(kwargs.pop('checkin'))
-        self.checkout = self._check_date(kwargs.pop('checkout'))
+        self.checkin = check_date(kwargs.pop('checkin'))
+        self.checkout = check_date(kwargs.pop('checkout'))
         super(Invocation, self).__init__(*args, **kwargs)
 
-    def _check_date(self, value):
-        if value is not None and not isinstance(value, datetime.date):
-            return dateutil.parser.parse(value).date()
-        return value
+
+class ResponseBlob(Model):
+    """
+    Compressed response body, stored once per distinct content.
+
+    Entries reference blobs by id and the compressed ``data`` column is
+    deferred, so neither is read from the database unless asked for.
+    """
+    COMPRESSION_LEVEL = 6
+
+    digest = Column(types.String(40), unique=True, nullable=False)
+    codec = Column(types.String(10), default='zlib')
+    size = Column(types.Integer)
+    data = deferred(Column(types.LargeBinary))
+
+    @staticmethod
+    def digest_of(text):
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def create(cls, text):
+        encoded = text.encode('utf-8')
+        return cls(
+            digest=hashlib.sha1(encoded).hexdigest(),
+            codec='zlib',
+            size=len(encoded),
+            data=zlib.compress(encoded, cls.COMPRESSION_LEVEL),
+        )
+
+    @classmethod
+    def store(cls, session, text):
+        """ returns the blob holding ``text``, adding one if it is new """
+        return cls.store_many(session, [text])[cls.digest_of(text)]
+
+    @classmethod
+    def store_many(cls, session, texts):
+        """
+        Returns a dict of digest to blob for every text, looking up the
+        existing blobs with a single query and adding the missing ones.
+        """
+        texts = dict((cls.digest_of(text), text) for text in texts)
+        blobs = {}
+        if not texts:
+            return blobs
+        with session.no_autoflush:
+            existing = session.query(cls).filter(
+                cls.digest.in_(list(texts.keys()))
+            )
+            for blob in existing:
+                blobs[blob.digest] = blob
+        for digest, text in texts.items():
+            if digest not in blobs:
+                blobs[digest] = cls.create(text)
+                session.add(blobs[digest])
+        return blobs
+
+    @property
+    def text(self):
+        return zlib.decompress(self.data).decode('utf-8')
+
+
+Search = namedtuple('Search', ('checkin', 'checkout', 'guests'))
+
+
+def _as_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
 
 
 class ScrapeResultEntry(Model):
     HOST_HOTELS = get_host_names()
+    __table_args__ = (
+        Index('ix_scraperesultentry_hotel_created', 'hotel', 'created'),
+        Index(
+            'ix_scraperesultentry_search_created',
+            'hotel', 'checkin', 'checkout', 'guests', 'created',
+        ),
+        Index(
+            'ix_scraperesultentry_available_created', 'available', 'created'
+        ),
+        Index('ix_scraperesultentry_invocation_id', 'invocation_id'),
+        Index('ux_scraperesultentry_uuid', 'uuid', unique=True),
+    )
 
     invocation_id = Column(types.Integer, ForeignKey('invocation.id'))
     invocation = relationship(
@@ -150,41 +248,442 @@ class ScrapeResultEntry(Model):
     )
 
     hotel = Column(ChoiceStringType(HOST_HOTELS))
+    checkin = Column(types.Date, nullable=True)
+    checkout = Column(types.Date, nullable=True)
+    guests = Column(types.Integer, nullable=True)
     available = Column(types.Boolean, default=False)
     processed = Column(types.Boolean, default=False)
     error = Column(types.Boolean, default=False)
     traceback = Column(types.UnicodeText, nullable=True, default=None)
     post_process = Column(types.Boolean, default=False)
-    raw = Column(types.UnicodeText)
-    history = Column(types.UnicodeText)
-    cookies = Column(types.UnicodeText)
+    raw_id = Column(types.Integer, ForeignKey('responseblob.id'))
+    raw_blob = relationship(ResponseBlob, lazy='select')
+    history = deferred(Column(types.UnicodeText))
+    cookies = deferred(Column(types.UnicodeText))
+
+    @property
+    def raw(self):
+        """ the decompressed response body; loads the blob on access """
+        if self.raw_blob is None:
+            return None
+        return self.raw_blob.text
+
+    @property
+    def search(self):
+        """ the ``(checkin, checkout, guests)`` searched for """
+        return Search(self.checkin, self.checkout, self.guests)
+
+    @classmethod
+    def from_result(cls, result, invocation_id=None):
+        """ a new, unsaved entry for an evaluated scrape result """
+        scraper = result.parent
+        return cls(
+            uuid=uuid.uuid4(),
+            invocation_id=invocation_id,
+            hotel=scraper.name,
+            checkin=_as_date(scraper.start),
+            checkout=_as_date(scraper.end),
+            guests=scraper.numppl,
+            available=result.available,
+            post_process=result.post_process,
+            error=result.error,
+            traceback=result.traceback,
+            history=json.dumps(result.history),
+            cookies=json.dumps(result.cookies),
+        )
 
 
 _ENGINE = None
 _SESSION_FACTORY = None
 
 
-def init_database(db_url=None, db_filename=None):
+def init_database(db_url=None, db_filename=None, pool_size=None, echo=False):
     log = logging.getLogger(__name__)
     global _ENGINE
     global _SESSION_FACTORY
     db_filename = db_filename or 'dragonite.sqlite3'
     db_url = db_url or ('sqlite:///' + db_filename)
-    _ENGINE = create_engine(db_url)
+    engine_options = {'echo': echo}
+    if pool_size:
+        engine_options['pool_size'] = pool_size
+        if db_url.startswith('sqlite'):
+            # file-based SQLite defaults to a pool which cannot be sized
+            engine_options['poolclass'] = QueuePool
+    _ENGINE = create_engine(db_url, **engine_options)
+    if _ENGINE.dialect.name == 'sqlite':
+        event.listen(_ENGINE, 'connect', _apply_sqlite_pragmas)
     _SESSION_FACTORY = sessionmaker()
     _SESSION_FACTORY.configure(bind=_ENGINE)
-    Model.metadata.create_all(_ENGINE)
+    version = schema_version()
+    if version != SCHEMA_VERSION:
+        upgrade_schema(version)
     log.debug('database initialization completed.')
 
 
-def create_session():
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS:
+        cursor.execute('PRAGMA {0} = {1}'.format(pragma, value))
+    cursor.close()
+
+
+def schema_version():
+    """ the schema version recorded in the database, or None """
+    with _ENGINE.connect() as connection:
+        table = SchemaVersion.__table__.name
+        if not _ENGINE.dialect.has_table(connection, table):
+            return None
+    session = create_session()
+    try:
+        return session.query(func.max(SchemaVersion.version)).scalar()
+    finally:
+        session.close()
+
+
+def upgrade_schema(previous=None):
+    """
+    Creates missing tables and adds columns missing from existing ones,
+    then runs the data migrations for versions after ``previous``.
+
+    Columns which are no longer mapped are left in place.
+    """
+    log = logging.getLogger(__name__)
+    Model.metadata.create_all(_ENGINE)
+    inspector = inspect(_ENGINE)
+    with _ENGINE.begin() as connection:
+        for table in Model.metadata.sorted_tables:
+            columns = inspector.get_columns(table.name)
+            existing = set(column['name'] for column in columns)
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                log.info('adding column {0}.{1}'.format(
+                    table.name, column.name
+                ))
+                connection.execute('ALTER TABLE {0} ADD COLUMN {1} {2}'.format(
+                    table.name,
+                    column.name,
+                    column.type.compile(dialect=_ENGINE.dialect),
+                ))
+            indexes = inspector.get_indexes(table.name)
+            existing = set(index['name'] for index in indexes)
+            for index in table.indexes:
+                if index.name not in existing:
+                    log.info('adding index {0}'.format(index.name))
+                    index.create(bind=connection)
+        # no recorded version means a database from before versioning
+        if previous is None or previous < 4:
+            _backfill_search_dates(connection)
+    _migrate_legacy_raw()
+    session = create_session()
+    session.add(SchemaVersion(version=SCHEMA_VERSION))
+    session.commit()
+    session.close()
+    log.debug('database schema upgraded to {0}'.format(SCHEMA_VERSION))
+
+
+def _backfill_search_dates(connection):
+    """
+    Entries from before version 4 searched their run's stay; the guest
+    count was never recorded and stays unknown.
+    """
+    entry = ScrapeResultEntry.__table__
+    invocation = Invocation.__table__
+
+    def of_invocation(column):
+        return select([column]).where(
+            invocation.c.id == entry.c.invocation_id
+        ).as_scalar()
+
+    result = connection.execute(entry.update().where(
+        entry.c.checkin.is_(None)
+    ).values(
+        checkin=of_invocation(invocation.c.checkin),
+        checkout=of_invocation(invocation.c.checkout),
+    ))
+    logging.getLogger(__name__).info(
+        'filled in the stay of {0} earlier results'.format(result.rowcount)
+    )
+
+
+def _migrate_legacy_raw():
+    """
+    Moves the bodies left in the ``raw`` column of entries stored before
+    responses became shared blobs into ``ResponseBlob`` rows, emptying the
+    column as it goes; SQLite files are vacuumed afterwards so the space
+    is actually given back.
+    """
+    log = logging.getLogger(__name__)
+    name = ScrapeResultEntry.__table__.name
+    columns = inspect(_ENGINE).get_columns(name)
+    if 'raw' not in set(c['name'] for c in columns):
+        return
+    legacy = sql.table(
+        name, sql.column('id'), sql.column('raw'), sql.column('raw_id')
+    )
+    pending = select([legacy.c.id, legacy.c.raw]).where(
+        legacy.c.raw.isnot(None)
+    ).limit(LEGACY_RAW_BATCH)
+    moved = 0
+    session = create_session()
+    try:
+        while True:
+            rows = session.execute(pending).fetchall()
+            if not rows:
+                break
+            blobs = ResponseBlob.store_many(session, [raw for _, raw in rows])
+            session.flush()
+            for entry_id, raw in rows:
+                session.execute(legacy.update().where(
+                    legacy.c.id == entry_id
+                ).values(
+                    raw_id=blobs[ResponseBlob.digest_of(raw)].id, raw=None
+                ))
+            session.commit()
+            moved += len(rows)
+    finally:
+        session.close()
+    if not moved:
+        return
+    log.info('moved {0} stored responses into blobs'.format(moved))
+    if _ENGINE.dialect.name == 'sqlite':
+        with _ENGINE.connect() as connection:
+            connection.execute('VACUUM')
+
+
+def create_session(**kwargs):
     log = logging.getLogger(__name__)
     if _SESSION_FACTORY is None:
         raise ValueError(__name__ + '.init_database() must be called first!')
-    session = _SESSION_FACTORY()
+    session = _SESSION_FACTORY(**kwargs)
     log.debug('database session created.')
     return session
 
 
 def object_session(obj):
     return _SESSION_FACTORY.object_session(obj)
+
+
+def record_invocation(options):
+    """ stores and returns the ``Invocation`` for this run's options """
+    log = logging.getLogger(__name__)
+    session = create_session(expire_on_commit=False)
+    invocation = Invocation(**options)
+    session.add(invocation)
+    session.commit()
+    log.debug('invocation = {0}'.format(invocation))
+    session.close()
+    return invocation
+
+
+def _describe_entry(entry):
+    """ names an entry without going back to the (possibly failing) db """
+    state = inspect(entry)
+    if state.dict.get('uuid') is not None:
+        return 'entry {0}'.format(state.dict['uuid'])
+    if state.identity is not None:
+        return 'entry with id {0}'.format(state.identity[0])
+    return 'an unsaved entry'
+
+
+def _commit_writes(session, pending):
+    raws = [raw for action, _, raw in pending
+            if action == 'insert' and raw is not None]
+    blobs = ResponseBlob.store_many(session, raws)
+    for action, entry, payload in pending:
+        if action == 'insert':
+            if payload is not None:
+                entry.raw_blob = blobs[ResponseBlob.digest_of(payload)]
+            session.add(entry)
+        else:
+            for attr, value in payload.items():
+                setattr(entry, attr, value)
+    session.commit()
+
+
+def apply_writes(session, pending):
+    """
+    Applies a batch of queued writes in one transaction.
+
+    Items are ``('insert', entry, raw)`` or ``('update', entry, values)``
+    tuples; the raw bodies of the inserts are stored as shared blobs. When
+    the batch fails it is retried one item at a time so a single bad item
+    only loses its own write.
+    """
+    log = logging.getLogger(__name__)
+    started = timeit.default_timer()
+    try:
+        _commit_writes(session, pending)
+        written = len(pending)
+    except Exception:
+        session.rollback()
+        metrics.increment('db_write_errors_total')
+        log.exception('issue encountered writing to the database:')
+        written = 0
+        for item in pending:
+            try:
+                _commit_writes(session, [item])
+                written += 1
+            except Exception:
+                session.rollback()
+                metrics.increment('db_write_errors_total')
+                log.error('dropped the queued {0} of {1}'.format(
+                    item[0], _describe_entry(item[1])
+                ))
+    log.debug('wrote {0} queued database changes'.format(written))
+    metrics.observe('db_write_seconds', timeit.default_timer() - started)
+    metrics.increment('db_writes_total', written)
+
+
+ResultSummary = namedtuple('ResultSummary', (
+    'uuid', 'hotel', 'checkin', 'checkout', 'guests', 'created',
+    'available', 'post_process', 'error', 'processed', 'invocation_id',
+))
+HotelSummary = namedtuple('HotelSummary', (
+    'hotel', 'checkin', 'checkout', 'guests', 'polls', 'available',
+    'errors', 'first', 'last',
+))
+_SUMMARY_COLUMNS = (
+    ScrapeResultEntry.uuid,
+    ScrapeResultEntry.hotel,
+    ScrapeResultEntry.checkin,
+    ScrapeResultEntry.checkout,
+    ScrapeResultEntry.guests,
+    ScrapeResultEntry.created,
+    ScrapeResultEntry.available,
+    ScrapeResultEntry.post_process,
+    ScrapeResultEntry.error,
+    ScrapeResultEntry.processed,
+    ScrapeResultEntry.invocation_id,
+)
+
+
+def _summaries(query):
+    return [ResultSummary._make(row) for row in query]
+
+
+def _for_search(query, search):
+    """
+    limits ``query`` to one ``(checkin, checkout, guests)`` search; any
+    part given as None matches every value
+    """
+    if search is None:
+        return query
+    entry = ScrapeResultEntry
+    checkin, checkout, guests = search
+    if checkin is not None:
+        query = query.filter(entry.checkin == _as_date(checkin))
+    if checkout is not None:
+        query = query.filter(entry.checkout == _as_date(checkout))
+    if guests is not None:
+        query = query.filter(entry.guests == guests)
+    return query
+
+
+def last_available(session, hotel, search=None):
+    """
+    When the hotel was last seen with availability, optionally for one
+    ``(checkin, checkout, guests)`` search only.
+
+    :rtype: datetime.datetime or None
+    """
+    query = session.query(func.max(ScrapeResultEntry.created)).filter(
+        ScrapeResultEntry.hotel == hotel,
+        ScrapeResultEntry.available.is_(True),
+    )
+    return _for_search(query, search).scalar()
+
+
+def last_result(session, hotel, search=None):
+    """
+    The most recent result recorded for the hotel, optionally for one
+    ``(checkin, checkout, guests)`` search only.
+
+    :rtype: ResultSummary or None
+    """
+    query = session.query(*_SUMMARY_COLUMNS).filter(
+        ScrapeResultEntry.hotel == hotel,
+    )
+    row = _for_search(query, search).order_by(
+        ScrapeResultEntry.created.desc()
+    ).first()
+    return ResultSummary._make(row) if row is not None else None
+
+
+def recent_results(session, hotel=None, since=None, limit=100, search=None):
+    """
+    Newest results first, optionally limited to one hotel, one
+    ``(checkin, checkout, guests)`` search and a start time.
+
+    :rtype: list of ResultSummary
+    """
+    query = _for_search(session.query(*_SUMMARY_COLUMNS), search)
+    if hotel is not None:
+        query = query.filter(ScrapeResultEntry.hotel == hotel)
+    if since is not None:
+        query = query.filter(ScrapeResultEntry.created >= since)
+    query = query.order_by(ScrapeResultEntry.created.desc())
+    return _summaries(query.limit(limit))
+
+
+def available_results(session, since=None, limit=100):
+    """
+    Newest results which found availability.
+
+    :rtype: list of ResultSummary
+    """
+    query = session.query(*_SUMMARY_COLUMNS).filter(
+        ScrapeResultEntry.available.is_(True),
+    )
+    if since is not None:
+        query = query.filter(ScrapeResultEntry.created >= since)
+    query = query.order_by(ScrapeResultEntry.created.desc())
+    return _summaries(query.limit(limit))
+
+
+def invocation_results(session, invocation_id):
+    """
+    Every result recorded by one run of dragonite, oldest first.
+
+    :rtype: list of ResultSummary
+    """
+    query = session.query(*_SUMMARY_COLUMNS).filter(
+        ScrapeResultEntry.invocation_id == invocation_id,
+    ).order_by(ScrapeResultEntry.created)
+    return _summaries(query)
+
+
+def result_by_uuid(session, ref_uuid):
+    """
+    Looks up a result by the UUID referenced in alerts.
+
+    :rtype: ResultSummary or None
+    """
+    row = session.query(*_SUMMARY_COLUMNS).filter(
+        ScrapeResultEntry.uuid == ref_uuid,
+    ).first()
+    return ResultSummary._make(row) if row is not None else None
+
+
+def hotel_summaries(session, since=None, search=None):
+    """
+    Poll, availability, and error counts per hotel and search, optionally
+    for one ``(checkin, checkout, guests)`` search only.
+
+    :rtype: list of HotelSummary
+    """
+    entry = ScrapeResultEntry
+    searched = (entry.hotel, entry.checkin, entry.checkout, entry.guests)
+    counts = (
+        func.count(entry.id),
+        func.sum(cast(entry.available, types.Integer)),
+        func.sum(cast(entry.error, types.Integer)),
+        func.min(entry.created),
+        func.max(entry.created),
+    )
+    query = session.query(*(searched + counts))
+    query = _for_search(query, search)
+    if since is not None:
+        query = query.filter(entry.created >= since)
+    query = query.group_by(*searched).order_by(*searched)
+    return [HotelSummary._make(row) for row in query]
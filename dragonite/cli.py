@@ -8,10 +8,40 @@ import click
 
 from .conf import settings
 from .constants import DRAGONITE_ASCII
-from .dragoncon import DragonCon
+from .utils import check_date
 
 
 @click.group(invoke_without_command=True)
+@click.option(
+    '--attachments', 'attachment_policy',
+    type=click.Choice(['full', 'gzip', 'region', 'omit']),
+    help=(
+        'How the raw response is attached to alert emails: as is, '
+        'gzipped (default), only the regions the scraper parses, or not '
+        'at all.'
+    )
+)
+@click.option(
+    '--attachment-max-kb', 'attachment_max_kb',
+    type=int,
+    help='Size the raw response attachment is truncated to, in KB.'
+)
+@click.option(
+    '--base-url', 'base_url',
+    metavar='URL',
+    help=(
+        'Send every hotel request to URL/<hotel host>/<path> instead, '
+        'e.g. a local site emulator.'
+    )
+)
+@click.option(
+    '--block-threshold', 'block_threshold',
+    type=float,
+    help=(
+        'Log the stack of any greenlet holding up the gevent hub for '
+        'longer than this many seconds (off by default).'
+    )
+)
 @click.option(
     '-c', '--cache', 'cache',
     is_flag=True, default=False,
@@ -20,16 +50,71 @@ from .dragoncon import DragonCon
         'and 0/1 to enable/disable caching.'
     )
 )
+@click.option(
+    '--db-url', 'db_url',
+    envvar='DRAGONITE_DB_URL',
+    help='SQLAlchemy database URL; defaults to sqlite:///dragonite.sqlite3'
+)
+@click.option(
+    '--db-pool-size', 'db_pool_size',
+    type=int,
+    help='Number of pooled database connections.'
+)
+@click.option(
+    '--db-echo', 'db_echo',
+    is_flag=True, default=None,
+    help='Logs every SQL statement issued to the database.'
+)
+@click.option(
+    '--db-batch-size', 'db_batch_size',
+    type=int,
+    help='Max number of queued database writes committed together.'
+)
+@click.option(
+    '--db-max-latency', 'db_max_latency',
+    type=float,
+    help='Max seconds a database write waits in the queue before a commit.'
+)
 @click.option(
     '-d', '--debug', 'debug',
     is_flag=True, default=False,
     help='Puts Dragonite into debug mode.'
 )
+@click.option(
+    '--host-rate', 'host_rate',
+    type=float,
+    help='Max requests per second sent to a single host (0 = unlimited).'
+)
+@click.option(
+    '--host-burst', 'host_burst',
+    type=int,
+    help='Number of requests a host may receive in a burst.'
+)
+@click.option(
+    '--host-connections', 'host_connections',
+    type=int,
+    help='Max concurrent connections to a single host (0 = unlimited).'
+)
+@click.option(
+    '--jitter', 'rate_jitter',
+    type=float,
+    help='Max random seconds added when a request is rate limited.'
+)
 @click.option(
     '-i', '--info', 'info',
     is_flag=True, default=False,
     help='Dragonite logs configuration data before running.'
 )
+@click.option(
+    '--interval', 'interval',
+    type=float,
+    help='Base number of seconds between polls of each hotel.'
+)
+@click.option(
+    '--max-interval', 'max_interval',
+    type=float,
+    help='Longest number of seconds polling may back off to.'
+)
 @click.option(
     '-l', '--loglevel', 'loglevel',
     type=click.Choice(['debug', 'info', 'warn', 'error']),
@@ -41,16 +126,96 @@ from .dragoncon import DragonCon
     type=int,
     help='Set the max number of tries to find room availability.'
 )
+@click.option(
+    '--metrics-file', 'metrics_file',
+    type=click.Path(dir_okay=False, writable=True),
+    help=(
+        'File the metrics are periodically written to; Prometheus text '
+        'for .prom/.txt files, JSON otherwise.'
+    )
+)
+@click.option(
+    '--metrics-interval', 'metrics_interval',
+    type=float,
+    help='Seconds between metrics file writes.'
+)
 @click.option(
     '-n', '--nodb', 'nodb',
     is_flag=True, default=False,
     help='Prevents Dragonite from attempting to store any info in a database.'
 )
+@click.option(
+    '--notify-retries', 'notify_retries',
+    type=int,
+    help='Times a failed alert is retried before giving up.'
+)
+@click.option(
+    '--notify-timeout', 'notify_timeout',
+    type=float,
+    help='Seconds a single alert may take to send.'
+)
+@click.option(
+    '--parser', 'parse_executor',
+    type=click.Choice(['inline', 'thread', 'process']),
+    help='Where responses are parsed; defaults to a thread pool.'
+)
+@click.option(
+    '--parse-workers', 'parse_workers',
+    type=int,
+    help='Number of parse threads or processes.'
+)
+@click.option(
+    '--pool-size', 'session_pool_size',
+    type=int,
+    help='Max keep-alive connections each scraper keeps open per host.'
+)
+@click.option(
+    '--profile', 'profile',
+    metavar='PREFIX',
+    help=(
+        'Profile the run and write PREFIX.pstats, PREFIX.collapsed (for '
+        'flame graphs) and PREFIX.txt when it ends.'
+    )
+)
+@click.option(
+    '--session-max-age', 'session_max_age',
+    type=int,
+    help='Seconds before a scraper HTTP session is recycled (0 = never).'
+)
+@click.option(
+    '--warmup-ttl', 'warmup_ttl',
+    type=int,
+    help='Seconds to reuse cookies from landing-page warm-up requests.'
+)
+@click.option(
+    '--remind-every', 'alert_reminder',
+    type=float,
+    help=(
+        'Seconds between repeat alerts while a search stays available; '
+        'by default only the change to available is alerted.'
+    )
+)
 @click.option(
     '-s', '--simple', 'simple',
     is_flag=True, default=False,
     help='Prevents Dragonite from logging extraneous things like ASCII art.'
 )
+@click.option(
+    '--engine', 'engine',
+    type=click.Choice(['gevent', 'asyncio']),
+    help=(
+        'Crawl engine; asyncio runs without monkey patching and needs '
+        'aiohttp installed.'
+    )
+)
+@click.option(
+    '--workers', 'workers',
+    type=int,
+    help=(
+        'Number of processes to shard the monitors across; scrapers of the '
+        'same host always share a process.'
+    )
+)
 @click.option(
     '--verbose', 'verbose',
     is_flag=True, default=False,
@@ -59,7 +224,8 @@ from .dragoncon import DragonCon
 @click.version_option(message='%(prog)s %(version)s')
 @click.pass_context
 def dragonite(
-    context, cache, debug, info, loglevel, max_attempts, nodb, simple, verbose
+    context, cache, debug, info, loglevel, max_attempts, nodb, simple, verbose,
+    **tuning
 ):
     # CLI options/args override defaults and env vars
     options = {
@@ -73,7 +239,12 @@ def dragonite(
     }
     if max_attempts is not None:
         options['max_attempts'] = max_attempts
+    # tuning options only override the defaults when given explicitly
+    options.update(
+        (key, value) for key, value in tuning.items() if value is not None
+    )
     settings.configure(**options)
+    from .dragoncon import DragonCon
     dragoncon_bot = DragonCon()
     context.obj = dragoncon_bot
     log = logging.getLogger(__name__)
@@ -95,18 +266,57 @@ def dragonite(
         ))
 
 
+def _validate_stays(context, param, value):
+    """ parses each CHECKIN:CHECKOUT stay into checkin and checkout dates """
+    stays = []
+    for stay in value:
+        if ':' not in stay:
+            raise click.BadParameter(
+                '"{0}" is not CHECKIN:CHECKOUT'.format(stay)
+            )
+        try:
+            checkin, checkout = [check_date(d) for d in stay.split(':', 1)]
+        except (ValueError, OverflowError):
+            raise click.BadParameter(
+                '"{0}" does not hold two valid dates'.format(stay)
+            )
+        if checkout <= checkin:
+            raise click.BadParameter(
+                '"{0}" checks out before it checks in'.format(stay)
+            )
+        stays.append({'checkin': checkin, 'checkout': checkout})
+    return stays
+
+
 @click.command()
 @click.option(
     '-m', '--max-tries', 'max_attempts',
     type=int, default=1,
     help='Set the max number of tries to find room availability.'
 )
+@click.option(
+    '--stay', 'stays',
+    multiple=True, callback=_validate_stays,
+    help=(
+        'CHECKIN:CHECKOUT dates of a stay to search for; may be repeated '
+        'to watch several partial stays at once.'
+    )
+)
+@click.option(
+    '--guests', 'guests',
+    type=int, multiple=True,
+    help='Number of guests to search for; may be repeated.'
+)
 @click.pass_context
-def rooms(context, max_attempts):
+def rooms(context, max_attempts, stays, guests):
     log = logging.getLogger(__name__)
     if max_attempts != 1:
         log.warning('max attempts is not 1! ({0})'.format(max_attempts))
     settings.max_attempts = max_attempts
+    if stays:
+        settings.stays = stays
+    if guests:
+        settings.guests = list(guests)
     log.debug('running "rooms" subcommand')
     context.obj.run()
 
@@ -119,31 +329,107 @@ def rooms(context, max_attempts):
 )
 @click.pass_context
 def test(context, message):
-    def get_cookies_dict():
-        return {'test-cookie': 'some stupid value'}
     from dragonite.scrapers.base import ScrapeResults
     log = logging.getLogger(__name__)
     settings.debug = True
     if message is not None:
         settings.inject_message = message
     with settings.comm as gateway:
-        log.debug(gateway._gateway._server)
-        log.debug(gateway._gateway._smtp_user)
-        log.debug(gateway._gateway._passcode)
+        log.debug('{0}:{1}'.format(
+            gateway.gateway.server, gateway.gateway.port
+        ))
         test_data = ScrapeResults(None)
-        test_data._raw = 'This is test raw_response data!'
-        test_data._session = ScrapeResults(None)
-        test_data._session.cookies = ScrapeResults(None)
-        test_data._session.cookies.get_dict = get_cookies_dict
-        test_data._parent = ScrapeResults(None)
-        test_data._parent.friendly = 'TEST HOTEL NAME'
-        test_data._parent.phone = '555-555-5555'
-        test_data._parent.link = 'http://lmgtfy.com/?q=dragon+con'
+        test_data.raw = 'This is test raw_response data!'
+        test_data.cookies = {'test-cookie': 'some stupid value'}
+        test_data.parent = ScrapeResults(None)
+        test_data.parent.friendly = 'TEST HOTEL NAME'
+        test_data.parent.phone = '555-555-5555'
+        test_data.parent.link = 'http://lmgtfy.com/?q=dragon+con'
         gateway.notify(test_data)
 
 
+@click.command()
+@click.option(
+    '--polls', 'polls',
+    type=int, default=20,
+    help='Polls of every hotel search.'
+)
+@click.option(
+    '--searches', 'searches',
+    type=int, default=1,
+    help='Searches per hotel, for 1 up to this many guests.'
+)
+@click.option(
+    '--latency', 'latency',
+    default='lognormal:150:0.5',
+    help=(
+        'Emulated response time distribution in ms: fixed:MS, '
+        'uniform:MIN:MAX, exponential:MEAN or lognormal:MEDIAN:SIGMA.'
+    )
+)
+@click.option(
+    '--error-rate', 'error_rate',
+    type=float, default=0.01,
+    help='Fraction of responses which fail with a 503.'
+)
+@click.option(
+    '--timeout-rate', 'timeout_rate',
+    type=float, default=0.0,
+    help='Fraction of responses which hang past the request timeout.'
+)
+@click.option(
+    '--available-rate', 'available_rate',
+    type=float, default=0.1,
+    help='Fraction of result pages showing available rooms.'
+)
+@click.option(
+    '--change-rate', 'change_rate',
+    type=float, default=0.5,
+    help='Fraction of polls for which a result page changes.'
+)
+@click.option(
+    '--maintenance-rate', 'maintenance_rate',
+    type=float, default=0.02,
+    help='Fraction of passkey searches redirected to maintenance.'
+)
+@click.option(
+    '--page-kb', 'page_kb',
+    type=int, default=50,
+    help='Approximate size of the emulated result pages.'
+)
+@click.pass_context
+def bench(context, polls, searches, **emulation):
+    """ Load test the crawl against a local hotel site emulator. """
+    from .emulator import Latency, run_bench
+    try:
+        Latency(emulation['latency'])
+    except ValueError as e:
+        raise click.BadParameter('{0}'.format(e), param_hint='--latency')
+    report = run_bench(polls, searches, **emulation)
+    click.echo(
+        '{engine} engine: {probes} searches x {polls_each} polls'.format(
+            polls_each=polls, **report
+        )
+    )
+    click.echo(
+        '{polls} polls in {seconds:.1f} s: {polls_per_second:.1f} polls/s'
+        .format(**report)
+    )
+    click.echo(
+        'poll latency: p50 {0:.1f} ms  p95 {1:.1f} ms  p99 {2:.1f} ms'.format(
+            *[(report[q] or 0) * 1000 for q in ('p50', 'p95', 'p99')]
+        )
+    )
+    click.echo(
+        'cpu: {0:.2f} ms per poll; {1} scrape errors; {2} alerts'.format(
+            report['cpu_per_poll'] * 1000, report['errors'], report['alerts']
+        )
+    )
+
+
 dragonite.add_command(rooms)
 dragonite.add_command(test)
+dragonite.add_command(bench)
 
 
 if __name__ == '__main__':
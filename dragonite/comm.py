@@ -4,7 +4,11 @@ from __future__ import absolute_import, unicode_literals
 import io
 import json
 import logging
+import smtplib
+import socket
+import timeit
 import uuid
+import zlib
 
 from collections import OrderedDict
 from email.mime.application import MIMEApplication
@@ -14,10 +18,246 @@ from email.mime.text import MIMEText
 from armory.phone import phone
 from armory.serialize import jsonify
 
-from jinja2 import Environment, PackageLoader
+from jinja2 import Environment, FileSystemBytecodeCache, PackageLoader
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
 
 log = logging.getLogger(__name__)
 
+RAW_CHUNK = 64 * 1024
+
+
+def _utf8_chunks(text, size=RAW_CHUNK):
+    """ encodes ``text`` a slice at a time rather than all at once """
+    for start in range(0, len(text), size):
+        yield text[start:start + size].encode('utf-8')
+
+
+def gzip_limited(text, limit=None):
+    """
+    Gzips ``text`` a chunk at a time, stopping once the compressed output
+    reaches ``limit`` bytes; returns ``(data, truncated)``.
+    """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    output = []
+    size = 0
+    truncated = False
+    for chunk in _utf8_chunks(text):
+        if limit and size >= limit:
+            truncated = True
+            break
+        output.append(compressor.compress(chunk))
+        output.append(compressor.flush(zlib.Z_SYNC_FLUSH))
+        size += len(output[-2]) + len(output[-1])
+    output.append(compressor.flush())
+    return b''.join(output), truncated
+
+
+def truncate_utf8(text, limit=None):
+    """ cuts ``text`` to at most ``limit`` UTF-8 bytes; (text, truncated) """
+    if not limit or len(text) * 4 <= limit:
+        return text, False
+    size = 0
+    for start in range(0, len(text), RAW_CHUNK):
+        chunk = text[start:start + RAW_CHUNK].encode('utf-8')
+        if size + len(chunk) > limit:
+            cut = chunk[:limit - size].decode('utf-8', 'ignore')
+            return text[:start] + cut, True
+        size += len(chunk)
+    return text, False
+
+
+class SMTPConnection(phone.EmailSMS):
+    """
+    ``EmailSMS`` with a configurable port, optional STARTTLS and login,
+    and a NOOP health check so a pooled connection can be trusted again
+    after sitting idle.
+    """
+
+    def __init__(self, server, username=None, passcode=None, sender=None,
+                 port=None, starttls=True, timeout=30):
+        super(SMTPConnection, self).__init__(
+            server, username, passcode, sender=sender, logger=__name__
+        )
+        self._port = port
+        self._smtp_tls = starttls
+        self._smtp_login = bool(username)
+        self._timeout = timeout
+        self.used = None
+
+    def _initialize_smtp(self):
+        smtp = smtplib.SMTP(
+            self._server, self._port or 0, timeout=self._timeout
+        )
+        if self._smtp_tls:
+            smtp.starttls()
+        if self._smtp_login:
+            smtp.login(self._smtp_user, self._passcode)
+        self._smtp = smtp
+        self.used = timeit.default_timer()
+
+    @property
+    def idle(self):
+        if self.used is None:
+            return 0
+        return timeit.default_timer() - self.used
+
+    def healthy(self):
+        if self._smtp is None:
+            return False
+        try:
+            code, _ = self._smtp.noop()
+        except (smtplib.SMTPException, socket.error):
+            return False
+        return code == 250
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, socket.error):
+                self._smtp.close()
+        self._smtp = None
+
+    def abort(self):
+        """ drops the connection without QUIT, e.g. when killed mid-send """
+        if self._smtp is not None:
+            self._smtp.close()
+        self._smtp = None
+
+    def send(self, recipient, message):
+        self.smtp.sendmail(self._sender, recipient, message)
+        self.used = timeit.default_timer()
+        log.debug('sent to {0}'.format(recipient))
+
+
+class SMTPPool(object):
+    """
+    Fixed set of ``SMTPConnection`` objects kept open between alerts.
+
+    Connections are opened on first use and handed out most recently used
+    first. One idle for more than ``idle_check`` seconds is checked with
+    NOOP before use and reopened if the server has dropped it; a send
+    failing on a dropped connection is retried once on a fresh one.
+    ``send_all`` sends several messages at once, one connection each.
+    """
+
+    def __init__(self, server, username=None, passcode=None, sender=None,
+                 port=None, starttls=True, timeout=30, pool_size=4,
+                 idle_check=30):
+        self.size = max(1, pool_size)
+        self.idle_check = idle_check
+        self._idle = queue.LifoQueue()
+        for _ in range(self.size):
+            self._idle.put(SMTPConnection(
+                server, username, passcode, sender=sender, port=port,
+                starttls=starttls, timeout=timeout,
+            ))
+        self.sender = sender if sender else username
+        self.server = server
+        self.port = port
+
+    def checkout(self):
+        connection = self._idle.get()
+        if connection.idle > self.idle_check and not connection.healthy():
+            log.info('SMTP connection went stale; reconnecting')
+            connection.close()
+        return connection
+
+    def checkin(self, connection):
+        self._idle.put(connection)
+
+    def send(self, recipient, message):
+        connection = self.checkout()
+        try:
+            try:
+                connection.send(recipient, message)
+            except (smtplib.SMTPServerDisconnected, socket.error):
+                log.info('SMTP connection dropped; retrying once')
+                connection.close()
+                connection.send(recipient, message)
+        except Exception:
+            connection.close()
+            raise
+        except BaseException:
+            connection.abort()
+            raise
+        finally:
+            self.checkin(connection)
+
+    def send_all(self, messages, delivered=None):
+        """
+        Sends every ``(recipient, message)`` pair concurrently; raises
+        ``SMTPFanOutError`` naming the recipients which could not be sent.
+
+        Each recipient sent to is appended to ``delivered`` as soon as it
+        is done, so a retry after a failure or timeout can skip them.
+        Sends still running when the caller times out are killed.
+        """
+        def attempt(job):
+            try:
+                self.send(*job)
+            except Exception as e:
+                log.error('sending to {0} failed: {1!r}'.format(job[0], e))
+                return job[0]
+            if delivered is not None:
+                delivered.append(job[0])
+            return None
+
+        workers = min(self.size, len(messages))
+        if workers <= 1:
+            failed = [attempt(job) for job in messages]
+        elif _cooperative():
+            from gevent.pool import Pool
+            pool = Pool(workers)
+            try:
+                failed = pool.map(attempt, messages)
+            finally:
+                pool.kill()
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(workers) as executor:
+                failed = list(executor.map(attempt, messages))
+        failed = [recipient for recipient in failed if recipient is not None]
+        if failed:
+            raise SMTPFanOutError(failed)
+
+    def close(self):
+        """ quits every idle connection; they reopen on next use """
+        connections = []
+        while True:
+            try:
+                connections.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for connection in connections:
+            connection.close()
+            self._idle.put(connection)
+
+
+class SMTPFanOutError(Exception):
+    """ Raised when some recipients of an alert could not be sent to. """
+
+    def __init__(self, recipients):
+        self.recipients = recipients
+        super(SMTPFanOutError, self).__init__(
+            'could not send to {0}'.format(', '.join(
+                '{0}'.format(r) for r in recipients
+            ))
+        )
+
+
+def _cooperative():
+    """ whether sockets are gevent's, so greenlets send in parallel """
+    try:
+        import gevent.monkey
+    except ImportError:  # pragma: no cover
+        return False
+    return gevent.monkey.is_module_patched('socket')
+
 
 class CommProxy(object):
     COMM_CONFIG_FILE = '.commconfig'
@@ -51,24 +291,41 @@ class CommProxy(object):
             self._lookups.get(to) for to in commdata.get('recipients', [])
         ]
 
+        # templates never change during a run; compiled bytecode is kept on
+        # disk so later runs skip compiling them at all
         self._jinja = Environment(
-            loader=PackageLoader('dragonite', 'templates')
+            loader=PackageLoader('dragonite', 'templates'),
+            bytecode_cache=FileSystemBytecodeCache(
+                pattern='__dragonite_%s.cache'
+            ),
+            auto_reload=False,
         )
         self.sms_template = self._jinja.get_template('sms_template.j2')
-        self.email_template = self._jinja.get_template('email_template.j2')
+        self.email_text_template = self._jinja.get_template('email_text.j2')
+        self.email_html_template = self._jinja.get_template('email_html.j2')
+        self.to_name = ', '.join(to['first_name'] for to in self.recipients)
+        self.to_emails = [to['email'] for to in self.recipients]
+        self._settings_attachment = None
         self._email_subject = kwargs.get('subject', self.DEFAULT_EMAIL_SUBJECT)
         self._mms_subject = kwargs.get('mms_subject', self.DEFAULT_MMS_SUBJECT)
 
     def __enter__(self):
+        """
+        Hands out the connection pool; connections outlive the ``with``
+        block so the next alert does not pay for a new SMTP handshake.
+        """
         if self._gateway is None:
-            self._gateway = phone.EmailSMS(**self._smtp_login)
-        self.gateway = self._gateway.__enter__()
+            self._gateway = SMTPPool(**self._smtp_login)
+        self.gateway = self._gateway
         return self
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
-        self.gateway.__exit__(exc_type, exc_value, exc_traceback)
         self.gateway = None
 
+    def close(self):
+        if self._gateway is not None:
+            self._gateway.close()
+
     @property
     def email_subject(self):
         if self.conf.debug:
@@ -81,7 +338,61 @@ class CommProxy(object):
             return '***TEST*** ' + self._mms_subject
         return self._mms_subject
 
-    def notify(self, data_object, ref_uuid=None):
+    @staticmethod
+    def attachment(part, filename):
+        part.add_header('Content-Disposition', 'attachment', filename=filename)
+        return part
+
+    @property
+    def settings_attachment(self):
+        """ settings.json is the same for every alert of a run """
+        if self._settings_attachment is None:
+            self._settings_attachment = self.attachment(MIMEApplication(
+                self.conf.dumps(pretty=True), _subtype='json'
+            ), 'settings.json')
+        return self._settings_attachment
+
+    def raw_attachment(self, data_object):
+        """
+        The raw response as shaped by ``settings.attachment_policy``:
+
+        - ``full``: the page as is;
+        - ``gzip``: the page gzipped, compressed a chunk at a time;
+        - ``region``: only the ``parse_regions`` the scraper reads, or the
+          page when none of them matched;
+        - ``omit``: nothing.
+
+        Whatever is attached is cut to ``attachment_max_kb`` (0 for no
+        limit); None is returned when there is nothing to attach.
+        """
+        policy = self.conf.attachment_policy
+        raw = data_object.raw
+        if policy == 'omit' or not raw:
+            return None
+        limit = self.conf.attachment_max_kb * 1024
+
+        if policy == 'region':
+            region_markup = getattr(data_object.parent, 'region_markup', None)
+            markup = region_markup(raw) if region_markup else None
+            # nothing matched is worth seeing in full, within the limit
+            if markup:
+                raw = markup
+
+        if policy == 'gzip':
+            data, truncated = gzip_limited(raw, limit)
+            part = MIMEApplication(data, _subtype='gzip')
+            filename = 'raw_response.html.gz'
+        else:
+            text, truncated = truncate_utf8(raw, limit)
+            part = MIMEText(text, _subtype='html', _charset='utf-8')
+            filename = 'raw_response.html'
+        if truncated:
+            log.info('raw response attachment cut to {0} KB'.format(
+                self.conf.attachment_max_kb
+            ))
+        return self.attachment(part, filename)
+
+    def notify(self, data_object, ref_uuid=None, delivered=None):
         """
         Sends SMS/MMS and email messages based on settings.
 
@@ -89,26 +400,31 @@ class CommProxy(object):
         :type data_object: dragonite.scrapers.base.ScrapeResults
         :param ref_uuid: the UUID of the scrape for reference if needed
         :type ref_uuid: uuid.UUID or a str UUID
+        :param delivered: recipients this alert already reached, which are
+            skipped; the ones reached now are appended to it
+        :type delivered: list
 
         NOTE: SMS/MMS messages do not appear to work properly unless
         sent to the gateway as a multipart/mixed email.
 
         NOTE: SMS messages can only be up to 160 characters; it needs to
         use an MMS gateway if it is longer than that limit.
+
+        The email and every SMS/MMS are handed to the gateway together so
+        they go out in parallel over the pooled connections.
         """
         alert_uuid = str(ref_uuid) if ref_uuid else uuid.uuid4().hex
         log.debug('notify UUID={0}'.format(alert_uuid))
+        outgoing = []
+        sent = []
 
         template_variables = {
-            'to_name': ', '.join(
-                [to['first_name'] for to in self.recipients]
-            ),
+            'to_name': self.to_name,
             'hotel': {
                 'name': data_object.parent.friendly,
                 'phone': data_object.parent.phone,
-                'phone': data_object.parent.phone,
                 'link': data_object.parent.link,
-                'rooms': '<unknown>',
+                'rooms': getattr(data_object.parent, 'search', '<unknown>'),
             },
             'debug_test': self.conf.debug,
             'alert_uuid': alert_uuid,
@@ -117,63 +433,34 @@ class CommProxy(object):
             template_variables['inject_message'] = self.conf.inject_message
 
         if self.send_email:
-            cookies = json.dumps(
-                data_object.session.cookies.get_dict(),
-                indent=2
-            )
-            to_list = [to['email'] for to in self.recipients]
-
             email = MIMEMultipart(_subtype='mixed')
             email['subject'] = self.email_subject
-            email['to'] = ', '.join(to_list)
-            email['from'] = self.gateway._sender
+            email['to'] = ', '.join(self.to_emails)
+            email['from'] = self.gateway.sender
             email['sender'] = 'dragonite@neuroticnerd.com'
-            email['reply-to'] = ', '.join(to_list)
-
-            body_text_plain = self.email_template.render(
-                render_html=False,
-                **template_variables
-            )
-            body_text_html = self.email_template.render(
-                render_html=True,
-                **template_variables
-            )
+            email['reply-to'] = email['to']
+
             email_body = MIMEMultipart(_subtype='alternative')
-            email_body.attach(MIMEText(body_text_plain, _subtype='plain'))
-            email_body.attach(MIMEText(body_text_html, _subtype='html'))
+            email_body.attach(MIMEText(
+                self.email_text_template.render(**template_variables),
+                _subtype='plain'
+            ))
+            email_body.attach(MIMEText(
+                self.email_html_template.render(**template_variables),
+                _subtype='html'
+            ))
             email.attach(email_body)
+            raw_response = self.raw_attachment(data_object)
+            if raw_response is not None:
+                email.attach(raw_response)
+            email.attach(self.attachment(MIMEApplication(
+                json.dumps(data_object.cookies, indent=2), _subtype='json'
+            ), 'cookies.json'))
+            email.attach(self.settings_attachment)
 
-            raw_response = MIMEText(data_object.raw, _subtype='html')
-            raw_response.add_header(
-                'Content-Disposition',
-                'attachment',
-                filename='raw_response.html'
-            )
-            email.attach(raw_response)
-
-            cookies = MIMEApplication(cookies, _subtype='json')
-            cookies.add_header(
-                'Content-Disposition',
-                'attachment',
-                filename='cookies.json'
-            )
-            email.attach(cookies)
-
-            config = MIMEApplication(
-                self.conf.dumps(pretty=True), _subtype='json'
-            )
-            config.add_header(
-                'Content-Disposition',
-                'attachment',
-                filename='settings.json'
-            )
-            email.attach(config)
-
-            self.gateway.send(to_list, email.as_string())
-            log.debug((
-                '*************************\n'
-                'email sent to {0}:\n\n{1}'
-            ).format(template_variables['to_name'], email.as_string()))
+            serialized = email.as_string()
+            outgoing.append((self.to_emails, serialized))
+            sent.append(('email', self.to_name, serialized))
 
         if self.send_sms:
             message_text = self.sms_template.render(**template_variables)
@@ -186,16 +473,27 @@ class CommProxy(object):
             if message_type == 'mms':
                 message['subject'] = self.mms_subject
             message.attach(MIMEText(message_text, _subtype='plain'))
+            # no per-recipient headers, so one serialization serves everyone
+            serialized = message.as_string()
             for to in self.recipients:
-                self.gateway.send(to[message_type], message.as_string())
+                outgoing.append((to[message_type], serialized))
+                sent.append((message_type.upper(), to['comment'], serialized))
+
+        if delivered:
+            pending = [
+                (job, info) for job, info in zip(outgoing, sent)
+                if job[0] not in delivered
+            ]
+            outgoing = [job for job, _ in pending]
+            sent = [info for _, info in pending]
+        if outgoing:
+            self.gateway.send_all(outgoing, delivered)
+        if log.isEnabledFor(logging.DEBUG):
+            for kind, to_name, serialized in sent:
                 log.debug((
                     '*************************\n'
                     '{0} sent to {1}:\n\n{2}'
-                ).format(
-                    message_type.upper(),
-                    to['comment'],
-                    message.as_string()
-                ))
+                ).format(kind, to_name, serialized))
 
     def dumps(self, constrain=None, pretty=False):
         info = OrderedDict()
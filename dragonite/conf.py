@@ -12,7 +12,8 @@ from armory.serialize import jsonexpand, jsonify
 
 from dateutil.parser import parse
 
-from .comm import CommProxy
+from .utils import check_date, fork_context
+
 
 if (sys.version_info > (3, 0)):
     # FileNotFoundError is a built-in for Python 3
@@ -107,6 +108,31 @@ class DragoniteConfig(object):
     fmt_short = '%(message)s'
     fmt_date = '%Y-%m-%d %H:%M:%S'
     MAX_PRICE = 300
+    INTERVAL = 1
+    MAX_INTERVAL = 60
+    ERROR_BACKOFF = 2.0
+    IDLE_BACKOFF = 1.05
+    MIN_DELAY = 0.1
+    SESSION_POOL_SIZE = 4
+    SESSION_MAX_AGE = 900
+    WARMUP_TTL = 600
+    HOST_RATE = 4.0
+    HOST_BURST = 8
+    HOST_CONNECTIONS = 4
+    RATE_JITTER = 0.25
+    PARSE_EXECUTOR = 'thread'
+    PARSE_WORKERS = 2
+    ENGINE = 'gevent'
+    DB_BATCH_SIZE = 50
+    DB_MAX_LATENCY = 2.0
+    ALERT_REMINDER = 0
+    NOTIFY_QUEUE_SIZE = 100
+    NOTIFY_RETRIES = 3
+    NOTIFY_TIMEOUT = 30.0
+    ATTACHMENT_POLICY = 'gzip'
+    ATTACHMENT_MAX_KB = 256
+    METRICS_INTERVAL = 15.0
+    BLOCK_THRESHOLD = 0
 
     def __init__(self, **options):
         if options:
@@ -148,14 +174,102 @@ class DragoniteConfig(object):
         else:
             self.use_cache = bool(cc)
 
-        self.interval = 1
+        self.interval = options.get('interval', self.INTERVAL)
+        self.max_interval = options.get('max_interval', self.MAX_INTERVAL)
+        self.error_backoff = options.get('error_backoff', self.ERROR_BACKOFF)
+        self.idle_backoff = options.get('idle_backoff', self.IDLE_BACKOFF)
+        self.min_delay = options.get('min_delay', self.MIN_DELAY)
         self.max_attempts = options.get('max_attempts', 0)
         self.debug = options.get('debug', False)
         self.info = options.get('info', True)
         self.simple = options.get('simple', False)
         self.nodb = options.get('nodb', False)
+        self.session_pool_size = options.get(
+            'session_pool_size', self.SESSION_POOL_SIZE
+        )
+        self.session_max_age = options.get(
+            'session_max_age', self.SESSION_MAX_AGE
+        )
+        self.warmup_ttl = options.get('warmup_ttl', self.WARMUP_TTL)
+        self.host_rate = options.get('host_rate', self.HOST_RATE)
+        self.host_burst = options.get('host_burst', self.HOST_BURST)
+        self.host_connections = options.get(
+            'host_connections', self.HOST_CONNECTIONS
+        )
+        self.rate_jitter = options.get('rate_jitter', self.RATE_JITTER)
+        self.parse_executor = options.get(
+            'parse_executor', self.PARSE_EXECUTOR
+        )
+        self.parse_workers = options.get('parse_workers', self.PARSE_WORKERS)
+        self.workers = options.get('workers', 1)
+        self.engine = options.get('engine', self.ENGINE)
+        if self.engine == 'asyncio' and self.workers > 1:
+            self._warnings.append(
+                'ignoring --workers; the asyncio engine runs in one process'
+            )
+            self.workers = 1
+        if fork_context() is None:
+            # worker processes inherit the settings and scrapers by forking
+            if self.workers > 1:
+                self._warnings.append(
+                    'ignoring --workers; this platform cannot fork'
+                )
+                self.workers = 1
+            if self.parse_executor == 'process':
+                self._warnings.append(
+                    'parsing in threads; this platform cannot fork'
+                )
+                self.parse_executor = 'thread'
+        self.db_url = options.get('db_url', None)
+        self.db_pool_size = options.get('db_pool_size', None)
+        self.db_echo = options.get('db_echo', False)
+        self.db_batch_size = options.get('db_batch_size', self.DB_BATCH_SIZE)
+        self.db_max_latency = options.get(
+            'db_max_latency', self.DB_MAX_LATENCY
+        )
+
+        self.alert_reminder = options.get(
+            'alert_reminder', self.ALERT_REMINDER
+        )
+        self.notify_queue_size = options.get(
+            'notify_queue_size', self.NOTIFY_QUEUE_SIZE
+        )
+        self.notify_retries = options.get(
+            'notify_retries', self.NOTIFY_RETRIES
+        )
+        self.notify_timeout = options.get(
+            'notify_timeout', self.NOTIFY_TIMEOUT
+        )
+        self.attachment_policy = options.get(
+            'attachment_policy', self.ATTACHMENT_POLICY
+        )
+        self.attachment_max_kb = options.get(
+            'attachment_max_kb', self.ATTACHMENT_MAX_KB
+        )
+        self.metrics_file = options.get('metrics_file', None)
+        self.metrics_interval = options.get(
+            'metrics_interval', self.METRICS_INTERVAL
+        )
+        self.profile = options.get('profile', None)
+        self.base_url = options.get('base_url', None)
+        self.block_threshold = options.get(
+            'block_threshold', self.BLOCK_THRESHOLD
+        )
+
+        self._comm = None
 
-        self.comm = CommProxy(settings=self)
+    @property
+    def comm(self):
+        """ the alert gateway; reading .commconfig and compiling templates
+        is deferred until something actually needs to send or show it """
+        if getattr(self, '_comm', None) is None:
+            from .comm import CommProxy
+            self._comm = CommProxy(settings=self)
+        return self._comm
+
+    @comm.setter
+    def comm(self, value):
+        self._comm = value
 
     @property
     def cache(self):
@@ -188,6 +302,49 @@ class DragoniteConfig(object):
     def checkout(self):
         return self.cache.get('checkout', None)
 
+    @property
+    def hot_windows(self):
+        """ list of {"start": ..., "end": ..., "interval": ...} mappings """
+        return self.cache.get('hot_windows', [])
+
+    @property
+    def stays(self):
+        """ list of {"checkin": ..., "checkout": ...} mappings """
+        if getattr(self, '_stays', None):
+            return self._stays
+        return self.cache.get('stays', [])
+
+    @stays.setter
+    def stays(self, value):
+        self._stays = value
+
+    @property
+    def guests(self):
+        if getattr(self, '_guests', None):
+            return self._guests
+        return self.cache.get('guests', [4])
+
+    @guests.setter
+    def guests(self, value):
+        self._guests = value
+
+    def search_matrix(self, start, end):
+        """
+        Expands the configured stays and guest counts into searches.
+
+        :returns: list of ``(checkin, checkout, guests)`` tuples; with no
+            stays configured the single stay is ``start`` to ``end``.
+        """
+        stays = [
+            (check_date(s['checkin']), check_date(s['checkout']))
+            for s in self.stays
+        ] or [(start, end)]
+        return [
+            (checkin, checkout, guests)
+            for checkin, checkout in stays
+            for guests in self.guests
+        ]
+
     @property
     def use_db(self):
         return (not self.nodb)
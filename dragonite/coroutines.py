@@ -3,34 +3,85 @@ from __future__ import absolute_import, unicode_literals
 
 import logging
 import timeit
-from decimal import Decimal
+import warnings
 
 from armory.gevent import patch_gevent_hub
 
 import gevent
+import gevent.events
 import gevent.monkey
 from gevent.pool import Group
-from gevent.queue import Queue
+from gevent.queue import Empty, Queue
 
 import requests
 
-from . import beaker, scrapers
+from . import (
+    alerts, beaker, executor, metrics, scheduler, scrapers, sharding,
+)
 from .conf import settings
-from .utils import LogAndForget
 
 
 pool_size = 5
 result_queue = Queue()
+write_queue = Queue()
 invocation = None
 log = logging.getLogger(__name__)
 
 
 def monkey_patch():
     patch_gevent_hub()
+    _configure_monitor()
     gevent.monkey.patch_all()
     return True
 
 
+def watch_hub():
+    """
+    Starts gevent's monitor thread, which checks every
+    ``block_threshold`` seconds whether the hub has switched greenlets
+    since its last look; each time it has not, the greenlet hogging the
+    hub is logged with its stack and counted in ``hub_blocked_total``.
+    """
+    if not settings.block_threshold:
+        return None
+    _configure_monitor()
+    if _report_blocking not in gevent.events.subscribers:
+        gevent.events.subscribers.append(_report_blocking)
+    with warnings.catch_warnings():
+        # memory usage monitoring wants psutil; it is not used here
+        warnings.simplefilter('ignore')
+        return gevent.get_hub().start_periodic_monitoring_thread()
+
+
+def _configure_monitor():
+    if settings.block_threshold:
+        # gevent reads these when the hub starts its monitor thread
+        gevent.config.monitor_thread = True
+        gevent.config.max_blocking_time = settings.block_threshold
+        # before gevent 25.4.1 the reports always go to stderr as well
+        if 'print_blocking_reports' in gevent.config.settings:
+            gevent.config.print_blocking_reports = False
+
+
+def _report_blocking(event):
+    if not isinstance(event, gevent.events.EventLoopBlocked):
+        return
+    from .profiling import describe
+    name = describe(event.greenlet)
+    metrics.increment('hub_blocked_total', greenlet=name)
+    # the report is a header, the blocked stack, then every thread and
+    # greenlet in the process; the latter only at debug level
+    stack = ''
+    for index, line in enumerate(event.info):
+        if line.startswith('Blocked Stack'):
+            stack = event.info[index + 1]
+            break
+    log.warning('hub blocked for over {0}s by {1}:\n{2}'.format(
+        event.blocking_time, name, stack.rstrip()
+    ))
+    log.debug('\n'.join(event.info))
+
+
 class CrawlerGroup(Group):
     """ Normal gevent Group with extra method to determine greenlet status. """
     def alive(self):
@@ -40,7 +91,7 @@ class CrawlerGroup(Group):
         return False
 
 
-def check_room_availability(start, end):
+def check_room_availability(start, end, hotel_scrapers=None):
     """
     Main point of entry into the coroutines.
 
@@ -48,34 +99,61 @@ def check_room_availability(start, end):
     :type start: datetime.date
     :param end: ending date of availability window for hotel rooms.
     :type end: datetime.date
+    :param hotel_scrapers: scrapers to monitor instead of the search matrix
+    :type hotel_scrapers: list
+
+    NOTE: SQLAlchemy sessions are not intended to be shared across threads
+    of execution, so the monitors never touch the database themselves; all
+    inserts and updates go through ``write_queue`` to ``_database_writer``.
 
-    NOTE: Normally we would want to share a SQLAlchemy session object,
-    however, sessions are not intended to be shared across threads of
-    execution. That is why new sessions are created in the coroutines.
+    With ``settings.workers`` above 1 the monitors run in forked shard
+    processes and this process only coordinates: it stores the results
+    they send back and handles all notifications.
     """
+    writer = None
+    exporter = None
+    shards = []
+    crawlers = CrawlerGroup()
+    watch_hub()
     try:
+        log.debug('spawning room availability monitors')
+        if hotel_scrapers is None:
+            hotel_scrapers = scrapers.get_scrapers(
+                start, end, settings.search_matrix(start, end)
+            )
+        if settings.workers > 1:
+            # fork before this process spawns any greenlets of its own
+            shards = sharding.start_shards(
+                hotel_scrapers, settings.workers, _monitor_rooms
+            )
+
+        metrics.registry.collect(_sample_queues)
+        exporter = metrics.start_exporter()
+
         if settings.use_db:
             global invocation
-            beaker.init_database()
-            session = beaker.create_session()
-            invocation = beaker.Invocation(**settings.dict())
-            session.add(invocation)
-            session.commit()
-            log.debug('invocation = {0}'.format(invocation))
-            session.close()
-
-        log.debug('spawning room availability monitors')
-        hotel_scrapers = scrapers.get_scrapers(start, end)
+            beaker.init_database(
+                db_url=settings.db_url,
+                pool_size=settings.db_pool_size,
+                echo=settings.db_echo,
+            )
+            invocation = beaker.record_invocation(settings.dict())
+            writer = gevent.spawn(_database_writer)
 
-        crawlers = CrawlerGroup()
-        for scraper in hotel_scrapers:
-            crawlers.spawn(_monitor_rooms, scraper)
+        for shard in shards:
+            crawlers.spawn(
+                sharding.relay, shard, hotel_scrapers, _record_result,
+                _touch_result,
+            )
+        if not shards:
+            for scraper in hotel_scrapers:
+                crawlers.spawn(_monitor_rooms, scraper)
         processor = gevent.spawn(_result_processor)
 
         crawlers.join()
 
         result_queue.put(StopIteration)
-        processor.join(timeout=10)
+        processor.join(timeout=alerts.delivery_budget() + 10)
         if not processor.ready():
             processor.kill()
     except KeyboardInterrupt:
@@ -83,96 +161,181 @@ def check_room_availability(start, end):
     except requests.exceptions.ConnectionError as e:
         log.debug('{0}'.format(e))
         log.error('internet connection error; aborting!')
+    finally:
+        for shard in shards:
+            shard.stop()
+        executor.shutdown()
+        if writer is not None:
+            write_queue.put(StopIteration)
+            writer.join(timeout=30)
+        if exporter is not None:
+            exporter.stop()
 
     return crawlers
 
 
-def _monitor_rooms(scraper):
+def _sample_queues(registry):
+    registry.gauge('result_queue_depth').set(result_queue.qsize())
+    registry.gauge('write_queue_depth').set(write_queue.qsize())
+
+
+def _monitor_rooms(scraper, publish=None, touch=None):
     """
     Performs the actual scraping and parsing then adds results to the queue.
 
     :param scraper: the object holding the actual scraping and parsing code
     :type scraper: dragonite.scrapers.base.HostHotelScraper (or subclass)
+    :param publish: called with each changed result; defaults to
+        ``_process_result``
+    :param touch: called with the last published result when a poll finds
+        it unchanged and still available, so reminders and re-alerts after
+        a failed delivery still happen; defaults to ``_touch_result``
 
     Depending on the settings configuration, it will also create a database
     entry containing the results of the run and iterate through additional
     runs up to ``max_attempts`` times.
+
+    Responses whose fingerprint matches the previous poll are not parsed,
+    stored, or queued again; they only count as a "no change" tick.
+
+    The wait between polls comes from a per-scraper ``PollScheduler`` which
+    backs off on errors and unchanged responses.
     """
-    log.info('checking {0} room availability...'.format(scraper.friendly))
+    log.info('checking {0} room availability...'.format(scraper.label))
+    publish = publish or _process_result
+    touch = touch or _touch_result
+    schedule = scheduler.PollScheduler()
     iteration = 0
-    previous = None
+    fingerprint = None
+    latest = None
+    unchanged = 0
 
     while settings.max_attempts == 0 or iteration < settings.max_attempts:
-        if settings.max_attempts != 0:
-            previous = timeit.default_timer()
+        previous = timeit.default_timer()
 
         result = scraper()
-        result.evaluate()
-
-        if settings.use_db:
-            session = beaker.create_session()
-            entry = beaker.ScrapeResultEntry(
-                hotel=result.parent.name,
-                available=result.available,
-                post_process=result.post_process,
-                error=result.error,
-                traceback=result.traceback,
-                raw=result.raw,
-                history='{0}'.format(
-                    [
-                        r.url for r in result.response.history
-                    ] + [result.response.url]
-                ),
-                cookies='{0}'.format(result.session.cookies.get_dict()),
-            )
-            session.add(entry)
-            session.commit()
-            entry.session = session
-            result.entry = entry
-
-        if result.available:
-            log.info('{0}: AVAILABILITY FOUND'.format(scraper.friendly))
+        metrics.increment('polls_total', scraper=scraper.name)
+        current = result.fingerprint
+        if current is not None and current == fingerprint:
+            unchanged += 1
+            log.info('{0}: NO CHANGE ({1})'.format(scraper.label, unchanged))
+            if latest.available:
+                touch(latest)
         else:
-            log.info('{0}: UNAVAILABLE'.format(scraper.friendly))
-
-        result_queue.put(result)
+            fingerprint = current
+            latest = result
+            unchanged = 0
+            publish(result)
+        metrics.observe(
+            'poll_seconds', timeit.default_timer() - previous,
+            scraper=scraper.name,
+        )
+        schedule.record(error=result.error, changed=(unchanged == 0))
 
         iteration += 1
-        if settings.max_attempts != 0:
-            elapsed = round(Decimal(timeit.default_timer() - previous), 4)
-            sleeptime = max(0.1, (settings.interval - elapsed))
-            gevent.sleep(sleeptime)
+        if settings.max_attempts == 0 or iteration < settings.max_attempts:
+            elapsed = timeit.default_timer() - previous
+            gevent.sleep(schedule.delay(elapsed))
 
     return '{0}'.format(scraper.name)
 
 
+def _process_result(result):
+    """ evaluates a fresh scrape, stores it, and hands it to the processor """
+    result.evaluate()
+    _record_result(result)
+
+
+def _touch_result(result):
+    """ hands an unchanged result back to the processor, without storing it """
+    result_queue.put(result)
+
+
+def _record_result(result):
+    """ queues the database entry for an evaluated result and processes it """
+    if settings.use_db:
+        entry = beaker.ScrapeResultEntry.from_result(
+            result, invocation.id if invocation is not None else None
+        )
+        write_queue.put(('insert', entry, result.raw))
+        result.entry = entry
+
+    if result.available:
+        log.info('{0}: AVAILABILITY FOUND'.format(result.parent.label))
+    else:
+        log.info('{0}: UNAVAILABLE'.format(result.parent.label))
+
+    result_queue.put(result)
+
+
 def _result_processor():
     """
     Handles objects from ``result_queue`` until StopIteration is received.
 
-    This processes the results of the scrapes, sending communications if
-    availability was found and updating database entries when needed.
+    Each result updates the per-(hotel, search) availability state; only
+    the ones which warrant an alert are handed to the notification worker,
+    which marks their database entries processed once delivered.
     """
-    with settings.comm as gateway:
+    tracker = alerts.AvailabilityTracker()
+    notifier = alerts.NotificationWorker(
+        on_sent=_mark_processed, on_failed=tracker.forget
+    ).start()
+    try:
         for result in result_queue:
             log.debug('processing {0} result'.format(result.parent.friendly))
+            if tracker.observe(result):
+                entry = getattr(result, 'entry', None)
+                if not notifier.submit(result, entry):
+                    tracker.forget(result)
+    finally:
+        notifier.stop(timeout=alerts.delivery_budget())
+        alerts.close_gateway()
 
-            entry = None
-            if hasattr(result, 'entry'):
-                entry = result.entry
-                session = beaker.object_session(entry)
+    return True
 
-            if result.available and entry is not None:
-                with LogAndForget('issue encountered notifying with uuid:'):
-                    gateway.notify(result, entry.uuid)
-                    entry.processed = True
-                    session.commit()
-                    log.debug('entry.processed = {0}'.format(entry.processed))
-            elif result.available:
-                with LogAndForget('issue encountered notifying:'):
-                    gateway.notify(result)
 
-            if entry is not None:
-                session.close()
+def _mark_processed(entry):
+    write_queue.put(('update', entry, {'processed': True}))
+    log.debug('entry {0} processed'.format(entry.uuid))
 
+
+def _database_writer():
+    """
+    Handles writes from ``write_queue`` until StopIteration is received.
+
+    Items are ``('insert', entry, raw)`` or ``('update', entry, values)``
+    tuples. They are committed together in a single transaction once
+    ``db_batch_size`` items are pending or the oldest pending item has
+    waited ``db_max_latency`` seconds, so SQLite only syncs once per batch.
+    """
+    session = beaker.create_session(expire_on_commit=False)
+    pending = []
+    deadline = None
+    stopping = False
+
+    while not stopping:
+        timeout = None
+        if pending:
+            timeout = max(0, deadline - timeit.default_timer())
+        try:
+            item = write_queue.get(timeout=timeout)
+        except Empty:
+            item = None
+
+        if item is StopIteration:
+            stopping = True
+        elif item is not None:
+            if not pending:
+                deadline = timeit.default_timer() + settings.db_max_latency
+            pending.append(item)
+
+        if pending and (
+            stopping or item is None or
+            len(pending) >= settings.db_batch_size or
+            timeit.default_timer() >= deadline
+        ):
+            beaker.apply_writes(session, pending)
+            pending = []
+
+    session.close()
     return True
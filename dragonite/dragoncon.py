@@ -6,15 +6,8 @@ from collections import OrderedDict
 
 from armory.serialize import jsonify
 
-from bs4 import BeautifulSoup
-
 import dateutil.parser
 
-import requests
-
-from unidecode import unidecode
-
-from . import coroutines
 from .conf import settings
 
 
@@ -33,6 +26,8 @@ class DragonCon(object):
     @property
     def site_content(self):
         if self._site_main is None:
+            import requests
+            from bs4 import BeautifulSoup
             r = requests.get('http://www.dragoncon.org/')
             self._site_main = BeautifulSoup(r.text, 'lxml')
         return self._site_main
@@ -102,6 +97,7 @@ class DragonCon(object):
         if domlen != 1:
             errmsg = "incorrect number of objects ({0}) returned from '{1}'"
             raise ValueError(errmsg.format(domlen, self.dates_selector))
+        from unidecode import unidecode
         dateinfo = unidecode(domdate[0].get_text())
         parts = [p.strip().replace(',', ' ') for p in dateinfo.split('-')]
         parts = [' '.join(p.split()[:2]) for p in parts]
@@ -122,11 +118,24 @@ class DragonCon(object):
         settings.cache.flush()
 
     def run(self, info_only=False):
+        if settings.profile:
+            from . import profiling
+            profiler = profiling.start_profiler()
+            try:
+                return self._run(info_only)
+            finally:
+                profiler.stop()
+        return self._run(info_only)
+
+    def _run(self, info_only=False):
         log = self._log
         for w in settings._warnings:
             log.warning(w)
-        coroutines.monkey_patch()
-        log.debug('gevent monkey patching done')
+        if settings.engine == 'gevent':
+            # gevent, the scrapers and the database only load for a run
+            from . import coroutines
+            coroutines.monkey_patch()
+            log.debug('gevent monkey patching done')
         log.debug('fetching event info...')
         dcstr = '{0}'.format(self.event_info)
         log.debug(dcstr)
@@ -134,9 +143,14 @@ class DragonCon(object):
             log.debug('info only; terminating')
             return True
         log.debug('spawning tasks...')
-        hotels = coroutines.check_room_availability(
-            self.checkin,
-            self.checkout
-        )
-        log.debug([h.value for h in hotels])
+        if settings.engine == 'asyncio':
+            from . import aio
+            names = aio.check_room_availability(self.checkin, self.checkout)
+        else:
+            hotels = coroutines.check_room_availability(
+                self.checkin,
+                self.checkout
+            )
+            names = [h.value for h in hotels]
+        log.debug(names)
         log.info('dragoncon bot exiting\n')
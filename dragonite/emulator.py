@@ -0,0 +1,538 @@
+# -*- encoding: utf-8 -*-
+"""
+Local stand-in for the hotel sites, for load testing the whole crawl
+pipeline with ``dragonite bench``.
+
+The emulator answers on ``<url>/<hotel host>/<path>``, which is where the
+scrapers send their requests once ``settings.base_url`` points at it. It
+follows each hotel's flow as the scrapers know it:
+- landing pages set session cookies;
+- searches without them bounce back to the landing page;
+- searches go through redirect chains;
+- passkey needs its group POST and sometimes redirects to maintenance.
+
+Every response is delayed by a configurable latency distribution. Any
+response may also fail with a 503 or hang past the scrapers' timeouts.
+
+Each search's result page (available, unavailable, or price too high for
+Marriott) only changes on ``change_rate`` of the polls, so unchanged
+responses are skipped the way they are against the live sites.
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import datetime
+import logging
+import math
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import timeit
+from collections import OrderedDict
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse
+
+from .conf import settings
+
+log = logging.getLogger(__name__)
+
+HILTON = 'www3.hilton.com'
+HYATT = 'atlantaregency.hyatt.com'
+PASSKEY = 'aws.passkey.com'
+MARRIOTT = 'www.marriott.com'
+EVENT = '/event/14179207/owner/323'
+
+# (host, method, path): (action, site, next path)
+ROUTES = {
+    (HILTON, 'GET', '/en/hotels/georgia/hilton-atlanta-ATLAHHH/index.html'):
+        ('landing', 'hilton', None),
+    (HILTON, 'POST', '/en_US/hi/search/findhotels/index.htm'):
+        ('search', 'hilton', '/en_US/hi/search/findhotels/select.htm'),
+    (HILTON, 'GET', '/en_US/hi/search/findhotels/select.htm'):
+        ('redirect', 'hilton', '/en_US/hi/reservation/book.htm'),
+    (HILTON, 'GET', '/en_US/hi/reservation/book.htm'):
+        ('results', 'hilton', None),
+    (HYATT, 'GET', '/en/hotel/home.html'):
+        ('landing', 'hyatt', None),
+    (HYATT, 'GET', '/HICBooking'):
+        ('search', 'hyatt', '/en/hotel/booking/select-room.html'),
+    (HYATT, 'GET', '/en/hotel/booking/select-room.html'):
+        ('results', 'hyatt', None),
+    (PASSKEY, 'GET', EVENT + '/home'):
+        ('landing', 'hyatt_passkey', EVENT + '/landing'),
+    (PASSKEY, 'GET', EVENT + '/landing'):
+        ('landing', 'hyatt_passkey', None),
+    (PASSKEY, 'POST', EVENT + '/home/group'):
+        ('group', 'hyatt_passkey', EVENT + '/landing'),
+    (PASSKEY, 'POST', EVENT + '/rooms/select'):
+        ('search', 'hyatt_passkey', None),
+    (PASSKEY, 'GET', '/maintenance/index.html'):
+        ('maintenance', 'hyatt_passkey', None),
+    (MARRIOTT, 'GET', '/hotels/travel/atlmq-atlanta-marriott-marquis/'):
+        ('landing', 'marriott', None),
+    (MARRIOTT, 'GET', '/reservation/availabilitySearch.mi'):
+        ('search', 'marriott', '/reservation/availability.mi'),
+    (MARRIOTT, 'GET', '/reservation/availability.mi'):
+        ('results', 'marriott', None),
+    (MARRIOTT, 'GET',
+     '/meeting-event-hotels/group-corporate-travel/groupCorp.mi'):
+        ('landing', 'marriott_discount', None),
+    (MARRIOTT, 'POST', '/meetings/rateListMenu.mi'):
+        ('search', 'marriott_discount', None),
+}
+
+SITE_HOSTS = {
+    'hilton': HILTON,
+    'hyatt': HYATT,
+    'hyatt_passkey': PASSKEY,
+    'marriott': MARRIOTT,
+    'marriott_discount': MARRIOTT,
+}
+LANDINGS = dict(
+    (site, path) for (_, _, path), (action, site, _) in ROUTES.items()
+    if action == 'landing' and path != EVENT + '/landing'
+)
+# the cookie a site's search needs; passkey's only comes from the group POST
+SEARCH_COOKIES = dict(
+    (site, '{0}_session'.format(site)) for site in SITE_HOSTS
+)
+SEARCH_COOKIES['hyatt_passkey'] = 'passkey_group'
+
+PAGE = (
+    '<!DOCTYPE html><html><head><meta charset="utf-8"><title>{title}'
+    '</title></head><body>{content}<div class="inventory">inventory '
+    '{snapshot}</div>{padding}</body></html>'
+)
+CONTENT = {
+    ('hilton', 'available'): (
+        '<div id="main_content"><div id="main"><div class="alertBox info">'
+        '<p>Rates are per room, per night.</p></div><div class="roomType">'
+        '<span class="priceamount">$249</span></div></div></div>'
+    ),
+    ('hilton', 'unavailable'): (
+        '<div id="main_content"><div id="main"><div class="alertBox error">'
+        '<p>There are no rooms available for 01 Sep 2016 - 05 Sep 2016 at '
+        'Hilton Atlanta.</p></div></div></div>'
+    ),
+    ('hyatt', 'available'): (
+        '<div class="room-results"><div class="room-type"><h3>1 King Bed'
+        '</h3><span class="price">279.00 USD</span></div></div>'
+    ),
+    ('hyatt', 'unavailable'): (
+        '<div class="error-block"><div id="msg"><p class="error">The hotel '
+        'is not available for your requested travel dates. It is either '
+        'sold out or not yet open for reservations.</p></div></div>'
+    ),
+    ('hyatt_passkey', 'available'): (
+        '<div id="main"><div class="shell"><div id="content"><table '
+        'class="rooms"><tr><td>Regency King</td><td>$229.00</td></tr>'
+        '</table></div></div></div>'
+    ),
+    ('hyatt_passkey', 'unavailable'): (
+        '<div id="main"><div class="shell"><div id="content"><div '
+        'class="message-room">No lodging matches your search criteria.'
+        '</div></div></div></div>'
+    ),
+    ('hyatt_passkey', 'maintenance'): (
+        '<div id="main"><h1>We\'ll be back soon</h1><p>Passkey is '
+        'undergoing scheduled maintenance.</p></div>'
+    ),
+    ('marriott', 'available'): (
+        '<div id="popover-panel"></div><div class="results-container"><div '
+        'class="room-rate-results"><div class="rate-price"><span '
+        'class="t-price">259.00 USD</span></div></div></div>'
+    ),
+    ('marriott', 'price_too_high'): (
+        '<div id="popover-panel"></div><div class="results-container"><div '
+        'class="room-rate-results"><div class="rate-price"><span '
+        'class="t-price">389.00 USD</span></div></div></div>'
+    ),
+    ('marriott', 'unavailable'): (
+        '<div id="popover-panel"><div id="no-rooms-available">Sorry, '
+        'currently there are no rooms available at this property for the '
+        'dates you selected. Please try your search again with different '
+        'dates.</div></div>'
+    ),
+    ('marriott_discount', 'available'): (
+        '<div id="popover-panel"></div><div class="rate"><span '
+        'class="t-price">229.00 USD</span></div>'
+    ),
+    ('marriott_discount', 'unavailable'): (
+        '<div id="popover-panel"><div id="unsuccessful-sell-popover"><p>'
+        'Sorry, there are no rooms remaining in the group block for a '
+        'particular night. Please contact the Hotel directly for '
+        'assistance.</p></div></div>'
+    ),
+}
+
+
+class Latency(object):
+    """
+    Response delay distribution, from a spec in milliseconds such as
+    ``fixed:50``, ``uniform:20:200``, ``exponential:50`` (the mean) or
+    ``lognormal:80:0.5`` (the median and sigma).
+    """
+    KINDS = {'fixed': 1, 'uniform': 2, 'exponential': 1, 'lognormal': 2}
+
+    def __init__(self, spec):
+        self.spec = spec
+        kind, _, params = spec.partition(':')
+        try:
+            values = [float(v) for v in params.split(':')] if params else []
+        except ValueError:
+            values = None
+        if self.KINDS.get(kind) != len(values or ()):
+            raise ValueError('invalid latency distribution "{0}"'.format(spec))
+        self.kind = kind
+        self.values = values
+
+    def sample(self):
+        """ one delay, in seconds """
+        if self.kind == 'fixed':
+            delay = self.values[0]
+        elif self.kind == 'uniform':
+            delay = random.uniform(*self.values)
+        elif self.kind == 'exponential':
+            delay = random.expovariate(1.0 / self.values[0])
+        else:
+            median, sigma = self.values
+            delay = random.lognormvariate(math.log(median), sigma)
+        return max(delay, 0.0) / 1000.0
+
+
+def padding(kilobytes):
+    """ navigation-like markup, about ``kilobytes`` KB of it """
+    chunks = []
+    size = 0
+    n = 0
+    while size < kilobytes * 1024:
+        chunk = (
+            '<div class="promo" data-offer="{0}"><ul><li><a href="/offers/'
+            '{0}">Offer {0}</a></li></ul><script>track("promo-{0}");'
+            '</script></div>\n'
+        ).format(n)
+        chunks.append(chunk)
+        size += len(chunk)
+        n += 1
+    return ''.join(chunks)
+
+
+class EmulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):  # noqa: N802
+        self.dispatch('GET')
+
+    def do_POST(self):  # noqa: N802
+        self.dispatch('POST')
+
+    def log_message(self, *args):
+        pass
+
+    def dispatch(self, method):
+        url = urlparse(self.path)
+        host, _, path = url.path.lstrip('/').partition('/')
+        self.host = host
+        length = int(self.headers.get('Content-Length') or 0)
+        form = self.rfile.read(length).decode('utf-8') if length else ''
+        self.search_key = '&'.join(part for part in (url.query, form) if part)
+
+        emulator = self.server
+        time.sleep(emulator.latency.sample())
+        fault = emulator.fault()
+        try:
+            if fault == 'timeout':
+                time.sleep(emulator.hang)
+            if fault == 'error':
+                return self.send_page(503, 'Service Unavailable', '')
+            route = ROUTES.get((host, method, '/' + path))
+            if route is None:
+                return self.send_page(404, 'Not Found', '')
+            action, site, target = route
+            getattr(self, action)(site, target)
+        except socket.error:
+            # the client gave up on a hung response
+            self.close_connection = True
+
+    def cookie(self, name):
+        for part in self.headers.get('Cookie', '').split(';'):
+            key, _, value = part.strip().partition('=')
+            if key == name:
+                return value
+        return None
+
+    def location(self, path, query=None):
+        location = '/{0}{1}'.format(self.host, path)
+        if query:
+            location += '?' + query
+        return location
+
+    def send_page(self, status, title, content, snapshot=0, cookies=(),
+                  location=None):
+        body = PAGE.format(
+            title=title, content=content, snapshot=snapshot,
+            padding=self.server.padding if status == 200 else '',
+        ).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for cookie in cookies:
+            self.send_header('Set-Cookie', '{0}; Path=/'.format(cookie))
+        if location is not None:
+            self.send_header('Location', location)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def redirect(self, site, target, cookies=(), query=None):
+        if query is None:
+            query = self.search_key
+        self.send_page(
+            302, 'Found', '', cookies=cookies,
+            location=self.location(target, query),
+        )
+
+    def landing(self, site, target):
+        cookie = '{0}_session={1}'.format(site, random.getrandbits(32))
+        if target is not None:
+            return self.redirect(site, target, cookies=(cookie,), query='')
+        self.send_page(200, site, '<h1>Welcome</h1>', cookies=(cookie,))
+
+    def group(self, site, target):
+        if self.cookie('{0}_session'.format(site)) is None:
+            return self.redirect(site, LANDINGS[site], query='')
+        cookie = '{0}={1}'.format(SEARCH_COOKIES[site], 52445573)
+        self.redirect(site, target, cookies=(cookie,), query='')
+
+    def search(self, site, target):
+        if self.cookie(SEARCH_COOKIES[site]) is None:
+            return self.redirect(site, LANDINGS[site], query='')
+        if target is not None:
+            return self.redirect(site, target)
+        self.results(site, None)
+
+    def results(self, site, target):
+        emulator = self.server
+        if site == 'hyatt_passkey' and emulator.maintenance():
+            return self.redirect(site, '/maintenance/index.html', query='')
+        state, snapshot = emulator.state(site, self.search_key)
+        self.send_page(200, site, CONTENT[site, state], snapshot)
+
+    def maintenance(self, site, target):
+        self.send_page(200, 'Maintenance', CONTENT[site, 'maintenance'])
+
+
+class HotelSiteEmulator(ThreadingMixIn, HTTPServer):
+    """
+    The emulated hotel sites. Rates are fractions of the responses:
+    ``error_rate`` fail with a 503 and ``timeout_rate`` only answer after
+    ``hang`` seconds; ``available_rate`` of the result pages show rooms
+    (as many again show Marriott rooms at too high a price) and
+    ``maintenance_rate`` of passkey searches land on its maintenance page.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency='fixed:0',
+                 error_rate=0.0, timeout_rate=0.0, hang=30.0,
+                 available_rate=0.1, change_rate=0.5, maintenance_rate=0.0,
+                 page_kb=50):
+        HTTPServer.__init__(self, address, EmulatorHandler)
+        self.latency = Latency(latency)
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.hang = hang
+        self.available_rate = available_rate
+        self.change_rate = change_rate
+        self.maintenance_rate = maintenance_rate
+        self.padding = padding(page_kb)
+        self.states = {}
+        self.snapshots = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self.server_address[:2])
+
+    def handle_error(self, request, client_address):
+        # clients hanging up on a slow or hung response are part of the test
+        if isinstance(sys.exc_info()[1], socket.error):
+            log.debug('client %s:%s went away', *client_address[:2])
+            return
+        HTTPServer.handle_error(self, request, client_address)
+
+    def fault(self):
+        roll = random.random()
+        if roll < self.error_rate:
+            return 'error'
+        if roll < self.error_rate + self.timeout_rate:
+            return 'timeout'
+        return None
+
+    def maintenance(self):
+        return random.random() < self.maintenance_rate
+
+    def pick(self, site):
+        roll = random.random()
+        if roll < self.available_rate:
+            return 'available'
+        if site == 'marriott' and roll < 2 * self.available_rate:
+            return 'price_too_high'
+        return 'unavailable'
+
+    def state(self, site, search):
+        """ (state, snapshot) of a search's result page """
+        with self.lock:
+            current = self.states.get((site, search))
+            if current is None or random.random() < self.change_rate:
+                self.snapshots += 1
+                current = (self.pick(site), self.snapshots)
+                self.states[site, search] = current
+        return current
+
+
+def _serve(connection, options):
+    server = HotelSiteEmulator(**options)
+    connection.send(server.url)
+    connection.close()
+    server.serve_forever()
+
+
+class EmulatorProcess(object):
+    """ a ``HotelSiteEmulator`` serving from its own process """
+
+    def __init__(self, **options):
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(
+            target=_serve, args=(writer, options), name='hotel-emulator'
+        )
+        self.process.daemon = True
+        self.process.start()
+        writer.close()
+        self.url = reader.recv()
+        reader.close()
+        log.debug('hotel site emulator listening on {0}'.format(self.url))
+
+    def stop(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(timeout=5)
+
+
+def start_emulator(**options):
+    """
+    Starts the emulator in a separate process, so neither gevent's monkey
+    patching nor its CPU time get mixed up with the crawl it serves.
+    """
+    return EmulatorProcess(**options)
+
+
+# poll latency buckets 5% apart, fine enough to read percentiles off
+POLL_BUCKETS = tuple(round(0.001 * 1.05 ** n, 6) for n in range(300))
+
+
+class NullGateway(object):
+    """ stands in for the alert gateway; only counts the alerts """
+
+    def __init__(self):
+        self.sent = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def notify(self, result, ref_uuid=None, delivered=None):
+        self.sent += 1
+
+
+def _cpu_seconds():
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+
+def run_bench(polls=20, searches=1, **options):
+    """
+    Crawls the emulator with the configured engine, ``polls`` times for
+    each of ``searches`` guest counts at every hotel, and returns the
+    throughput, poll latency and CPU cost of the run.
+
+    Polls run back to back without host rate limits, and alerts only get
+    counted; results are stored only when a database URL is configured.
+    """
+    from . import metrics
+
+    if settings.workers > 1:
+        log.warning('ignoring --workers; the bench runs in one process')
+        settings.workers = 1
+    if not settings.db_url:
+        settings.nodb = True
+    settings.max_attempts = polls
+    settings.interval = 0
+    settings.min_delay = 0
+    settings.host_rate = 0
+    gateway = settings.comm = NullGateway()
+
+    site = start_emulator(**options)
+    try:
+        settings.base_url = site.url
+        if settings.engine == 'asyncio':
+            from .aio import check_room_availability
+        else:
+            from . import coroutines
+            coroutines.monkey_patch()
+            check_room_availability = coroutines.check_room_availability
+        from .scrapers import get_scrapers
+
+        start = datetime.date(2016, 9, 1)
+        end = datetime.date(2016, 9, 5)
+        probes = get_scrapers(start, end, [
+            (start, end, guests) for guests in range(1, searches + 1)
+        ])
+        latency = metrics.Histogram(POLL_BUCKETS)
+        for probe in probes:
+            metrics.registry.histogram(
+                'poll_seconds', buckets=POLL_BUCKETS, scraper=probe.name
+            )
+
+        cpu = _cpu_seconds()
+        started = timeit.default_timer()
+        check_room_availability(start, end, probes)
+        elapsed = timeit.default_timer() - started
+        cpu = _cpu_seconds() - cpu
+    finally:
+        site.stop()
+
+    errors = 0
+    for (name, labels), metric in list(metrics.registry.metrics.items()):
+        if name == 'poll_seconds':
+            latency.count += metric.count
+            latency.counts = [
+                a + b for a, b in zip(latency.counts, metric.counts)
+            ]
+        elif name == 'scrape_errors_total':
+            errors += metric.value
+    count = latency.count or 1
+    return OrderedDict((
+        ('engine', settings.engine),
+        ('probes', len(probes)),
+        ('polls', latency.count),
+        ('seconds', elapsed),
+        ('polls_per_second', latency.count / elapsed),
+        ('p50', latency.quantile(0.50)),
+        ('p95', latency.quantile(0.95)),
+        ('p99', latency.quantile(0.99)),
+        ('cpu_per_poll', cpu / count),
+        ('errors', errors),
+        ('alerts', gateway.sent),
+    ))
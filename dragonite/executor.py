@@ -0,0 +1,158 @@
+# -*- encoding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import logging
+from collections import namedtuple
+
+from gevent.queue import Queue
+from gevent.socket import wait_read
+from gevent.threadpool import ThreadPool
+
+from .conf import settings
+from .utils import fork_context
+
+log = logging.getLogger(__name__)
+
+EXECUTOR_KINDS = ('inline', 'thread', 'process')
+VERDICT_FIELDS = ('available', 'post_process', 'error', 'traceback', 'prices')
+
+ParsedResponse = namedtuple('ParsedResponse', ('url', 'history'))
+
+
+def parse_verdict(scraper, raw, url):
+    """
+    Runs ``scraper.parse`` over a raw response and returns a compact verdict.
+
+    Only plain values go in and out so this can run in a worker thread or
+    process without dragging the HTTP session or DOM along.
+    """
+    from .scrapers.base import ScrapeResults
+
+    result = ScrapeResults(scraper)
+    result.raw = raw
+    result.response = ParsedResponse(url, [])
+    scraper.parse(result)
+    return dict((field, getattr(result, field)) for field in VERDICT_FIELDS)
+
+
+def _parse_worker(jobs, verdicts):
+    """ loop run by each parse process until it receives None """
+    while True:
+        job = jobs.recv()
+        if job is None:
+            break
+        try:
+            verdicts.send((True, parse_verdict(*job)))
+        except Exception as e:
+            verdicts.send((False, e))
+
+
+class ProcessWorkers(object):
+    """
+    Fixed set of parse processes, each fed over its own pair of pipes.
+
+    One-way pipes are plain OS pipes, which gevent leaves blocking in the
+    workers; the hub waits on the verdict pipes with ``wait_read`` so a
+    greenlet waiting for its verdict never blocks the others.
+    """
+
+    def __init__(self, size):
+        self._idle = Queue()
+        self._workers = []
+        context = fork_context()
+        for _ in range(size):
+            job_reader, job_writer = context.Pipe(duplex=False)
+            verdict_reader, verdict_writer = context.Pipe(duplex=False)
+            process = context.Process(
+                target=_parse_worker, args=(job_reader, verdict_writer)
+            )
+            process.daemon = True
+            process.start()
+            job_reader.close()
+            verdict_writer.close()
+            self._workers.append((process, job_writer, verdict_reader))
+            self._idle.put((job_writer, verdict_reader))
+
+    def apply(self, job):
+        jobs, verdicts = self._idle.get()
+        try:
+            jobs.send(job)
+            wait_read(verdicts.fileno())
+            ok, payload = verdicts.recv()
+        finally:
+            self._idle.put((jobs, verdicts))
+        if not ok:
+            raise payload
+        return payload
+
+    def close(self):
+        for process, jobs, verdicts in self._workers:
+            jobs.send(None)
+            jobs.close()
+            verdicts.close()
+            process.join(timeout=5)
+
+
+class ParseExecutor(object):
+    """
+    Evaluates scrape results away from the gevent hub.
+
+    ``kind`` is one of ``inline`` (parse on the calling greenlet),
+    ``thread`` (a gevent ThreadPool) or ``process`` (forked workers).
+    """
+
+    def __init__(self, kind=None, workers=None):
+        self.kind = settings.parse_executor if kind is None else kind
+        self.workers = settings.parse_workers if workers is None else workers
+        if self.kind not in EXECUTOR_KINDS:
+            raise ValueError('{0} is not a valid parse executor! {1}'.format(
+                self.kind, EXECUTOR_KINDS
+            ))
+        self._pool = None
+
+    def start(self):
+        if self._pool is not None or self.kind == 'inline':
+            return
+        if self.kind == 'thread':
+            self._pool = ThreadPool(self.workers)
+        else:
+            self._pool = ProcessWorkers(self.workers)
+        log.debug('started {0} {1} parse workers'.format(
+            self.workers, self.kind
+        ))
+
+    def verdict(self, scraper, raw, url):
+        job = (scraper, raw, url)
+        if self.kind == 'inline':
+            return parse_verdict(*job)
+        self.start()
+        if self.kind == 'thread':
+            return self._pool.apply(parse_verdict, job)
+        return self._pool.apply(job)
+
+    def shutdown(self):
+        if self._pool is None:
+            return
+        if self.kind == 'thread':
+            self._pool.kill()
+        else:
+            self._pool.close()
+        self._pool = None
+
+
+_EXECUTOR = None
+
+
+def get_executor():
+    """ the process-wide parse executor, built from settings on first use """
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = ParseExecutor()
+    return _EXECUTOR
+
+
+def shutdown():
+    global _EXECUTOR
+    if _EXECUTOR is not None:
+        _EXECUTOR.shutdown()
+        _EXECUTOR = None
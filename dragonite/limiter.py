@@ -0,0 +1,113 @@
+# -*- encoding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import random
+import threading
+import time
+import timeit
+from contextlib import contextmanager
+
+from .conf import settings
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """
+    Classic token bucket refilled at ``rate`` tokens per second.
+
+    Tokens are reserved rather than waited for while holding the lock, so
+    concurrent callers each get their own place in line.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.capacity = float(max(burst, 1))
+        self.tokens = self.capacity
+        self.updated = timeit.default_timer()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """ takes a token and returns the seconds to wait before using it """
+        with self._lock:
+            now = timeit.default_timer()
+            elapsed = now - self.updated
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class HostLimiter(object):
+    """
+    Rate limit and concurrent connection budget shared by every scraper.
+
+    Each origin (``scheme://host:port``) gets its own token bucket and
+    semaphore; requests to different origins never wait on each other.
+    A rate of 0 disables rate limiting, as does 0 connections for the
+    concurrency budget.
+    """
+
+    semaphore = threading.BoundedSemaphore
+
+    def __init__(self, rate=None, burst=None, connections=None, jitter=None):
+        self.rate = settings.host_rate if rate is None else rate
+        self.burst = settings.host_burst if burst is None else burst
+        self.connections = (
+            settings.host_connections if connections is None else connections
+        )
+        self.jitter = settings.rate_jitter if jitter is None else jitter
+        self._buckets = {}
+        self._budgets = {}
+        self._lock = threading.Lock()
+
+    def _get(self, origin):
+        with self._lock:
+            if origin not in self._buckets:
+                self._buckets[origin] = (
+                    TokenBucket(self.rate, self.burst) if self.rate else None
+                )
+                self._budgets[origin] = (
+                    self.semaphore(self.connections)
+                    if self.connections else None
+                )
+            return self._buckets[origin], self._budgets[origin]
+
+    def delay(self, origin, bucket):
+        """ seconds to hold off before the next request to ``origin`` """
+        if bucket is None:
+            return 0.0
+        wait = bucket.reserve()
+        if wait > 0:
+            wait += random.uniform(0, self.jitter)
+            log.debug('{0}: rate limited for {1:.3f}s'.format(origin, wait))
+        return wait
+
+    @contextmanager
+    def limit(self, origin):
+        """ waits for a token and a connection slot for ``origin`` """
+        bucket, budget = self._get(origin)
+        wait = self.delay(origin, bucket)
+        if wait > 0:
+            time.sleep(wait)
+        if budget is not None:
+            budget.acquire()
+        try:
+            yield
+        finally:
+            if budget is not None:
+                budget.release()
+
+
+_LIMITER = None
+
+
+def get_limiter():
+    """ the process-wide limiter, built from settings on first use """
+    global _LIMITER
+    if _LIMITER is None:
+        _LIMITER = HostLimiter()
+    return _LIMITER
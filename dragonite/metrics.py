@@ -0,0 +1,280 @@
+# -*- encoding: utf-8 -*-
+"""
+In-process metrics: counters, gauges and latency histograms, exported to a
+JSON or Prometheus text file every ``metrics_interval`` seconds.
+
+Every process keeps its own registry; shard processes write their own
+``<metrics file>.shard<N>`` next to the coordinator's file.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import io
+import json
+import logging
+import os
+import threading
+import timeit
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .conf import settings
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def increment(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return {'value': self.value}
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram(object):
+    """ Cumulative bucket counts plus sum and count, Prometheus style. """
+    kind = 'histogram'
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[index] += 1
+
+    def quantile(self, fraction):
+        """ upper bound of the bucket holding the given quantile """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        for bound, count in zip(self.buckets, self.counts):
+            if count >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        return OrderedDict((
+            ('count', self.count),
+            ('sum', round(self.sum, 6)),
+            ('p50', self.quantile(0.50)),
+            ('p95', self.quantile(0.95)),
+            ('p99', self.quantile(0.99)),
+            ('buckets', OrderedDict(
+                ('{0}'.format(bound), count)
+                for bound, count in zip(self.buckets, self.counts)
+            )),
+        ))
+
+
+class Registry(object):
+    """
+    Metrics keyed by name and labels. Collectors registered with
+    ``collect`` are called before every export to refresh sampled gauges
+    such as queue depths.
+    """
+
+    def __init__(self):
+        self.metrics = OrderedDict()
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def _get(self, factory, name, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self.metrics.setdefault(key, factory())
+        return metric
+
+    def counter(self, name, **labels):
+        return self._get(Counter, name, labels)
+
+    def gauge(self, name, **labels):
+        return self._get(Gauge, name, labels)
+
+    def histogram(self, name, buckets=LATENCY_BUCKETS, **labels):
+        """ ``buckets`` only applies when the histogram is created """
+        return self._get(lambda: Histogram(buckets), name, labels)
+
+    def collect(self, collector):
+        self.collectors.append(collector)
+
+    def refresh(self):
+        for collector in list(self.collectors):
+            try:
+                collector(self)
+            except Exception:
+                log.exception('metrics collector failed:')
+
+    def snapshot(self):
+        """ {name: [{"labels": {...}, ...values}]} of every metric """
+        output = OrderedDict()
+        for (name, labels), metric in list(self.metrics.items()):
+            entry = OrderedDict((('labels', OrderedDict(labels)),))
+            entry.update(metric.snapshot())
+            output.setdefault(name, []).append(entry)
+        return output
+
+    def prometheus(self):
+        """ the Prometheus text exposition format """
+        lines = []
+        typed = set()
+        # every sample of a metric family has to be listed together
+        metrics = sorted(self.metrics.items(), key=lambda item: item[0][0])
+        for (name, labels), metric in metrics:
+            if name not in typed:
+                lines.append('# TYPE {0} {1}'.format(name, metric.kind))
+                typed.add(name)
+            if metric.kind != 'histogram':
+                lines.append('{0}{1} {2}'.format(
+                    name, _labels(labels), metric.value
+                ))
+                continue
+            for bound, count in zip(metric.buckets, metric.counts):
+                lines.append('{0}_bucket{1} {2}'.format(
+                    name, _labels(labels + (('le', bound),)), count
+                ))
+            lines.append('{0}_bucket{1} {2}'.format(
+                name, _labels(labels + (('le', '+Inf'),)), metric.count
+            ))
+            lines.append('{0}_sum{1} {2}'.format(
+                name, _labels(labels), metric.sum
+            ))
+            lines.append('{0}_count{1} {2}'.format(
+                name, _labels(labels), metric.count
+            ))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{0}="{1}"'.format(key, value) for key, value in labels
+    ) + '}'
+
+
+registry = Registry()
+
+
+def increment(name, amount=1, **labels):
+    registry.counter(name, **labels).increment(amount)
+
+
+def set_gauge(name, value, **labels):
+    registry.gauge(name, **labels).set(value)
+
+
+def observe(name, value, **labels):
+    registry.histogram(name, **labels).observe(value)
+
+
+@contextmanager
+def timer(name, **labels):
+    """ observes the seconds spent in the block, if it does not raise """
+    started = timeit.default_timer()
+    yield
+    observe(name, timeit.default_timer() - started, **labels)
+
+
+class MetricsExporter(object):
+    """
+    Writes the registry to ``path`` every ``interval`` seconds, replacing
+    the file atomically. Paths ending in ``.prom`` or ``.txt`` get the
+    Prometheus text format, anything else JSON.
+
+    Poll counters are also turned into a ``polls_per_minute`` gauge per
+    scraper over each export interval.
+    """
+
+    def __init__(self, path, interval=None, registry=registry):
+        self.path = path
+        if interval is None:
+            interval = settings.metrics_interval
+        self.interval = interval
+        self.registry = registry
+        self.prometheus = path.endswith(('.prom', '.txt'))
+        self._stop = threading.Event()
+        self._thread = None
+        self._polls = {}
+        self._polled = timeit.default_timer()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ stops the exporter after one last write """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+        self.write()
+
+    def rates(self):
+        now = timeit.default_timer()
+        elapsed = max(now - self._polled, 1e-9)
+        for (name, labels), metric in list(self.registry.metrics.items()):
+            if name != 'polls_total':
+                continue
+            previous = self._polls.get(labels, 0)
+            self._polls[labels] = metric.value
+            self.registry.gauge('polls_per_minute', **dict(labels)).set(
+                round((metric.value - previous) * 60.0 / elapsed, 3)
+            )
+        self._polled = now
+
+    def write(self):
+        self.registry.refresh()
+        self.rates()
+        if self.prometheus:
+            content = self.registry.prometheus()
+        else:
+            content = json.dumps(self.registry.snapshot(), indent=2)
+        partial = '{0}.tmp'.format(self.path)
+        try:
+            with io.open(partial, 'w', encoding='utf-8') as output:
+                output.write(content)
+            # os.replace is atomic everywhere; py2 only has os.rename
+            getattr(os, 'replace', os.rename)(partial, self.path)
+        except (IOError, OSError):
+            log.exception('could not write metrics to {0}'.format(self.path))
+
+
+def start_exporter(suffix=''):
+    """ starts the exporter configured in settings, if there is one """
+    if not settings.metrics_file:
+        return None
+    return MetricsExporter(settings.metrics_file + suffix).start()
@@ -0,0 +1,273 @@
+# -*- encoding: utf-8 -*-
+"""
+Profiling for crawl runs, enabled with ``dragonite --profile PREFIX``.
+
+While the run lasts three things are recorded, and written out when it
+ends:
+
+``PREFIX.pstats``
+    cProfile statistics, for ``python -m pstats`` or snakeviz.
+``PREFIX.collapsed``
+    stacks sampled every ``SAMPLE_INTERVAL`` seconds of CPU time, one
+    ``frame;frame;frame count`` line per stack, rooted at the greenlet
+    they ran in; feed them to flamegraph.pl or speedscope.
+``PREFIX.txt``
+    the slowest functions, and the wall and CPU time every greenlet spent
+    running, such as each ``_monitor_rooms`` greenlet.
+
+cProfile cannot tell greenlets apart, so time a greenlet spent switched
+out may be charged to whatever called ``switch``; the sampled stacks and
+the greenlet times do not have that problem. Shard processes write their
+own ``PREFIX.shard<N>.*`` files.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import signal
+import time
+import timeit
+from collections import Counter, OrderedDict
+
+import greenlet
+
+from .conf import settings
+
+log = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = 0.005
+
+_cpu_clock = (
+    getattr(time, 'thread_time', None) or
+    getattr(time, 'process_time', None) or
+    time.clock
+)
+
+
+def describe(glet):
+    """ a readable name for a greenlet: its function, plus the scraper """
+    if glet.parent is None:
+        return 'main'
+    run = getattr(glet, '__dict__', {}).get('_run')
+    run = run or getattr(glet, 'run', None)
+    name = (
+        getattr(run, '__qualname__', None) or
+        getattr(run, '__name__', None) or
+        type(glet).__name__
+    )
+    args = getattr(glet, 'args', None) or ()
+    label = getattr(args[0], 'label', None) if args else None
+    if label:
+        name = '{0}[{1}]'.format(name, label)
+    return name
+
+
+class GreenletTime(object):
+    def __init__(self, name, now):
+        self.name = name
+        self.first = now
+        self.last = now
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.switches = 0
+
+
+class GreenletTimer(object):
+    """
+    Wall and CPU time every greenlet spends running, accounted on each
+    switch by a ``greenlet.settrace`` hook. A tracer installed before this
+    one keeps being called.
+    """
+
+    def __init__(self):
+        self.times = OrderedDict()
+        self._previous = None
+        self._wall = None
+        self._cpu = None
+
+    def record(self, glet, now):
+        # gevent drops a greenlet's function and arguments once it has
+        # run, so it is named the first time it is seen
+        entry = self.times.get(glet)
+        if entry is None:
+            entry = self.times[glet] = GreenletTime(describe(glet), now)
+        return entry
+
+    def start(self):
+        self._wall = timeit.default_timer()
+        self._cpu = _cpu_clock()
+        self.record(greenlet.getcurrent(), self._wall)
+        self._previous = greenlet.settrace(self.trace)
+        return self
+
+    def stop(self):
+        self.account(greenlet.getcurrent())
+        greenlet.settrace(self._previous)
+        self._previous = None
+
+    def account(self, glet):
+        """ charges the time since the last switch to ``glet`` """
+        wall = timeit.default_timer()
+        cpu = _cpu_clock()
+        entry = self.record(glet, wall)
+        entry.wall += wall - self._wall
+        entry.cpu += cpu - self._cpu
+        entry.last = wall
+        entry.switches += 1
+        self._wall = wall
+        self._cpu = cpu
+        return wall
+
+    def trace(self, event, args):
+        if event in ('switch', 'throw'):
+            origin, target = args
+            now = self.account(origin)
+            self.record(target, now).last = now
+        if self._previous is not None:
+            self._previous(event, args)
+
+    def name(self, glet):
+        entry = self.times.get(glet)
+        return entry.name if entry is not None else describe(glet)
+
+    def report(self):
+        lines = [
+            '{0:>10} {1:>10} {2:>10} {3:>9}  {4}'.format(
+                'wall ms', 'cpu ms', 'alive s', 'switches', 'greenlet'
+            )
+        ]
+        ordered = sorted(self.times.values(), key=lambda entry: -entry.cpu)
+        for entry in ordered:
+            lines.append(
+                '{0:>10.1f} {1:>10.1f} {2:>10.1f} {3:>9}  {4}'.format(
+                    entry.wall * 1000, entry.cpu * 1000,
+                    entry.last - entry.first, entry.switches, entry.name,
+                )
+            )
+        return '\n'.join(lines) + '\n'
+
+
+class StackSampler(object):
+    """
+    Samples the running stack every ``interval`` seconds of CPU time with
+    SIGPROF, so only the main thread is seen. Not available on Windows.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, name=describe):
+        self.interval = interval
+        self.name = name
+        self.stacks = Counter()
+        self._previous = None
+        self.running = False
+
+    def start(self):
+        if not hasattr(signal, 'setitimer'):
+            log.warning('stack sampling needs setitimer; skipped')
+            return self
+        try:
+            self._previous = signal.signal(signal.SIGPROF, self.sample)
+        except ValueError:
+            log.warning('stack sampling only works in the main thread')
+            return self
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self.running = True
+        return self
+
+    def stop(self):
+        if not self.running:
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous or signal.SIG_DFL)
+        self.running = False
+
+    def sample(self, signum, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('{0} ({1}:{2})'.format(
+                code.co_name, os.path.basename(code.co_filename),
+                code.co_firstlineno,
+            ))
+            frame = frame.f_back
+        names.append(self.name(greenlet.getcurrent()))
+        self.stacks[';'.join(reversed(names))] += 1
+
+    def collapsed(self):
+        return ''.join(
+            '{0} {1}\n'.format(stack, count)
+            for stack, count in sorted(self.stacks.items())
+        )
+
+
+class Profiler(object):
+    """ cProfile, stack samples and greenlet times for one process """
+
+    def __init__(self, prefix, interval=SAMPLE_INTERVAL):
+        self.prefix = prefix
+        self.pid = None
+        self.profile = cProfile.Profile()
+        self.greenlets = GreenletTimer()
+        self.sampler = StackSampler(interval, self.greenlets.name)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        global _active
+        self.pid = os.getpid()
+        self.greenlets.start()
+        self.sampler.start()
+        self.profile.enable()
+        _active = self
+        return self
+
+    def detach(self):
+        """ stops profiling without writing anything """
+        self.profile.disable()
+        self.sampler.stop()
+        self.greenlets.stop()
+
+    def stop(self):
+        global _active
+        self.detach()
+        _active = None
+        self.write()
+
+    def write(self):
+        try:
+            self.profile.dump_stats(self.prefix + '.pstats')
+            with io.open(self.prefix + '.collapsed', 'w',
+                         encoding='utf-8') as output:
+                output.write(self.sampler.collapsed())
+            # pstats prints native strings
+            with open(self.prefix + '.txt', 'w') as output:
+                stats = pstats.Stats(self.profile, stream=output)
+                stats.sort_stats('cumulative').print_stats(40)
+                output.write(str(self.greenlets.report()))
+        except (IOError, OSError):
+            log.exception('could not write the profile to {0}.*'.format(
+                self.prefix
+            ))
+            return
+        log.info('profile written to {0}.pstats, .collapsed and .txt'.format(
+            self.prefix
+        ))
+
+
+_active = None
+
+
+def start_profiler(suffix=''):
+    """ starts the profiler configured in settings, if there is one """
+    if _active is not None and _active.pid != os.getpid():
+        # inherited through a fork; this process gets a profile of its own
+        _active.detach()
+    if not settings.profile:
+        return None
+    return Profiler(settings.profile + suffix).start()
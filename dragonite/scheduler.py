@@ -0,0 +1,122 @@
+# -*- encoding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import datetime
+import logging
+import math
+
+import dateutil.parser
+
+from .conf import settings
+
+log = logging.getLogger(__name__)
+
+
+class HotWindow(object):
+    """ A period of time during which a hotel is polled more often. """
+
+    def __init__(self, start, end, interval):
+        self.start = self._check_datetime(start)
+        self.end = self._check_datetime(end)
+        self.interval = float(interval)
+
+    def _check_datetime(self, value):
+        if not isinstance(value, datetime.datetime):
+            return dateutil.parser.parse(value)
+        return value
+
+    def active(self, now=None):
+        now = now or datetime.datetime.now()
+        return self.start <= now < self.end
+
+    def __repr__(self):
+        return '<HotWindow {0} - {1} every {2}s>'.format(
+            self.start, self.end, self.interval
+        )
+
+
+def _backoff(interval, factor, count, ceiling):
+    """
+    ``interval * factor ** count``, or ``ceiling`` once it gets there, so
+    long error or unchanged streaks cannot overflow the power
+    """
+    if interval <= 0:
+        return interval
+    if factor <= 1:
+        return interval * factor ** count
+    if interval >= ceiling or count >= math.log(ceiling / interval, factor):
+        return ceiling
+    return interval * factor ** count
+
+
+class PollScheduler(object):
+    """
+    Decides how long a monitor waits before polling its hotel again.
+
+    Each consecutive error multiplies the interval by ``error_backoff`` and
+    each consecutive unchanged response by ``idle_backoff`` (capped at
+    ``max_interval``); any change snaps back to the base interval. While a
+    hot window is active its interval becomes the base and unchanged
+    responses no longer slow polling down.
+    """
+
+    def __init__(self, interval=None, max_interval=None, error_backoff=None,
+                 idle_backoff=None, hot_windows=None, min_delay=None):
+        self.interval = settings.interval if interval is None else interval
+        self.max_interval = (
+            settings.max_interval if max_interval is None else max_interval
+        )
+        self.error_backoff = (
+            settings.error_backoff if error_backoff is None else error_backoff
+        )
+        self.idle_backoff = (
+            settings.idle_backoff if idle_backoff is None else idle_backoff
+        )
+        if hot_windows is None:
+            hot_windows = settings.hot_windows
+        self.hot_windows = [
+            w if isinstance(w, HotWindow) else HotWindow(**w)
+            for w in hot_windows
+        ]
+        self.min_delay = (
+            settings.min_delay if min_delay is None else min_delay
+        )
+        self.errors = 0
+        self.unchanged = 0
+
+    def record(self, error=False, changed=True):
+        """ updates the schedule with the outcome of the latest poll """
+        if error:
+            self.errors += 1
+        elif changed:
+            self.errors = 0
+            self.unchanged = 0
+        else:
+            self.errors = 0
+            self.unchanged += 1
+
+    @property
+    def hot_window(self):
+        now = datetime.datetime.now()
+        for window in self.hot_windows:
+            if window.active(now):
+                return window
+        return None
+
+    @property
+    def current(self):
+        """ the interval in seconds to use for the next poll """
+        ceiling = max(self.max_interval, self.interval)
+        window = self.hot_window
+        if window is not None:
+            interval = window.interval
+        else:
+            interval = _backoff(
+                self.interval, self.idle_backoff, self.unchanged, ceiling
+            )
+        interval = _backoff(interval, self.error_backoff, self.errors, ceiling)
+        return min(interval, ceiling)
+
+    def delay(self, elapsed):
+        """ how long to sleep given the time the last poll already took """
+        return max(self.min_delay, self.current - float(elapsed))
@@ -1,22 +1,43 @@
 # -*- encoding: utf-8 -*-
 from __future__ import absolute_import, unicode_literals
 
+from .base import SessionManager
 from .hilton import HiltonAvailability
 from .hyatt import HyattAvailability
 from .hyattpasskey import HyattPasskeyAvailability
 from .marriott import MarriottAvailability
 from .marriott_discount import MarriottDiscountAvailability
 
+SCRAPERS = (
+    HyattAvailability,
+    HyattPasskeyAvailability,
+    HiltonAvailability,
+    MarriottAvailability,
+    MarriottDiscountAvailability,
+)
 
-def get_scrapers(start, end):
-    """ should this be done in the coroutines? """
-    return (
-        HyattAvailability(start, end),
-        HyattPasskeyAvailability(start, end),
-        HiltonAvailability(start, end),
-        MarriottAvailability(start, end),
-        MarriottDiscountAvailability(start, end),
-    )
+
+def get_scrapers(start, end, searches=None):
+    """
+    Creates one scraper per hotel for every search in the matrix.
+
+    :param searches: ``(checkin, checkout, guests)`` tuples; defaults to a
+        single search from ``start`` to ``end`` for four guests.
+
+    All of a hotel's probes share one ``SessionManager`` so the warm-up
+    hops and keep-alive connections are paid for once per hotel rather
+    than once per search.
+    """
+    if not searches:
+        searches = ((start, end, 4),)
+    probes = []
+    for scraper in SCRAPERS:
+        sessions = SessionManager(headers=scraper.session_headers)
+        for checkin, checkout, guests in searches:
+            probes.append(scraper(
+                checkin, checkout, numppl=guests, sessions=sessions
+            ))
+    return tuple(probes)
 
 
 def get_host_names():
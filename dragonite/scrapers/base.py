@@ -1,12 +1,93 @@
 from __future__ import absolute_import, unicode_literals
 
+import hashlib
 import logging
+import re
+import threading
+import timeit
 import traceback
 
+from bs4 import BeautifulSoup
+
+import lxml.etree
+import lxml.html
+
+import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, ReadTimeout
+from requests.utils import urlparse, urlunparse
+
+from .. import metrics
+from ..conf import settings
+from ..limiter import get_limiter
+
+log = logging.getLogger(__name__)
+
+EMPTY_DOCUMENT = '<html><body></body></html>'
+UNAVAILABLE = 'unavailable'
+AMBIGUOUS = 'ambiguous'
+# fragments which change on every request without the page meaning changing
+VOLATILE_PATTERNS = (
+    re.compile(r'<input[^>]*(?:csrf|token|nonce)[^>]*>', re.IGNORECASE),
+    re.compile(r'(?:jsessionid|sessionid|sid)=[\w.\-]+', re.IGNORECASE),
+    re.compile(r'\b\d{10,13}\b'),
+)
+
+
+def has_class(name):
+    """ XPath predicate matching elements carrying the given CSS class """
+    return (
+        'contains(concat(" ", normalize-space(@class), " "), " {0} ")'
+    ).format(name)
+
+
+def open_tag(attr, value):
+    """
+    Regex fragment matching the opening tag of an element whose ``attr``
+    holds ``value`` as one whitespace separated token, and the whitespace
+    following it
+    """
+    return (
+        r'<\w+[^>]*\s{0}="(?:[^"]*\s)?{1}(?:\s[^"]*)?"[^>]*>\s*'
+    ).format(attr, re.escape(value))
+
+
+def rebase(url):
+    """
+    Points a hotel URL at ``settings.base_url`` when one is configured;
+    the original host becomes the first path segment, so
+    ``https://www.marriott.com/a.mi`` turns into
+    ``<base url>/www.marriott.com/a.mi``.
+    """
+    if not settings.base_url:
+        return url
+    parts = urlparse(url)
+    return '{0}/{1}{2}'.format(
+        settings.base_url.rstrip('/'),
+        parts.netloc,
+        urlunparse(('', '', parts.path, parts.params, parts.query, '')),
+    )
+
+
+def url_origin(url):
+    """
+    Scheme and host a URL belongs to, for per-host limits; behind a
+    ``base_url`` the emulated host is kept apart from the others.
+    """
+    base = (settings.base_url or '').rstrip('/')
+    if base and url.startswith(base + '/'):
+        return '{0}/{1}'.format(base, url[len(base) + 1:].split('/', 1)[0])
+    parts = urlparse(url)
+    return '{0}://{1}'.format(parts.scheme, parts.netloc)
+
+
+class ServerError(Exception):
+    """ the hotel site answered a search with an HTTP 5xx """
 
 
 class RequestsGuard(object):
+    timeout_errors = (ReadTimeout,)
+    connection_errors = (ConnectionError,)
 
     def __init__(self, result, logname=None):
         self.log = logging.getLogger((logname if logname else __name__))
@@ -19,47 +100,305 @@ class RequestsGuard(object):
         handled = False
 
         if exc_value is not None:
+            kind = 'other'
             self.result.error = True
+            self.result.parent.sessions.recycle()
             self.result.traceback = ''.join(traceback.format_exception(
                 exc_type, exc_value, exc_traceback
             ))
 
-            if issubclass(exc_type, ReadTimeout):
+            if issubclass(exc_type, self.timeout_errors):
                 self.log.error(self.result.parent.msg('TIMEOUT'))
+                kind = 'timeout'
                 handled = True
-            elif issubclass(exc_type, ConnectionError):
+            elif issubclass(exc_type, self.connection_errors):
                 self.log.error(self.result.parent.msg('CONNECTION ERROR'))
+                kind = 'connection'
+                handled = True
+            elif issubclass(exc_type, ServerError):
+                self.log.error(self.result.parent.msg(
+                    'SERVER ERROR ({0})'.format(exc_value)
+                ))
+                kind = 'server'
                 handled = True
+            metrics.increment(
+                'scrape_errors_total', scraper=self.result.parent.name,
+                kind=kind,
+            )
 
         return handled
 
 
+class LimitedHTTPAdapter(HTTPAdapter):
+    """ HTTPAdapter which sends every request through the host limiter """
+
+    def __init__(self, limiter=None, **kwargs):
+        self.limiter = limiter if limiter is not None else get_limiter()
+        super(LimitedHTTPAdapter, self).__init__(**kwargs)
+
+    def send(self, request, stream=False, **kwargs):
+        with self.limiter.limit(url_origin(request.url)):
+            response = super(LimitedHTTPAdapter, self).send(
+                request, stream=stream, **kwargs
+            )
+            if not stream:
+                # the body is the slow part; download it within the budget
+                response.content
+            return response
+
+
+class SessionManager(object):
+    """
+    Owns a pooled keep-alive ``requests.Session`` for a scraper.
+
+    The same session (and therefore its connection pool and cookie jar) is
+    handed out across polling iterations until it is older than
+    ``max_age`` seconds or ``recycle`` is called after an error.
+
+    It also remembers when the warm-up hops last populated the cookie jar
+    so they only need to be replayed once ``warmup_ttl`` seconds pass or
+    the site bounces a search back to its landing page.
+    """
+
+    def __init__(self, pool_size=None, max_age=None, warmup_ttl=None,
+                 headers=None):
+        if pool_size is None:
+            pool_size = settings.session_pool_size
+        if max_age is None:
+            max_age = settings.session_max_age
+        if warmup_ttl is None:
+            warmup_ttl = settings.warmup_ttl
+        self.pool_size = pool_size
+        self.max_age = max_age
+        self.warmup_ttl = warmup_ttl
+        self.headers = headers
+        self.lock = threading.RLock()
+        self._session = None
+        self._created = None
+        self._warmed = None
+
+    @property
+    def expired(self):
+        if self._session is None:
+            return True
+        if not self.max_age:
+            return False
+        return (timeit.default_timer() - self._created) > self.max_age
+
+    @property
+    def warm(self):
+        if self._session is None or self._warmed is None:
+            return False
+        if not self.warmup_ttl:
+            return True
+        return (timeit.default_timer() - self._warmed) < self.warmup_ttl
+
+    def mark_warm(self):
+        self._warmed = timeit.default_timer()
+
+    def invalidate(self):
+        """ forget the warm-up state but keep the connections alive """
+        self._warmed = None
+
+    @property
+    def session(self):
+        with self.lock:
+            if self.expired:
+                self.recycle()
+                self._session = self.create()
+                self._created = timeit.default_timer()
+            return self._session
+
+    def create(self):
+        session = requests.Session()
+        adapter = LimitedHTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if self.headers:
+            session.headers.update(self.headers)
+        return session
+
+    def recycle(self):
+        """ discard the current session so the next use builds a new one """
+        with self.lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._created = None
+            self._warmed = None
+
+
+class HttpStep(object):
+    """ A single HTTP request made against a hotel site. """
+
+    def __init__(self, method, url, params=None, data=None, headers=None):
+        self.method = method
+        self.url = rebase(url)
+        self.params = params
+        self.data = data
+        self.headers = headers
+
+    def send(self, session, timeout):
+        return session.request(
+            self.method,
+            self.url,
+            params=self.params,
+            data=self.data,
+            headers=self.headers,
+            timeout=timeout,
+        )
+
+
 class ScrapeResults(object):
+    RECORD_FIELDS = (
+        'raw', 'available', 'post_process', 'error', 'traceback', 'prices',
+        'history', 'cookies',
+    )
 
     def __init__(self, parent):
         self.parent = parent
         self.raw = None
-        self.dom = None
+        self._dom = None
         self.session = None
         self.response = None
         self.available = False
         self.post_process = False
         self.error = False
         self.traceback = None
+        self.prices = []
+        self._fingerprint = None
+        self._history = None
+        self._cookies = None
+
+    def record(self):
+        """ plain-data copy of the result which can be sent to a process """
+        fields = self.RECORD_FIELDS
+        return dict((field, getattr(self, field)) for field in fields)
+
+    @classmethod
+    def from_record(cls, parent, record):
+        """ rebuilds a result produced by ``record`` in another process """
+        result = cls(parent)
+        for field in cls.RECORD_FIELDS:
+            setattr(result, field, record[field])
+        return result
+
+    @property
+    def fingerprint(self):
+        """ hash of the normalized response; None when the scrape failed """
+        if self.error is not False or self.raw is None:
+            return None
+        if self._fingerprint is None:
+            self._fingerprint = self.parent.fingerprint(self)
+        return self._fingerprint
+
+    @property
+    def history(self):
+        """ every URL visited to produce the final response """
+        if self._history is not None:
+            return self._history
+        if self.response is None:
+            return []
+        return [r.url for r in self.response.history] + [self.response.url]
+
+    @history.setter
+    def history(self, value):
+        self._history = value
+
+    @property
+    def cookies(self):
+        if self._cookies is not None:
+            return self._cookies
+        if self.session is None:
+            return {}
+        return self.session.cookies.get_dict()
+
+    @cookies.setter
+    def cookies(self, value):
+        self._cookies = value
+
+    @property
+    def dom(self):
+        """ built on first access and only over the scraper's parse regions """
+        if self._dom is None and self.raw is not None:
+            self._dom = self.parent.build_dom(self.raw)
+        return self._dom
+
+    @dom.setter
+    def dom(self, value):
+        self._dom = value
+
+    @property
+    def url(self):
+        """ final URL of the response, after any redirects """
+        return self.response.url if self.response is not None else None
+
+    def prescreen(self):
+        """
+        Settles errors and raw-text "no rooms" pages without a DOM; returns
+        True when the response still needs to be parsed.
+        """
+        if self.error is not False:
+            return False
+        if self.parent.classify(self) == UNAVAILABLE:
+            self.available = False
+            self.post_process = False
+            log.debug(self.parent.msg('UNAVAILABLE (raw text)'))
+            return False
+        return True
+
+    def apply_verdict(self, verdict):
+        """ copies the fields of a ``parse_verdict`` onto this result """
+        for field, value in verdict.items():
+            setattr(self, field, value)
 
     def evaluate(self):
-        if self.error is False:
-            self.parent.parse(self)
+        """
+        Decides availability, only building a DOM when the raw text does not
+        already settle the question.
+        """
+        with metrics.timer('parse_seconds', scraper=self.parent.name):
+            if self.prescreen():
+                from ..executor import get_executor
+                self.apply_verdict(
+                    get_executor().verdict(self.parent, self.raw, self.url)
+                )
 
 
 class HostHotelScraper(object):
     msgfmt = '{name}:rooms  {msg}'
+    rtimeout = 10
+    session_headers = None
+    landing_markers = ()
+    # XPath expressions for the only parts of the page ``parse`` looks at;
+    # None means the whole document is handed to BeautifulSoup
+    parse_regions = None
+    # substrings or compiled regexes which, when all present in the raw
+    # response, mean the page can only be the "no rooms" page; anchor them
+    # on the element markup ``parse`` looks at (see ``open_tag``) so that
+    # the sentence turning up in a script or stylesheet stays ambiguous
+    unavailable_markers = ()
+    # compiled regexes stripped (on top of VOLATILE_PATTERNS) before
+    # fingerprinting a response
+    volatile_patterns = ()
 
-    def __init__(self, start, end, numppl=4, numrooms=1):
+    def __init__(self, start, end, numppl=4, numrooms=1, sessions=None):
         self.start = start
         self.end = end
         self.numppl = numppl
         self.numrooms = numrooms
+        if sessions is None:
+            sessions = SessionManager(headers=self.session_headers)
+        self.sessions = sessions
+
+    def __getstate__(self):
+        """ the session cannot cross process boundaries; parsing needs none """
+        state = self.__dict__.copy()
+        state['sessions'] = None
+        return state
 
     def __call__(self, *args, **kwargs):
         """ convenience method of triggering a scrape """
@@ -73,12 +412,162 @@ class HostHotelScraper(object):
     def friendly(self):
         raise NotImplementedError('must have friendly attribute')
 
-    def scrape(self, result, **kwargs):
+    @property
+    def search(self):
+        """ human readable description of the stay being searched for """
+        return '{0:%m/%d/%Y} - {1:%m/%d/%Y}, {2} guests, {3} room(s)'.format(
+            self.start, self.end, self.numppl, self.numrooms
+        )
+
+    @property
+    def origin(self):
+        """ scheme and host the search request is sent to """
+        return url_origin(self.search_request().url)
+
+    @property
+    def label(self):
+        return '{0} [{1:%m/%d}-{2:%m/%d} x{3}]'.format(
+            self.friendly, self.start, self.end, self.numppl
+        )
+
+    def warmup_requests(self):
+        """ requests which set up the cookies the search depends on """
+        return ()
+
+    def search_request(self):
+        """ expected to return the HttpStep performing the actual search """
+        raise NotImplementedError('must implement search_request method')
+
+    def landed(self, response):
+        """ whether the search was bounced back to the site landing page """
+        return any(marker in response.url for marker in self.landing_markers)
+
+    def check_status(self, response):
+        """ an error page is no answer; it must not be parsed as one """
+        if response.status_code >= 500:
+            raise ServerError('HTTP {0}'.format(response.status_code))
+
+    @classmethod
+    def region_xpath(cls):
+        if cls.parse_regions is None:
+            return None
+        if cls.__dict__.get('_region_xpath') is None:
+            cls._region_xpath = lxml.etree.XPath(' | '.join(cls.parse_regions))
+        return cls._region_xpath
+
+    def region_markup(self, raw):
+        """
+        Markup of just the declared ``parse_regions`` of a raw response;
+        None when the scraper declares no regions.
+
+        libxml2 tokenizes the page without building Python objects and the
+        compiled XPath picks out the regions, outermost matches only.
+        """
+        xpath = self.region_xpath()
+        if xpath is None:
+            return None
+
+        if not isinstance(raw, bytes):
+            raw = raw.encode('utf-8')
+        parser = lxml.html.HTMLParser(encoding='utf-8')
+        try:
+            document = lxml.html.document_fromstring(raw, parser=parser)
+        except lxml.etree.ParserError:
+            return ''
+
+        regions = []
+        for element in xpath(document):
+            if any(parent in regions for parent in element.iterancestors()):
+                continue
+            regions.append(element)
+        return ''.join(
+            lxml.html.tostring(region, encoding='unicode', with_tail=False)
+            for region in regions
+        )
+
+    def build_dom(self, raw):
+        """
+        Parses only the declared ``parse_regions`` of the raw response.
+
+        Only the fragments from ``region_markup`` are turned into a
+        BeautifulSoup tree so ``parse`` can keep using ``dom.body.select``.
+        """
+        markup = self.region_markup(raw)
+        if markup is None:
+            return BeautifulSoup(raw, 'lxml')
+        return BeautifulSoup(markup or EMPTY_DOCUMENT, 'lxml')
+
+    def classify(self, result):
+        """ cheap check of the raw response for the "no rooms" page """
+        raw = result.raw
+        if not raw or not self.unavailable_markers:
+            return AMBIGUOUS
+        for marker in self.unavailable_markers:
+            if hasattr(marker, 'search'):
+                if marker.search(raw) is None:
+                    return AMBIGUOUS
+            elif marker not in raw:
+                return AMBIGUOUS
+        return UNAVAILABLE
+
+    def normalize(self, raw):
+        """ strips tokens and timestamps which change on every response """
+        for pattern in VOLATILE_PATTERNS + tuple(self.volatile_patterns):
+            raw = pattern.sub('', raw)
+        return raw
+
+    def fingerprint(self, result):
+        digest = hashlib.sha1()
+        if result.response is not None:
+            digest.update(self.normalize(result.response.url).encode('utf-8'))
+        digest.update(self.normalize(result.raw).encode('utf-8'))
+        return digest.hexdigest()
+
+    def send(self, step, session, rtimeout, hop):
+        """ sends one step, timing it as the ``hop`` of this scraper """
+        with metrics.timer('http_request_seconds', scraper=self.name, hop=hop):
+            return step.send(session, rtimeout)
+
+    def warmup(self, session, rtimeout):
+        for number, step in enumerate(self.warmup_requests(), 1):
+            r = self.send(step, session, rtimeout, 'warmup{0}'.format(number))
+            self.check_status(r)
+        self.sessions.mark_warm()
+
+    def scrape(self, result, rtimeout=None):
         """ expected to return a ScrapeResults object """
-        raise NotImplementedError('must implement scrape method')
+        rtimeout = rtimeout or self.rtimeout
+
+        with RequestsGuard(result, self.__module__):
+            s = self.sessions.session
+            with self.sessions.lock:
+                if not self.sessions.warm:
+                    self.warmup(s, rtimeout)
+            r = self.send(self.search_request(), s, rtimeout, 'search')
+
+            if self.landed(r):
+                log.debug(self.msg('session went stale; replaying warm-up'))
+                with self.sessions.lock:
+                    self.sessions.invalidate()
+                    self.warmup(s, rtimeout)
+                r = self.send(self.search_request(), s, rtimeout, 'search')
+
+            log.debug(self.msg('[HTTP {0}]'.format(r.status_code)))
+            self.check_status(r)
+
+            result.session = s
+            result.response = r
+            result.raw = r.text
+
+        return result
 
     def parse(self, result, **kwargs):
         raise NotImplementedError('must implement parse method')
 
     def msg(self, message):
-        return self.msgfmt.format(name=self.name, msg=message)
+        return self.msgfmt.format(
+            name='{0}[{1:%m/%d}-{2:%m/%d}x{3}]'.format(
+                self.name, self.start, self.end, self.numppl
+            ),
+            msg=message,
+        )
@@ -2,14 +2,11 @@
 from __future__ import absolute_import, unicode_literals
 
 import logging
-
-from bs4 import BeautifulSoup
+import re
 
 from fuzzywuzzy import fuzz
 
-import requests
-
-from .base import HostHotelScraper, RequestsGuard
+from .base import HostHotelScraper, HttpStep, has_class, open_tag
 
 log = logging.getLogger(__name__)
 
@@ -20,12 +17,30 @@ class HiltonAvailability(HostHotelScraper):
     phone = '404-659-2000'
     link = 'http://www.atlanta.hilton.com/'
     address = '255 Courtland Street NE Atlanta, GA 30303'
-
-    def scrape(self, result, rtimeout=10):
-        baseurl = 'http://www3.hilton.com'
-        home = '{0}/en/hotels/georgia/hilton-atlanta-ATLAHHH/index.html'
-        home = home.format(baseurl)
-        search = '{0}/en_US/hi/search/findhotels/index.htm'.format(baseurl)
+    baseurl = 'http://www3.hilton.com'
+    home = '{0}/en/hotels/georgia/hilton-atlanta-ATLAHHH/index.html'
+    home = home.format(baseurl)
+    landing_markers = ('hilton-atlanta-ATLAHHH/index.html',)
+    parse_regions = (
+        '//div[@id="main_content"]//div[@id="main"]'
+        '//div[{0}]'.format(has_class('alertBox')),
+    )
+    unavailable_markers = (
+        re.compile(
+            open_tag('class', 'alertBox') +
+            r'<p[^>]*>\s*'
+            r'There are no rooms available for[^<]*at Hilton Atlanta'
+        ),
+    )
+
+    def warmup_requests(self):
+        return (HttpStep('GET', self.home),)
+
+    def search_request(self):
+        # the post will redirect a number of times due to how their
+        # site processes the search requests
+        search = '{0}/en_US/hi/search/findhotels/index.htm'
+        search = search.format(self.baseurl)
         datefmt = '{0:%d} {0:%b} {0:%Y}'
         params = {
             'arrivalDate': datefmt.format(self.start),
@@ -58,33 +73,18 @@ class HiltonAvailability(HostHotelScraper):
             'numberOfChildren[6]': 0,
             'numberOfChildren[7]': 0,
             'numberOfChildren[8]': 0,
-            'numberOfRooms': 1,
+            'numberOfRooms': self.numrooms,
             'offerId': '',
             'promoCode': '',
             'roomKeyEnable': 'false',
             'searchQuery': '',
             'searchType': 'PROP',
         }
-
-        with RequestsGuard(result, __name__):
-            # the post will redirect a number of times due to how their
-            # site processes the search requests
-            s = requests.Session()
-            r = s.get(home, timeout=rtimeout)
-            r = s.post(search, params=params, timeout=rtimeout)
-
-            log.debug(self.msg('[HTTP {0}]'.format(r.status_code)))
-
-            result.session = s
-            result.response = r
-            result.dom = BeautifulSoup(r.text, 'lxml')
-            result.raw = r.text
-
-        return result
+        return HttpStep('POST', search, params=params)
 
     def parse(self, result, **kwargs):
         unavailable = 'There are no rooms available for - at Hilton Atlanta'
-        alert_selector = 'div#main_content div#main div.alertBox p'
+        alert_selector = 'div.alertBox p'
         alertps = result.dom.body.select(alert_selector)
         alerts = []
         not_available = False
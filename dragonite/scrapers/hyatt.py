@@ -2,12 +2,9 @@
 from __future__ import absolute_import, unicode_literals
 
 import logging
+import re
 
-from bs4 import BeautifulSoup
-
-import requests
-
-from .base import HostHotelScraper, RequestsGuard
+from .base import HostHotelScraper, HttpStep, has_class, open_tag
 
 log = logging.getLogger(__name__)
 
@@ -18,15 +15,28 @@ class HyattAvailability(HostHotelScraper):
     phone = '404-577-1234'
     link = 'https://atlanta.regency.hyatt.com/en/hotel/home.html'
     address = '265 Peachtree Street NE Atlanta, GA 30303'
-
-    def scrape(self, result, rtimeout=8):
-        """
-        A large timeout is required because their redirects take a very
-        long time to process and actually return a response
-        """
-        hyatturl = 'https://atlantaregency.hyatt.com'
-        baseurl = '{hyatt}/en/hotel/home.html'.format(hyatt=hyatturl)
-        searchurl = '{hyatt}/HICBooking'.format(hyatt=hyatturl)
+    hyatturl = 'https://atlantaregency.hyatt.com'
+    baseurl = '{hyatt}/en/hotel/home.html'.format(hyatt=hyatturl)
+    landing_markers = ('/en/hotel/home.html',)
+    parse_regions = ('//*[{0}]'.format(has_class('error-block')),)
+    unavailable_markers = (
+        re.compile(
+            open_tag('class', 'error-block') + open_tag('id', 'msg') +
+            open_tag('class', 'error') +
+            r'The hotel is not available for your requested travel dates\.'
+        ),
+    )
+    # a large timeout is required because their redirects take a very
+    # long time to process and actually return a response
+    rtimeout = 8
+
+    def warmup_requests(self):
+        return (HttpStep('GET', self.baseurl),)
+
+    def search_request(self):
+        # the request will redirect a number of times due to
+        # how their site processes the search requests
+        searchurl = '{hyatt}/HICBooking'.format(hyatt=self.hyatturl)
         datefmt = '{0:%-m} {0:%y}'
         params = {
             'Lang': 'en',
@@ -45,25 +55,10 @@ class HyattAvailability(HostHotelScraper):
             'offercode': '',
             'pid': 'atlra',
             'rateType': 'Standard',
-            'rooms': 1,
+            'rooms': self.numrooms,
             'srcd': 'dayprop',
         }
-
-        with RequestsGuard(result, __name__):
-            # the request will redirect a number of times due to
-            # how their site processes the search requests
-            s = requests.Session()
-            r = s.get(baseurl, timeout=rtimeout)
-            r = s.get(searchurl, params=params, timeout=rtimeout)
-
-            log.debug(self.msg('[HTTP {0}]'.format(r.status_code)))
-
-            result.session = s
-            result.response = r
-            result.dom = BeautifulSoup(r.text, 'lxml')
-            result.raw = r.text
-
-        return result
+        return HttpStep('GET', searchurl, params=params)
 
     def parse(self, result, **kwargs):
         search_text = (
@@ -2,12 +2,11 @@
 from __future__ import absolute_import, unicode_literals
 
 import logging
+import re
 
-from bs4 import BeautifulSoup
-
-import requests
-
-from .base import HostHotelScraper, RequestsGuard
+from .base import (
+    AMBIGUOUS, HostHotelScraper, HttpStep, has_class, open_tag,
+)
 
 log = logging.getLogger(__name__)
 
@@ -18,53 +17,62 @@ class HyattPasskeyAvailability(HostHotelScraper):
     phone = '404-577-1234'
     link = 'https://atlanta.regency.hyatt.com/en/hotel/home.html'
     address = '265 Peachtree Street NE Atlanta, GA 30303'
-
-    def scrape(self, result, rtimeout=8):
-        hyatturl = 'https://aws.passkey.com/event/14179207/owner/323'
-        baseurl = '{0}/home'.format(hyatturl)
-        groupurl = '{0}/home/group'.format(hyatturl)
-        landingurl = '{0}/landing'.format(hyatturl)
-        searchurl = '{0}/rooms/select'.format(hyatturl)
+    hyatturl = 'https://aws.passkey.com/event/14179207/owner/323'
+    session_headers = {
+        'User-Agent': (
+            'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.10; rv:43.0) '
+            'Gecko/20100101 Firefox/43.0'
+        ),
+        'Host': 'aws.passkey.com',
+    }
+    landing_markers = ('/landing', '/home')
+    parse_regions = (
+        '//*[@id="main"]//*[{0}]//*[@id="content"]'
+        '//*[{1}]'.format(has_class('shell'), has_class('message-room')),
+    )
+    unavailable_markers = (
+        re.compile(
+            open_tag('class', 'message-room') +
+            r'No lodging matches your search criteria\.'
+        ),
+    )
+    rtimeout = 8
+
+    def warmup_requests(self):
+        # there are all sorts of redirects involved here because of the way
+        # the site works to make sure necessary cookies and such are set
+        baseurl = '{0}/home'.format(self.hyatturl)
+        groupurl = '{0}/home/group'.format(self.hyatturl)
+        groupid = {
+            'groupTypeId': 52445573,
+        }
+        return (
+            HttpStep('GET', baseurl),
+            HttpStep('POST', groupurl, data=groupid),
+        )
+
+    def search_request(self):
+        landingurl = '{0}/landing'.format(self.hyatturl)
+        searchurl = '{0}/rooms/select'.format(self.hyatturl)
         datefmt = '{0:%Y}-{0:%m}-{0:%d}'
         payload = {
             'hotelId': 323,
             'blockMap.blocks[0].blockId': 0,
             'blockMap.blocks[0].checkIn': datefmt.format(self.start),
             'blockMap.blocks[0].checkOut': datefmt.format(self.end),
-            'blockMap.blocks[0].numberOfGuests': 4,
-            'blockMap.blocks[0].numberOfRooms': 1,
+            'blockMap.blocks[0].numberOfGuests': self.numppl,
+            'blockMap.blocks[0].numberOfRooms': self.numrooms,
             'blockMap.blocks[0].numberOfChildren': 0,
         }
-        groupid = {
-            'groupTypeId': 52445573,
+        headers = {
+            'Referer': landingurl,
         }
+        return HttpStep('POST', searchurl, data=payload, headers=headers)
 
-        with RequestsGuard(result, __name__):
-            # there are all sorts of redirects involved here because of the way
-            # the site works to make sure necessary cookies and such are set
-            s = requests.Session()
-            s.headers.update({
-                'User-Agent': (
-                    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.10; rv:43.0) '
-                    'Gecko/20100101 Firefox/43.0'
-                ),
-                'Host': 'aws.passkey.com',
-            })
-            r = s.get(baseurl, timeout=rtimeout)
-            r = s.post(groupurl, data=groupid, timeout=rtimeout)
-            s.headers.update({
-                'Referer': landingurl,
-            })
-            r = s.post(searchurl, data=payload, timeout=rtimeout)
-
-            log.debug(self.msg('[HTTP {0}]'.format(r.status_code)))
-
-            result.session = s
-            result.response = r
-            result.dom = BeautifulSoup(r.text, 'lxml')
-            result.raw = r.text
-
-        return result
+    def classify(self, result):
+        if 'maintenance/index.html' in result.response.url:
+            return AMBIGUOUS
+        return super(HyattPasskeyAvailability, self).classify(result)
 
     def parse(self, result, **kwargs):
         if 'maintenance/index.html' in result.response.url:
@@ -73,7 +81,7 @@ class HyattPasskeyAvailability(HostHotelScraper):
         not_available = False
 
         search_text = 'No lodging matches your search criteria.'
-        selector = '#main .shell #content .message-room'
+        selector = '.message-room'
         messages = result.dom.body.select(selector)
         for message in messages:
             if not_available is True:
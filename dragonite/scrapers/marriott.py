@@ -2,12 +2,9 @@
 from __future__ import absolute_import, unicode_literals
 
 import logging
+import re
 
-from bs4 import BeautifulSoup
-
-import requests
-
-from .base import HostHotelScraper, RequestsGuard
+from .base import HostHotelScraper, HttpStep, has_class, open_tag
 from ..conf import settings
 
 log = logging.getLogger(__name__)
@@ -25,11 +22,32 @@ class MarriottAvailability(HostHotelScraper):
         'app=resvlink&stop_mobi=yes'
     )
     address = '265 Peachtree Center Avenue Atlanta, GA 30303'
+    base = 'https://www.marriott.com'
+    home = '{0}/hotels/travel/atlmq-atlanta-marriott-marquis/'.format(base)
+    landing_markers = ('/hotels/travel/atlmq-atlanta-marriott-marquis/',)
+    parse_regions = (
+        '//*[@id="popover-panel"]',
+        '//div[{0}]//div[{1}]//div[{2}]//*[{3}]'.format(
+            has_class('results-container'),
+            has_class('room-rate-results'),
+            has_class('rate-price'),
+            has_class('t-price'),
+        ),
+    )
+    unavailable_markers = (
+        re.compile(
+            open_tag('id', 'popover-panel') +
+            open_tag('id', 'no-rooms-available') +
+            r'Sorry, currently there are no rooms available at this'
+        ),
+    )
+    rtimeout = 5
+
+    def warmup_requests(self):
+        return (HttpStep('GET', self.home),)
 
-    def scrape(self, result, rtimeout=5):
-        base = 'https://www.marriott.com'
-        home = '{0}/hotels/travel/atlmq-atlanta-marriott-marquis/'.format(base)
-        search = '{0}/reservation/availabilitySearch.mi'.format(base)
+    def search_request(self):
+        search = '{0}/reservation/availabilitySearch.mi'.format(self.base)
         params = {
             'fromDate': '{0:%m}/{0:%d}/{0:%Y}'.format(self.start),
             'toDate': '{0:%m}/{0:%d}/{0:%Y}'.format(self.end),
@@ -47,24 +65,11 @@ class MarriottAvailability(HostHotelScraper):
             'miniStoreAvailabilitySear...': 'false',
             'numberOfGuests': self.numppl,
             'numberOfNights': 1,
-            'numberOfRooms': 1,
+            'numberOfRooms': self.numrooms,
             'propertyCode': 'atlmq',
             'useRewardsPoints': 'false',
         }
-
-        with RequestsGuard(result, __name__):
-            s = requests.Session()
-            r = s.get(home, timeout=rtimeout)
-            r = s.get(search, params=params, timeout=rtimeout)
-
-            log.debug(self.msg('[HTTP {0}]'.format(r.status_code)))
-
-            result.session = s
-            result.response = r
-            result.dom = BeautifulSoup(r.text, 'lxml')
-            result.raw = r.text
-
-        return result
+        return HttpStep('GET', search, params=params)
 
     def parse(self, result, **kwargs):
         unavailable = 'Sorry, currently there are no rooms available at this '
@@ -84,15 +89,13 @@ class MarriottAvailability(HostHotelScraper):
                 log.error(self.msg(errmsg))
 
         if not not_available:
-            selector = (
-                'div.results-container div.room-rate-results '
-                'div.rate-price .t-price'
-            )
+            selector = '.t-price'
             rooms = result.dom.body.select(selector)
             lowest = None
             for room in rooms:
                 price = float(room.get_text().strip().split()[0])
                 log.debug(price)
+                result.prices.append(price)
                 if lowest is None or price < lowest:
                     lowest = price
             if lowest is not None and lowest > settings.max_price:
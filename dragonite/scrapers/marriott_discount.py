@@ -2,12 +2,9 @@
 from __future__ import absolute_import, unicode_literals
 
 import logging
+import re
 
-from bs4 import BeautifulSoup
-
-import requests
-
-from .base import HostHotelScraper, RequestsGuard
+from .base import HostHotelScraper, HttpStep, open_tag
 
 log = logging.getLogger(__name__)
 
@@ -24,10 +21,24 @@ class MarriottDiscountAvailability(HostHotelScraper):
         'app=resvlink&stop_mobi=yes'
     )
     address = '265 Peachtree Center Avenue Atlanta, GA 30303'
+    base = 'https://www.marriott.com'
+    landing_markers = ('groupCorp.mi',)
+    parse_regions = ('//*[@id="popover-panel"]',)
+    unavailable_markers = (
+        re.compile(
+            open_tag('id', 'popover-panel') +
+            open_tag('id', 'unsuccessful-sell-popover') +
+            r'(?:<p[^>]*>\s*)?'
+            r'Sorry, there are no rooms remaining in the group block'
+        ),
+    )
+    rtimeout = 5
 
-    def scrape(self, result, rtimeout=5):
-        base = 'https://www.marriott.com'
-        ratelist = '{0}/meetings/rateListMenu.mi'.format(base)
+    def warmup_requests(self):
+        return (HttpStep('GET', self.link),)
+
+    def search_request(self):
+        ratelist = '{0}/meetings/rateListMenu.mi'.format(self.base)
         params = {
             'fromDate': '{0:%m}/{0:%d}/{0:%y}'.format(self.start),
             'toDate': '{0:%m}/{0:%d}/{0:%y}'.format(self.end),
@@ -55,20 +66,7 @@ class MarriottDiscountAvailability(HostHotelScraper):
             'single-search-date-format': 'mm/dd/yy',
             'weekDays': 'S,M,T,W,T,F,S',
         }
-
-        with RequestsGuard(result, __name__):
-            s = requests.Session()
-            r = s.get(self.link, timeout=rtimeout)
-            r = s.post(ratelist, params=params, timeout=rtimeout)
-
-            log.debug(self.msg('[HTTP {0}]'.format(r.status_code)))
-
-            result.session = s
-            result.response = r
-            result.dom = BeautifulSoup(r.text, 'lxml')
-            result.raw = r.text
-
-        return result
+        return HttpStep('POST', ratelist, params=params)
 
     def parse(self, result, **kwargs):
         unavailable = (
@@ -0,0 +1,150 @@
+# -*- encoding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import logging
+from collections import OrderedDict
+
+import gevent
+from gevent.socket import wait_read
+
+from . import metrics, profiling
+from .utils import fork_context
+
+log = logging.getLogger(__name__)
+
+
+class Shard(object):
+    """ A worker process running the monitors for part of the scrapers. """
+
+    def __init__(self, index, probes):
+        self.index = index
+        self.probes = probes
+        self.process = None
+        self.connection = None
+
+    @property
+    def name(self):
+        return 'shard-{0}'.format(self.index)
+
+    def start(self, monitor):
+        context = fork_context()
+        reader, writer = context.Pipe(duplex=False)
+        self.process = context.Process(
+            target=_run_shard,
+            args=(self.probes, writer, monitor, self.index),
+            name=self.name,
+        )
+        self.process.daemon = True
+        self.process.start()
+        writer.close()
+        self.connection = reader
+        log.debug('{0} started with {1} scrapers (pid {2})'.format(
+            self.name, len(self.probes), self.process.pid
+        ))
+
+    def stop(self):
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+        if self.process is not None:
+            self.process.join(timeout=5)
+
+
+def partition(scrapers, workers):
+    """
+    Splits the scrapers into at most ``workers`` shards.
+
+    Scrapers are grouped by the origin they search so a host's rate limit,
+    connection budget and shared session stay within a single process;
+    the groups are then dealt out largest first to the emptiest shard.
+
+    :returns: list of lists of ``(index, scraper)`` pairs
+    """
+    groups = OrderedDict()
+    for index, scraper in enumerate(scrapers):
+        groups.setdefault(scraper.origin, []).append((index, scraper))
+    shards = [[] for _ in range(min(workers, len(groups)))]
+    ordered = sorted(groups.values(), key=len, reverse=True)
+    for group in ordered:
+        min(shards, key=len).extend(group)
+    return shards
+
+
+def start_shards(scrapers, workers, monitor):
+    """
+    Forks the shard processes; call before spawning any other greenlets.
+
+    :param monitor: called as ``monitor(scraper, publish, touch)`` for
+        every scraper in the shard, inside the shard process.
+    """
+    shards = []
+    for index, probes in enumerate(partition(scrapers, workers)):
+        shard = Shard(index, probes)
+        shard.start(monitor)
+        shards.append(shard)
+    return shards
+
+
+def _run_shard(probes, connection, monitor, shard_index=0):
+    """ body of a shard process: run the monitors and stream the results """
+    indexes = dict((id(scraper), index) for index, scraper in probes)
+    suffix = '.shard{0}'.format(shard_index)
+    profiler = profiling.start_profiler(suffix)
+    exporter = metrics.start_exporter(suffix)
+
+    def publish(result):
+        result.evaluate()
+        connection.send((
+            'result', indexes[id(result.parent)], result.record()
+        ))
+
+    def touch(result):
+        connection.send(('touch', indexes[id(result.parent)]))
+
+    monitors = [
+        gevent.spawn(monitor, scraper, publish, touch)
+        for _, scraper in probes
+    ]
+    gevent.joinall(monitors)
+    # the coordinator terminates the shard once it hears it is done
+    if exporter is not None:
+        exporter.stop()
+    if profiler is not None:
+        profiler.stop()
+    connection.send(('done', [m.value for m in monitors]))
+    connection.close()
+
+
+def relay(shard, scrapers, record, touch):
+    """
+    Coordinator greenlet feeding a shard's results into ``record``, and
+    the last result of each scraper into ``touch`` whenever the shard
+    reports it unchanged.
+
+    Results are rebuilt around the coordinator's own scraper objects so
+    database writes and alerts are handled centrally.
+    """
+    from .scrapers.base import ScrapeResults
+
+    latest = {}
+    names = []
+    try:
+        while True:
+            wait_read(shard.connection.fileno())
+            try:
+                message = shard.connection.recv()
+            except EOFError:
+                log.error('{0} exited unexpectedly'.format(shard.name))
+                break
+            if message[0] == 'done':
+                names = message[1]
+                break
+            if message[0] == 'touch':
+                if message[1] in latest:
+                    touch(latest[message[1]])
+                continue
+            _, index, data = message
+            latest[index] = ScrapeResults.from_record(scrapers[index], data)
+            record(latest[index])
+    finally:
+        shard.stop()
+    return names
@@ -1,6 +1,31 @@
 from __future__ import absolute_import, unicode_literals
 
+import datetime
 import logging
+import multiprocessing
+import os
+
+import dateutil.parser
+
+
+def check_date(value):
+    """ parses ``value`` into a date; dates and None are passed through """
+    if value is not None and not isinstance(value, datetime.date):
+        return dateutil.parser.parse(value).date()
+    return value
+
+
+def fork_context():
+    """
+    ``multiprocessing`` bound to the fork start method, or None where the
+    platform cannot fork; worker processes rely on fork to inherit the
+    configured settings and scrapers
+    """
+    if not hasattr(multiprocessing, 'get_context'):
+        return multiprocessing if os.name == 'posix' else None
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    return multiprocessing.get_context('fork')
 
 
 class LogAndForget(object):
@@ -27,6 +27,9 @@ EXTRAS = {
         'pytest >= 2.8.4',
         'coverage >= 4.0.3',
     ),
+    'asyncio': (
+        'aiohttp >= 3.3',
+    ),
     # 'caching': (
     #     'redis>=2.10.3',
     #     'hiredis>=0.2.0',
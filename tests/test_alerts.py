@@ -0,0 +1,103 @@
+# -*- encoding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from dragonite import alerts, coroutines
+from dragonite.comm import SMTPFanOutError
+from dragonite.conf import settings
+
+
+class FakeScraper(object):
+    name = 'hotel'
+    label = 'Hotel'
+    search = None
+
+    def __init__(self, pages):
+        self.pages = list(pages)
+
+    def __call__(self):
+        fingerprint, available = self.pages.pop(0)
+        return FakeResult(self, fingerprint, available)
+
+
+class FakeResult(object):
+    error = False
+
+    def __init__(self, parent, fingerprint, available):
+        self.parent = parent
+        self.fingerprint = fingerprint
+        self.available = available
+
+
+def monitor(pages):
+    settings.configure(
+        loglevel='error', simple=True, max_attempts=len(pages), interval=0
+    )
+    published = []
+    touched = []
+    coroutines._monitor_rooms(
+        FakeScraper(pages), publish=published.append, touch=touched.append
+    )
+    return published, touched
+
+
+def test_unchanged_available_polls_are_touched():
+    published, touched = monitor([('a', True), ('a', True), ('a', True)])
+    assert len(published) == 1
+    assert touched == [published[0], published[0]]
+
+
+def test_unchanged_unavailable_polls_are_skipped():
+    published, touched = monitor([('a', False), ('a', False), ('b', True)])
+    assert len(published) == 2
+    assert touched == []
+
+
+def test_touched_result_is_alerted_again_after_forget():
+    published, touched = monitor([('a', True), ('a', True)])
+    tracker = alerts.AvailabilityTracker(reminder=0)
+    assert tracker.observe(published[0])
+    assert not tracker.observe(touched[0])
+    tracker.forget(published[0])
+    assert tracker.observe(touched[0])
+
+
+def test_touched_result_is_reminded(monkeypatch):
+    published, touched = monitor([('a', True), ('a', True)])
+    tracker = alerts.AvailabilityTracker(reminder=60)
+    assert tracker.observe(published[0])
+    assert not tracker.observe(touched[0])
+    now = alerts.timeit.default_timer() + 61
+    monkeypatch.setattr(alerts.timeit, 'default_timer', lambda: now)
+    assert tracker.observe(touched[0])
+
+
+class FlakyGateway(object):
+    """ reaches one more recipient on every attempt """
+
+    def __init__(self, recipients):
+        self.recipients = recipients
+        self.sent = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def notify(self, result, ref_uuid=None, delivered=None):
+        pending = [r for r in self.recipients if r not in delivered]
+        self.sent.append(pending[0])
+        delivered.append(pending[0])
+        if pending[1:]:
+            raise SMTPFanOutError(pending[1:])
+
+
+def test_retries_only_go_to_missed_recipients():
+    settings.configure(loglevel='error', simple=True)
+    gateway = settings.comm = FlakyGateway(['a', 'b', 'c'])
+    worker = alerts.NotificationWorker(retries=3, timeout=5, retry_delay=0)
+    try:
+        assert worker.deliver(FakeResult(FakeScraper([]), 'a', True))
+    finally:
+        settings.comm = None
+    assert gateway.sent == ['a', 'b', 'c']
@@ -0,0 +1,190 @@
+# -*- encoding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import datetime
+import sqlite3
+
+import pytest
+
+from dragonite import beaker
+
+SEP1 = datetime.date(2016, 9, 1)
+SEP2 = datetime.date(2016, 9, 2)
+SEP5 = datetime.date(2016, 9, 5)
+
+# the tables as the first release created them, before schema versions
+LEGACY_SCHEMA = '''
+CREATE TABLE invocation (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, uuid CHAR(32), created DATETIME,
+    modified DATETIME, debug BOOLEAN, info BOOLEAN, simple BOOLEAN,
+    use_cache BOOLEAN, use_db BOOLEAN, max_attempts INTEGER,
+    max_price INTEGER, checkin DATE, checkout DATE, loglevel VARCHAR(10),
+    verbose BOOLEAN, sms_enabled BOOLEAN, email_enabled BOOLEAN
+);
+CREATE TABLE scraperesultentry (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, uuid CHAR(32), created DATETIME,
+    modified DATETIME, invocation_id INTEGER REFERENCES invocation (id),
+    hotel VARCHAR, available BOOLEAN, processed BOOLEAN, error BOOLEAN,
+    traceback TEXT, post_process BOOLEAN, raw TEXT, history TEXT,
+    cookies TEXT
+);
+INSERT INTO invocation (id, uuid, checkin, checkout)
+    VALUES (1, '{0:032x}', '2016-09-01', '2016-09-05');
+'''
+LEGACY_ENTRY = (
+    'INSERT INTO scraperesultentry '
+    '(uuid, created, invocation_id, hotel, available, raw) '
+    "VALUES (?, '2016-08-01 12:00:00.000000', 1, 'hilton', 0, ?)"
+)
+
+
+class Scraper(object):
+    name = 'hilton'
+
+    def __init__(self, start, end, numppl):
+        self.start = start
+        self.end = end
+        self.numppl = numppl
+
+
+class Result(object):
+    available = False
+    post_process = False
+    error = False
+    traceback = None
+    history = []
+    cookies = {}
+
+    def __init__(self, parent, available=False):
+        self.parent = parent
+        self.available = available
+
+
+@pytest.fixture
+def session(tmpdir):
+    beaker.init_database(db_filename=str(tmpdir.join('test.sqlite3')))
+    session = beaker.create_session()
+    yield session
+    session.close()
+
+
+def record(session, start, end, guests, available=False):
+    entry = beaker.ScrapeResultEntry.from_result(
+        Result(Scraper(start, end, guests), available)
+    )
+    session.add(entry)
+    session.commit()
+    return entry
+
+
+def test_entries_record_their_search(session):
+    entry = record(session, datetime.datetime(2016, 9, 1, 12), SEP5, 3)
+    assert entry.search == (SEP1, SEP5, 3)
+
+
+def test_queries_filter_by_search(session):
+    record(session, SEP1, SEP5, 2, available=True)
+    record(session, SEP1, SEP5, 4)
+    record(session, SEP2, SEP5, 4)
+
+    assert beaker.last_available(session, 'hilton') is not None
+    assert beaker.last_available(
+        session, 'hilton', (SEP1, SEP5, 4)
+    ) is None
+    assert beaker.last_result(
+        session, 'hilton', (SEP1, SEP5, 2)
+    ).available
+    assert len(beaker.recent_results(
+        session, search=(None, None, 4)
+    )) == 2
+    summaries = beaker.hotel_summaries(session)
+    assert [(s.checkin, s.guests, s.polls) for s in summaries] == [
+        (SEP1, 2, 1), (SEP1, 4, 1), (SEP2, 4, 1),
+    ]
+
+
+def test_failed_batch_only_drops_the_bad_write(session):
+    taken = record(session, SEP1, SEP5, 4)
+    entries = [
+        beaker.ScrapeResultEntry.from_result(
+            Result(Scraper(SEP1, SEP5, 4))
+        ) for _ in range(3)
+    ]
+    entries[1].uuid = taken.uuid
+    beaker.apply_writes(session, [
+        ('insert', entries[0], '<html>one</html>'),
+        ('insert', entries[1], '<html>two</html>'),
+        ('insert', entries[2], None),
+        ('update', taken, {'processed': True}),
+    ])
+
+    rows = session.query(beaker.ScrapeResultEntry).all()
+    assert set(row.uuid for row in rows) == set(
+        [taken.uuid, entries[0].uuid, entries[2].uuid]
+    )
+    assert taken.processed
+    assert entries[0].raw == '<html>one</html>'
+
+
+def test_upgrade_fills_in_the_stay_of_older_entries(session):
+    invocation = beaker.Invocation(checkin=SEP1, checkout=SEP5)
+    session.add(invocation)
+    session.commit()
+    entry = record(session, SEP1, SEP5, 4)
+    entry.invocation_id = invocation.id
+    entry.checkin = entry.checkout = entry.guests = None
+    session.query(beaker.SchemaVersion).delete()
+    session.add(beaker.SchemaVersion(version=3))
+    session.commit()
+
+    beaker.init_database(db_url=str(session.bind.url))
+    assert beaker.schema_version() == beaker.SCHEMA_VERSION
+    session.expire_all()
+    assert entry.search == (SEP1, SEP5, None)
+
+
+@pytest.fixture
+def legacy_db(tmpdir):
+    """ a database written before schema versions, holding two entries """
+    path = str(tmpdir.join('legacy.sqlite3'))
+    connection = sqlite3.connect(path)
+    connection.executescript(LEGACY_SCHEMA.format(1))
+    for number, raw in enumerate(('<html>one</html>', '<html>two</html>')):
+        connection.execute(LEGACY_ENTRY, ('{0:032x}'.format(number + 2), raw))
+    connection.commit()
+    connection.close()
+    return path
+
+
+def test_upgrade_fills_in_the_stay_of_unversioned_entries(legacy_db):
+    beaker.init_database(db_filename=legacy_db)
+    assert beaker.schema_version() == beaker.SCHEMA_VERSION
+    session = beaker.create_session()
+    try:
+        entries = session.query(beaker.ScrapeResultEntry).all()
+        assert [e.search for e in entries] == [(SEP1, SEP5, None)] * 2
+        summaries = beaker.hotel_summaries(session)
+        assert [(s.checkin, s.checkout, s.polls) for s in summaries] == [
+            (SEP1, SEP5, 2),
+        ]
+    finally:
+        session.close()
+
+
+def test_upgrade_moves_legacy_responses_into_blobs(legacy_db):
+    beaker.init_database(db_filename=legacy_db)
+    session = beaker.create_session()
+    try:
+        entries = session.query(beaker.ScrapeResultEntry).all()
+        assert [e.raw for e in entries] == [
+            '<html>one</html>', '<html>two</html>',
+        ]
+        assert session.query(beaker.ResponseBlob).count() == 2
+    finally:
+        session.close()
+    connection = sqlite3.connect(legacy_db)
+    leftover = connection.execute(
+        'SELECT COUNT(*) FROM scraperesultentry WHERE raw IS NOT NULL'
+    ).fetchone()[0]
+    connection.close()
+    assert leftover == 0
@@ -0,0 +1,29 @@
+# -*- encoding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import datetime
+
+import pytest
+from click.testing import CliRunner
+
+from dragonite import cli
+
+
+def test_stays_are_parsed_into_dates():
+    stays = cli._validate_stays(None, None, ('2016-09-01:2016-09-03',))
+    assert stays == [{
+        'checkin': datetime.date(2016, 9, 1),
+        'checkout': datetime.date(2016, 9, 3),
+    }]
+
+
+@pytest.mark.parametrize('stay', [
+    '2016-09-01',
+    '2016-09-01:someday',
+    '2016-09-03:2016-09-01',
+    '2016-09-01:2016-09-01',
+])
+def test_invalid_stays_are_rejected(stay):
+    result = CliRunner().invoke(cli.rooms, ['--stay', stay])
+    assert result.exit_code == 2
+    assert 'Invalid value for' in result.output
@@ -0,0 +1,55 @@
+# -*- encoding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import gevent
+import pytest
+
+from dragonite import comm
+
+
+@pytest.fixture
+def outbox(monkeypatch):
+    sent = []
+    failing = set()
+    slow = set()
+
+    def send(connection, recipient, message):
+        if recipient in slow:
+            gevent.sleep(1)
+        if recipient in failing:
+            raise comm.smtplib.SMTPRecipientsRefused({recipient: (550, '')})
+        sent.append(recipient)
+
+    monkeypatch.setattr(comm.SMTPConnection, 'send', send)
+    monkeypatch.setattr(comm, '_cooperative', lambda: True)
+    return sent, failing, slow
+
+
+def pool():
+    return comm.SMTPPool('localhost', sender='me@example.com', pool_size=4)
+
+
+def test_fan_out_error_names_only_the_failed_recipients(outbox):
+    sent, failing, _ = outbox
+    failing.add('b')
+    delivered = []
+    with pytest.raises(comm.SMTPFanOutError) as error:
+        pool().send_all(
+            [('a', 'x'), ('b', 'x'), ('c', 'x')], delivered
+        )
+    assert error.value.recipients == ['b']
+    assert sorted(delivered) == ['a', 'c']
+
+
+def test_fan_out_is_killed_past_the_deadline(outbox):
+    sent, _, slow = outbox
+    slow.add('b')
+    delivered = []
+    gateway = pool()
+    with pytest.raises(gevent.Timeout):
+        with gevent.Timeout(0.1):
+            gateway.send_all([('a', 'x'), ('b', 'x')], delivered)
+    gevent.sleep(1.5)
+    assert sent == ['a']
+    assert delivered == ['a']
+    assert gateway._idle.qsize() == gateway.size
@@ -0,0 +1,22 @@
+# -*- encoding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from dragonite import conf
+from dragonite.conf import settings
+
+
+def test_worker_processes_need_fork(monkeypatch):
+    monkeypatch.setattr(conf, 'fork_context', lambda: None)
+    settings.configure(
+        loglevel='error', simple=True, workers=4, parse_executor='process'
+    )
+    assert settings.workers == 1
+    assert settings.parse_executor == 'thread'
+
+
+def test_worker_processes_fork_where_possible():
+    settings.configure(
+        loglevel='error', simple=True, workers=4, parse_executor='process'
+    )
+    assert settings.workers == 4
+    assert settings.parse_executor == 'process'
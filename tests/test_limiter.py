@@ -0,0 +1,55 @@
+# -*- encoding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from dragonite.scrapers.base import LimitedHTTPAdapter
+
+
+class Limiter(object):
+    def __init__(self):
+        self.held = False
+
+    @contextmanager
+    def limit(self, origin):
+        self.held = True
+        try:
+            yield
+        finally:
+            self.held = False
+
+
+class Response(requests.Response):
+    def __init__(self, limiter):
+        super(Response, self).__init__()
+        self.limiter = limiter
+        self.read_within_limit = None
+
+    @property
+    def content(self):
+        if self.read_within_limit is None:
+            self.read_within_limit = self.limiter.held
+        return b''
+
+
+def send(limiter, monkeypatch, stream):
+    monkeypatch.setattr(
+        HTTPAdapter, 'send',
+        lambda adapter, request, **kwargs: Response(limiter),
+    )
+    adapter = LimitedHTTPAdapter(limiter=limiter)
+    request = requests.Request('GET', 'http://hotel.example/').prepare()
+    return adapter.send(request, stream=stream)
+
+
+def test_body_is_downloaded_within_the_host_budget(monkeypatch):
+    response = send(Limiter(), monkeypatch, stream=False)
+    assert response.read_within_limit is True
+
+
+def test_streamed_body_is_left_to_the_caller(monkeypatch):
+    response = send(Limiter(), monkeypatch, stream=True)
+    assert response.read_within_limit is None
@@ -0,0 +1,71 @@
+# -*- encoding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import datetime
+
+from dragonite.scheduler import PollScheduler
+
+
+def schedule(**options):
+    defaults = dict(
+        interval=5, max_interval=60, error_backoff=2.0, idle_backoff=1.05,
+        hot_windows=[], min_delay=0.1,
+    )
+    defaults.update(options)
+    return PollScheduler(**defaults)
+
+
+def test_backoff_grows_until_the_cap():
+    s = schedule()
+    s.record(error=True)
+    s.record(error=True)
+    assert s.current == 20
+    s.record(error=True)
+    s.record(error=True)
+    assert s.current == 60
+
+
+def test_long_error_streak_stays_at_the_cap():
+    s = schedule()
+    for _ in range(5000):
+        s.record(error=True)
+    assert s.current == 60
+    assert s.delay(0) == 60
+
+
+def test_long_unchanged_streak_stays_at_the_cap():
+    s = schedule()
+    for _ in range(50000):
+        s.record(changed=False)
+    assert s.current == 60
+    s.record(error=True)
+    assert s.current == 60
+
+
+def test_long_streaks_with_zero_interval():
+    s = schedule(interval=0, max_interval=0)
+    for _ in range(50000):
+        s.record(changed=False)
+    for _ in range(5000):
+        s.record(error=True)
+    assert s.current == 0
+
+
+def test_long_error_streak_in_hot_window():
+    now = datetime.datetime.now()
+    s = schedule(hot_windows=[dict(
+        start=now - datetime.timedelta(hours=1),
+        end=now + datetime.timedelta(hours=1),
+        interval=1,
+    )])
+    for _ in range(5000):
+        s.record(error=True)
+    assert s.current == 60
+
+
+def test_change_resets_the_backoff():
+    s = schedule()
+    for _ in range(5000):
+        s.record(error=True)
+    s.record(changed=True)
+    assert s.current == 5
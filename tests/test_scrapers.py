@@ -0,0 +1,93 @@
+# -*- encoding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import datetime
+import io
+import os
+
+import pytest
+
+from dragonite import scrapers
+from dragonite.emulator import CONTENT
+from dragonite.scrapers.base import AMBIGUOUS, UNAVAILABLE
+
+FIXTURES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'benchmarks', 'fixtures',
+)
+SCRAPERS = {
+    'hilton': scrapers.HiltonAvailability,
+    'hyatt': scrapers.HyattAvailability,
+    'hyatt_passkey': scrapers.HyattPasskeyAvailability,
+    'marriott': scrapers.MarriottAvailability,
+    'marriott_discount': scrapers.MarriottDiscountAvailability,
+}
+# the "no rooms" sentences as they might turn up outside of the element
+# the DOM parse looks at, e.g. quoted by a script bundle or a stylesheet
+DECOYS = {
+    'hilton': (
+        '<div class="alertBox info"><p>Rates are per room.</p></div>'
+        '<script>var msg = "There are no rooms available for {0} at '
+        'Hilton Atlanta";</script>'
+    ),
+    'hyatt': (
+        '<style>.error-block #msg .error { color: red }</style>'
+        '<script>var msg = "The hotel is not available for your requested '
+        'travel dates.";</script>'
+    ),
+    'hyatt_passkey': (
+        '<style>.message-room { display: none }</style>'
+        '<script>var msg = "No lodging matches your search criteria.";'
+        '</script>'
+    ),
+    'marriott': (
+        '<div id="popover-panel"></div><script>var el = '
+        '\'<div id="no-rooms-available">\', msg = "Sorry, currently there '
+        'are no rooms available at this property";</script>'
+    ),
+    'marriott_discount': (
+        '<div id="popover-panel"></div><script>var el = '
+        '\'<div id="unsuccessful-sell-popover">\', msg = "Sorry, there are '
+        'no rooms remaining in the group block";</script>'
+    ),
+}
+
+
+class FakeResponse(object):
+    url = 'https://example.com/rooms'
+
+
+class FakeResult(object):
+    response = FakeResponse()
+
+    def __init__(self, raw):
+        self.raw = raw
+
+
+def classify(name, raw):
+    start = datetime.date(2016, 9, 1)
+    end = datetime.date(2016, 9, 5)
+    scraper = SCRAPERS[name](start, end, sessions=object())
+    return scraper.classify(FakeResult(raw))
+
+
+def fixture(name, state):
+    path = os.path.join(FIXTURES, name, '{0}.html'.format(state))
+    with io.open(path, encoding='utf-8') as handle:
+        return handle.read()
+
+
+@pytest.mark.parametrize('name', sorted(SCRAPERS))
+def test_unavailable_pages_are_classified(name):
+    assert classify(name, fixture(name, 'unavailable')) == UNAVAILABLE
+    assert classify(name, CONTENT[(name, 'unavailable')]) == UNAVAILABLE
+
+
+@pytest.mark.parametrize('name', sorted(SCRAPERS))
+def test_available_pages_are_ambiguous(name):
+    assert classify(name, fixture(name, 'available')) == AMBIGUOUS
+
+
+@pytest.mark.parametrize('name', sorted(SCRAPERS))
+def test_sentence_outside_of_the_element_is_ambiguous(name):
+    assert classify(name, DECOYS[name]) == AMBIGUOUS